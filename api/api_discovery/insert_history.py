@@ -1,38 +1,100 @@
 from flask import request, jsonify
 import logging
+import datetime
 import safrs
+from sqlalchemy import event, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
 from database import models
 
-db = safrs.DB 
-session = db.session 
+db = safrs.DB
+session = db.session
 
 app_logger = logging.getLogger("api_logic_server_app")
 
+MEALS = ("breakfast", "lunch", "dinner", "bedtime")
+""" Reading.time_of_reading values, each a ReadingHistory column """
+
+_PENDING = "pending_reading_history"
+""" session.info key: readings committed in this flush, awaiting upsert """
+
+
 def add_service(app, api, project_dir, swagger_host: str, PORT: str, method_decorators = []):
     pass
 
 def insert_reading_history(row: models.Reading, old_row: models.Reading):
-    # Insert a new ReadingHistory record
-    # do a get first to see if it exists (insert/update)
-    try:
-        reading_history = session.query(models.ReadingHistory).filter(models.ReadingHistory.reading_id == row.id).one()
-    except Exception as e:
-        reading_history = None
-        app_logger.error(f"Error querying reading history: {e}")
-
-    if reading_history is None:
-        reading_history = models.ReadingHistory()
-        reading_history.reading_id = row.id
-        reading_history.reading_date = row.reading_date
-    if 'breakfast' == row.time_of_reading:
-        reading_history.breakfast = row.reading_value
-    elif 'lunch' == row.time_of_reading:
-        reading_history.lunch = row.reading_value
-    elif 'dinner' == row.time_of_reading:
-        reading_history.dinner = row.reading_value
-    elif 'bedtime' == row.time_of_reading:
-        reading_history.bedtime = row.reading_value      
-
-    session.add(reading_history)
-    app_logger.info("insert_reading_history")
-    
\ No newline at end of file
+    """
+    Commit event: queue the reading for its day's ReadingHistory.
+
+    All readings queued in a flush are upserted together, in one statement,
+    by the session's after_flush (see upsert_reading_history).
+
+    The upsert is Core SQL, so ReadingHistory row events (recommend_drug) do not fire for it.
+    To run them, update the day's ReadingHistory through the ORM (as /load_csv does).
+    """
+    if row.time_of_reading not in MEALS:
+        return
+    _listen()
+    reading_date = row.reading_date or datetime.date.today()  # server default is now()
+    session.info.setdefault(_PENDING, []).append((row, reading_date))
+    app_logger.debug("insert_reading_history")
+
+
+def upsert_reading_history(readings: list, db_session = None):
+    """
+    INSERT ... ON CONFLICT (patient_id, reading_date) DO UPDATE, for many readings at once
+
+    Readings for the same patient and day are merged into 1 row, and only the meals
+    provided are updated (unique index reading_history_patient_day).
+
+    Args:
+        readings (list): (patient_id, reading_date, time_of_reading, reading_value) tuples
+        db_session: session to execute in (default: safrs.DB.session)
+    """
+    db_session = db_session or session
+    days = {}
+    for patient_id, reading_date, time_of_reading, reading_value in readings:
+        day = (patient_id, reading_day(reading_date))
+        days.setdefault(day, dict.fromkeys(MEALS))[time_of_reading] = reading_value
+    if not days:
+        return
+    table = models.ReadingHistory.__table__
+    dialect_name = db_session.get_bind(models.ReadingHistory).dialect.name
+    dialect_insert = sqlite.insert if dialect_name == "sqlite" else postgresql.insert
+    stmt = dialect_insert(table).values([
+        {"patient_id": patient_id, "reading_date": reading_date, **meals}
+        for (patient_id, reading_date), meals in days.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.patient_id, table.c.reading_date],
+        set_={meal: func.coalesce(stmt.excluded[meal], table.c[meal]) for meal in MEALS},
+    )
+    db_session.execute(stmt)
+
+
+def reading_day(reading_date) -> datetime.date:
+    """ the ReadingHistory day of a reading_date (a datetime, eg, from create_reading, is truncated) """
+    if isinstance(reading_date, datetime.datetime):
+        return reading_date.date()
+    return reading_date
+
+
+def _upsert_pending(a_session: Session, flush_context):
+    pending = a_session.info.pop(_PENDING, None)
+    if pending:
+        upsert_reading_history(
+            [(row.patient_id, reading_date, row.time_of_reading, row.reading_value)
+             for row, reading_date in pending],
+            a_session,
+        )
+
+
+def _discard_pending(a_session: Session):
+    a_session.info.pop(_PENDING, None)
+
+
+def _listen():
+    """ register (once) the session listeners that drain the pending readings """
+    if not event.contains(Session, "after_flush", _upsert_pending):
+        event.listen(Session, "after_flush", _upsert_pending)
+        event.listen(Session, "after_rollback", _discard_pending)
@@ -4,13 +4,57 @@ import safrs
 import datetime
 from database import models
 import pandas as pd
+import csv
+import io
+import json
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
 
 db = safrs.DB
 session = db.session
 
 app_logger = logging.getLogger("api_logic_server_app")
 
+PATIENT_CSV_COLUMNS = {
+    "weight": "Weight (lbs)",
+    "height": "Height (inches)",
+    "hba1c": "HbA1c %",
+    "ckd": "CKD",
+    "breakfast": "Blood sugar before breakfast",
+    "lunch": "Blood sugar before lunch",
+    "dinner": "Blood sugar before dinner",
+    "bedtime": "Blood sugar before bed time",
+    "create_readings": True,
+}
+""" /load_csv column names (e.g., patient.csv) """
+
+TEN_PATIENT_CSV_COLUMNS = {
+    "weight": "Weight",
+    "height": "Height",
+    "hba1c": "A1c",
+    "ckd": None,
+    "breakfast": "FBS bb",
+    "lunch": "FBS bl",
+    "dinner": "FBS bd",
+    "bedtime": "FBS bbd",
+    "create_readings": False,
+}
+""" /load_ten_csv column names (e.g., ten_patients.csv) """
+
+DEFAULT_CHUNK_SIZE = 1000
+""" rows per commit for mode=stream """
+
+DEFAULT_WORKERS = int(os.getenv("APILOGICPROJECT_LOAD_CSV_WORKERS", os.cpu_count() or 1))
+""" processes for mode=parallel """
+
+MEDICATION_COLUMNS = [
+    ("Metformin", 1), ("Glimepiride", 2), ("Tradjenta", 3), ("Glargine", 4),
+    ("Lispro", 5), ("Farxiga", 6), ("Ozempic", 7),
+]
+
 
 def add_service(app, api, project_dir, swagger_host: str, PORT: str, method_decorators):
     pass
@@ -25,13 +69,34 @@ def add_service(app, api, project_dir, swagger_host: str, PORT: str, method_deco
         try:
             session.commit()
         except Exception as e:
-            print(f"Error creating reading: {e}")
+            session.rollback()
+            app_logger.error(f"Error creating reading: {e}")
+
+    def merge_reading_history(patient_id, meals: dict):
+        """
+        Set today's ReadingHistory for the patient through the ORM, so its logic (recommend_drug) runs
+
+        create_reading has usually upserted the row already (see insert_history),
+        so it is updated - a second insert would violate reading_history_patient_day.
+        """
+        today = datetime.date.today()
+        reading_history = session.query(models.ReadingHistory) \
+            .filter_by(patient_id=patient_id, reading_date=today).one_or_none()
+        if reading_history is None:
+            reading_history = models.ReadingHistory(patient_id=patient_id, reading_date=today)
+            session.add(reading_history)
+        for meal, value in meals.items():
+            setattr(reading_history, meal, value)
+        session.commit()
 
     @app.route("/load_ten_csv", methods=["GET"])
     def load_ten_csv():
         """
         Load a CSV file into the database
         curl 'http://localhost:5656/load_ten_csv?csv_file=ten_patients.csv'
+
+        mode=bulk loads all rows in a few multi-row statements (no per-row logic)
+        curl 'http://localhost:5656/load_ten_csv?csv_file=ten_patients.csv&mode=bulk'
         """
         import datetime
 
@@ -43,6 +108,8 @@ def add_service(app, api, project_dir, swagger_host: str, PORT: str, method_deco
             return jsonify({"error": "CSV file not found"}), 404
         
         df = pd.read_csv(csv_file)
+        if request.args.get("mode") == "bulk":
+            return bulk_load_csv(df, TEN_PATIENT_CSV_COLUMNS)
 
         # Iterate over each row in the dataframe
         for index, row in df.iterrows():
@@ -88,17 +155,14 @@ def add_service(app, api, project_dir, swagger_host: str, PORT: str, method_deco
                 #create_reading(patient.id, "dinner", int(row["FBS bd"]))
                 #create_reading(patient.id, "bedtime", int(row["FBS bbd"]))
 
-                reading_history = models.ReadingHistory()
-                reading_history.patient_id = patient.id
-                reading_history.reading_date = datetime.datetime.now()
-                reading_history.breakfast = int(row["FBS bb"])
-                reading_history.lunch = int(row["FBS bl"])
-                reading_history.dinner = int(row["FBS bd"])
-                reading_history.bedtime = int(row["FBS bbd"])
-                session.add(reading_history)
-                session.commit()
+                merge_reading_history(patient.id, {
+                    "breakfast": int(row["FBS bb"]),
+                    "lunch": int(row["FBS bl"]),
+                    "dinner": int(row["FBS bd"]),
+                    "bedtime": int(row["FBS bbd"]),
+                })
             except Exception as e:
-                # session.rollback()
+                session.rollback()
                 app_logger.error(f"Error loading CSV file: {e}")
                 #return jsonify({"error": "Error loading CSV file"}), 500
         session.close()
@@ -110,6 +174,17 @@ def add_service(app, api, project_dir, swagger_host: str, PORT: str, method_deco
         """
         Load a CSV file into the database
         curl 'http://localhost:5656/load_csv?csv_file=patient.csv'
+
+        mode=bulk loads all rows in a few multi-row statements (no per-row logic)
+        curl 'http://localhost:5656/load_csv?csv_file=patient.csv&mode=bulk'
+
+        mode=stream loads in bulk, chunk_size rows per commit, resuming from the last checkpoint
+        (restart=true discards the checkpoint) - see /load_csv_status for progress
+        curl 'http://localhost:5656/load_csv?csv_file=patient.csv&mode=stream&chunk_size=1000'
+
+        mode=parallel converts and loads partitions of the file in a process pool
+        (workers defaults to APILOGICPROJECT_LOAD_CSV_WORKERS, else the cpu count)
+        curl 'http://localhost:5656/load_csv?csv_file=patient.csv&mode=parallel&workers=8'
         """
         import datetime
 
@@ -119,8 +194,24 @@ def add_service(app, api, project_dir, swagger_host: str, PORT: str, method_deco
             return jsonify({"error": "No CSV file specified"}), 400
         if not os.path.exists(csv_file):
             return jsonify({"error": "CSV file not found"}), 404
-        
+
+        if request.args.get("mode") == "parallel":
+            return parallel_load_csv(
+                csv_file,
+                PATIENT_CSV_COLUMNS,
+                database_uri=app.config["SQLALCHEMY_DATABASE_URI"],
+                workers=request.args.get("workers", DEFAULT_WORKERS, type=int),
+            )
+        if request.args.get("mode") == "stream":
+            return stream_load_csv(
+                csv_file,
+                PATIENT_CSV_COLUMNS,
+                chunk_size=request.args.get("chunk_size", DEFAULT_CHUNK_SIZE, type=int),
+                restart=request.args.get("restart", "false").lower() == "true",
+            )
         df = pd.read_csv(csv_file)
+        if request.args.get("mode") == "bulk":
+            return bulk_load_csv(df, PATIENT_CSV_COLUMNS)
 
         # Iterate over each row in the dataframe
         for index, row in df.iterrows():
@@ -166,23 +257,34 @@ def add_service(app, api, project_dir, swagger_host: str, PORT: str, method_deco
                 create_reading(patient.id, "dinner", int(row["Blood sugar before dinner"]))
                 create_reading(patient.id, "bedtime", int(row["Blood sugar before bed time"]))
 
-                reading_history = models.ReadingHistory()
-                reading_history.patient_id = patient.id
-                reading_history.reading_date = datetime.datetime.now()
-                reading_history.breakfast = int(row["Blood sugar before breakfast"])
-                reading_history.lunch = int(row["Blood sugar before lunch"])
-                reading_history.dinner = int(row["Blood sugar before dinner"])
-                reading_history.bedtime = int(row["Blood sugar before bed time"])
-                session.add(reading_history)
-                session.commit()
+                merge_reading_history(patient.id, {
+                    "breakfast": int(row["Blood sugar before breakfast"]),
+                    "lunch": int(row["Blood sugar before lunch"]),
+                    "dinner": int(row["Blood sugar before dinner"]),
+                    "bedtime": int(row["Blood sugar before bed time"]),
+                })
             except Exception as e:
-                # session.rollback()
+                session.rollback()
                 app_logger.error(f"Error loading CSV file: {e}")
                 #return jsonify({"error": "Error loading CSV file"}), 500
         session.close()
         return jsonify({"success": "CSV file loaded"}), 200
 
 
+    @app.route("/load_csv_status", methods=["GET"])
+    def load_csv_status():
+        """
+        Progress of a mode=stream load (from its checkpoint, so visible from any worker)
+        curl 'http://localhost:5656/load_csv_status?csv_file=patient.csv'
+        """
+        csv_file = request.args.get("csv_file")
+        if not csv_file:
+            return jsonify({"error": "No CSV file specified"}), 400
+        checkpoint = read_checkpoint(csv_file)
+        if checkpoint is None:
+            return jsonify({"error": "No load found for CSV file"}), 404
+        return jsonify(checkpoint), 200
+
     def insert_medication(patient_id: int, row: dict,  key:str , drug_id:int):
         if int(row[key]) == 0:
             return
@@ -242,8 +344,366 @@ def add_service(app, api, project_dir, swagger_host: str, PORT: str, method_deco
                 # Commit the session to save the records in the database
                 session.commit()
             except Exception as e:
-                # session.rollback()
+                session.rollback()
                 app_logger.error(f"Error loading CSV file: {e}")
                 return jsonify({"error": "Error loading CSV file"}), 500
+        from api.api_discovery.recommend_drug import reload_insulin_rules
+        reload_insulin_rules()
         session.close()
         return jsonify({"success": "Insulin Rule CSV file loaded"}), 200
+
+
+##############
+# Bulk Loading
+##############
+
+def bulk_load_csv(df: pd.DataFrame, columns: dict):
+    """
+    Load a patient CSV column-wise: one transaction, a few multi-row statements.
+
+    Patients are inserted with RETURNING to obtain their ids; medications, readings
+    and reading history use PostgreSQL COPY when available, else executemany.
+
+    LogicBank row events do not fire (use the default per-row mode for that), so
+    age is computed here, and the age >= 18 constraint is applied as a filter.
+
+    Args:
+        df (pd.DataFrame): csv contents
+        columns (dict): PATIENT_CSV_COLUMNS or TEN_PATIENT_CSV_COLUMNS
+    """
+    try:
+        batch = patient_batch(df, columns)
+        counts = insert_patient_batch(batch)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        app_logger.error(f"Error bulk loading CSV file: {e}")
+        return jsonify({"error": f"Error bulk loading CSV file: {e}"}), 500
+    finally:
+        session.close()
+    return jsonify({"success": "CSV file loaded", **counts}), 200
+
+
+def stream_load_csv(csv_file: str, columns: dict, chunk_size: int = DEFAULT_CHUNK_SIZE, restart: bool = False):
+    """
+    Load a patient CSV in bounded chunks, committing (and checkpointing) each chunk.
+
+    A rerun resumes after the last committed row, provided the file is unchanged;
+    memory use is bounded by chunk_size, not by the file.
+    """
+    checkpoint = None if restart else read_checkpoint(csv_file)
+    file_stat = os.stat(csv_file)
+    if checkpoint is None or checkpoint["status"] == "complete":
+        checkpoint = {
+            "csv_file": csv_file,
+            "file_size": file_stat.st_size,
+            "file_mtime": file_stat.st_mtime,
+            "rows_committed": 0,
+            "last_patient_id": None,
+            "counts": {"patients": 0, "medications": 0, "readings": 0, "reading_history": 0},
+        }
+    elif (checkpoint["file_size"], checkpoint["file_mtime"]) != (file_stat.st_size, file_stat.st_mtime):
+        return jsonify({"error": "CSV file changed since last checkpoint - use restart=true"}), 409
+    checkpoint["status"] = "running"
+    checkpoint["chunk_size"] = chunk_size
+    write_checkpoint(csv_file, checkpoint)
+
+    try:
+        for checkpoint in load_chunks(csv_chunks(csv_file, chunk_size, checkpoint["rows_committed"]),
+                                      columns, checkpoint):
+            write_checkpoint(csv_file, checkpoint)
+            app_logger.info(f"stream load {csv_file}: {checkpoint['rows_committed']} rows committed")
+    except Exception as e:
+        session.rollback()
+        checkpoint["status"] = "failed"
+        checkpoint["error"] = str(e)
+        write_checkpoint(csv_file, checkpoint)
+        app_logger.error(f"Error stream loading CSV file: {e}")
+        return jsonify({**checkpoint, "error": f"Error loading CSV file: {e}"}), 500
+    finally:
+        session.close()
+    checkpoint["status"] = "complete"
+    checkpoint.pop("error", None)
+    write_checkpoint(csv_file, checkpoint)
+    return jsonify({"success": "CSV file loaded", **checkpoint}), 200
+
+
+def csv_chunks(csv_file: str, chunk_size: int, skip_rows: int = 0):
+    """
+    Yield DataFrames of at most chunk_size rows, starting after skip_rows data rows
+    """
+    with pd.read_csv(csv_file, chunksize=chunk_size, skiprows=range(1, skip_rows + 1)) as reader:
+        yield from reader
+
+
+def load_chunks(chunks, columns: dict, checkpoint: dict):
+    """
+    Insert and commit each chunk, yielding the advanced checkpoint after each commit
+    """
+    for chunk in chunks:
+        counts = insert_patient_batch(patient_batch(chunk, columns))
+        session.commit()
+        checkpoint = {
+            **checkpoint,
+            "rows_committed": checkpoint["rows_committed"] + len(chunk),
+            "last_patient_id": _last_patient_id(chunk, checkpoint["last_patient_id"]),
+            "counts": {name: checkpoint["counts"][name] + count for name, count in counts.items()},
+        }
+        yield checkpoint
+
+
+def checkpoint_path(csv_file: str) -> str:
+    return f"{csv_file}.checkpoint.json"
+
+
+def read_checkpoint(csv_file: str):
+    path = checkpoint_path(csv_file)
+    if not os.path.exists(path):
+        return None
+    with open(path) as checkpoint_file:
+        return json.load(checkpoint_file)
+
+
+def write_checkpoint(csv_file: str, checkpoint: dict):
+    """ atomic (write, then rename), so readers never see a partial checkpoint """
+    path = checkpoint_path(csv_file)
+    with open(f"{path}.tmp", "w") as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file, indent=4)
+    os.replace(f"{path}.tmp", path)
+
+
+def _last_patient_id(chunk: pd.DataFrame, previous):
+    patient_ids = chunk["Patient Id"].dropna()
+    return int(patient_ids.iloc[-1]) if len(patient_ids) else previous
+
+
+def patient_batch(df: pd.DataFrame, columns: dict) -> dict:
+    """
+    Convert csv rows into ready-to-insert column batches (patient ids not yet known)
+
+    Returns:
+        dict: patients, medications, readings, reading_history - lists of row dicts;
+              child rows carry "patient_index" (position in patients) instead of patient_id
+    """
+    df = df[df["Patient Id"].notna() & (df["Patient Id"] != 0) & df["Age"].notna()]
+    required = ["Gender", "CAD", "HLD", "Duration", "Creatinine"] + [
+        columns[name] for name in ("weight", "height", "hba1c", "ckd", "breakfast", "lunch", "dinner", "bedtime")
+        if columns[name]
+    ]
+    incomplete = df[required].isna().any(axis=1)
+    if incomplete.any():
+        app_logger.info(f"bulk load: {int(incomplete.sum())} patients skipped (missing values)")
+    df = df[~incomplete]
+    ages = df["Age"].astype(int)
+    minors = int((ages < 18).sum())
+    if minors:
+        app_logger.info(f"bulk load: {minors} patients skipped (Patient must be 18 or older)")
+    df = df[ages >= 18].reset_index(drop=True)
+    ages = df["Age"].astype(int)
+
+    now = datetime.datetime.now()
+    today = now.date()
+    patient_numbers = df["Patient Id"].astype(int)
+    patients = pd.DataFrame({
+        "name": "Patient-" + patient_numbers.astype(str),
+        "medical_record_number": "MRN" + patient_numbers.astype(str),
+        "birth_date": [(now - pd.DateOffset(years=age)).date() for age in ages],
+        "age": ages,
+        "patient_sex": df["Gender"].map(lambda gender: "M" if gender == 1 else "F"),
+        "weight": df[columns["weight"]].astype(int),
+        "height": df[columns["height"]].astype(int),
+        "hba1c": df[columns["hba1c"]].astype(float),
+        "ckd": df[columns["ckd"]].astype(int) if columns["ckd"] else None,
+        "cad": df["CAD"].astype(int),
+        "hld": df["HLD"].astype(int),
+        "duration": df["Duration"].astype(int),
+        "creatine_mg_dl": df["Creatinine"].astype(float),
+    })
+
+    medications = []
+    for key, drug_id in MEDICATION_COLUMNS:
+        dosages = df[key].fillna(0).astype(float).astype(int)  # int(), as insert_medication; blank is none
+        given = dosages != 0
+        medications.append(pd.DataFrame({
+            "patient_index": given[given].index,
+            "drug_id": drug_id,
+            "dosage": dosages[given],
+            "dosage_unit": "mg",
+        }))
+    medications = pd.concat(medications).sort_values("patient_index", kind="stable")
+
+    meals = {meal: df[columns[meal]].astype(int) for meal in ("breakfast", "lunch", "dinner", "bedtime")}
+    readings = []
+    if columns["create_readings"]:
+        for meal, values in meals.items():
+            readings.append(pd.DataFrame({
+                "patient_index": df.index,
+                "reading_date": today,
+                "time_of_reading": meal,
+                "reading_value": values,
+            }))
+        readings = pd.concat(readings).sort_values("patient_index", kind="stable")
+    reading_history = pd.DataFrame({"patient_index": df.index, "reading_date": today, **meals})
+
+    return {
+        "patients": _records(patients),
+        "medications": _records(medications),
+        "readings": _records(readings) if len(readings) else [],
+        "reading_history": _records(reading_history),
+    }
+
+
+def insert_patient_batch(batch: dict, db_session = None) -> dict:
+    """
+    Insert a patient_batch in the session transaction (caller commits)
+
+    Args:
+        batch (dict): from patient_batch
+        db_session: session to insert with (default: safrs.DB.session)
+
+    Returns:
+        dict: row counts per table
+    """
+    db_session = db_session or session
+    if not batch["patients"]:
+        return {"patients": 0, "medications": 0, "readings": 0, "reading_history": 0}
+    patient_ids = db_session.execute(
+        insert(models.Patient).returning(models.Patient.id, sort_by_parameter_order=True),
+        batch["patients"],
+    ).scalars().all()
+    children = (
+        (models.PatientMedication, "medications"),
+        (models.Reading, "readings"),
+        (models.ReadingHistory, "reading_history"),
+    )
+    for model, name in children:
+        for each_row in batch[name]:
+            each_row["patient_id"] = patient_ids[each_row.pop("patient_index")]
+        bulk_insert(model, batch[name], db_session)
+    return {"patients": len(patient_ids), **{name: len(batch[name]) for _, name in children}}
+
+
+def bulk_insert(model, rows: list, db_session = None):
+    """
+    Insert rows (list of column dicts) - COPY on PostgreSQL (psycopg2), otherwise executemany
+    """
+    if not rows:
+        return
+    db_session = db_session or session
+    connection = db_session.connection()
+    if connection.dialect.name == "postgresql":
+        cursor = connection.connection.cursor()
+        if hasattr(cursor, "copy_expert"):
+            column_names = list(rows[0].keys())
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for each_row in rows:
+                writer.writerow([each_row[name] for name in column_names])  # None -> NULL
+            buffer.seek(0)
+            cursor.copy_expert(
+                f"COPY {model.__tablename__} ({', '.join(column_names)}) FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+            return
+    db_session.execute(insert(model), rows)
+
+
+##################
+# Parallel Loading
+##################
+
+def parallel_load_csv(csv_file: str, columns: dict, database_uri: str, workers: int = DEFAULT_WORKERS):
+    """
+    Load a patient CSV with a process pool: the file is split into one byte-range
+    partition per worker, and each worker parses, converts and inserts its partition
+    through its own database connection, committing independently.
+
+    Partitions split on line boundaries, so fields must not contain newlines.
+    """
+    from api.api_discovery import load_csv as loader  # importable functions, for pickling
+
+    partitions = csv_partitions(csv_file, workers)
+    totals = {"patients": 0, "medications": 0, "readings": 0, "reading_history": 0}
+    errors = []
+    with ProcessPoolExecutor(max_workers=len(partitions) or 1, mp_context=_pool_context(),
+                             initializer=loader.init_load_worker, initargs=(database_uri,)) as executor:
+        futures = {executor.submit(loader.load_partition, csv_file, start, end, columns): (start, end)
+                   for start, end in partitions}
+        for future in as_completed(futures):
+            try:
+                counts = future.result()
+            except Exception as e:
+                start, end = futures[future]
+                app_logger.error(f"Error loading CSV partition [{start}:{end}]: {e}")
+                errors.append({"partition": [start, end], "error": str(e)})
+                continue
+            totals = {name: totals[name] + count for name, count in counts.items()}
+    result = {"workers": len(partitions), **totals}
+    if errors:
+        return jsonify({"error": "Error loading CSV partitions", "errors": errors, **result}), 500
+    return jsonify({"success": "CSV file loaded", **result}), 200
+
+
+def csv_partitions(csv_file: str, count: int) -> list:
+    """
+    Split the data rows of csv_file into at most count (start, end) byte ranges, on line boundaries
+    """
+    file_size = os.path.getsize(csv_file)
+    with open(csv_file, "rb") as csv_data:
+        csv_data.readline()  # header
+        data_start = csv_data.tell()
+        bounds = [data_start]
+        for i in range(1, count):
+            csv_data.seek(data_start + (file_size - data_start) * i // count)
+            csv_data.readline()
+            bounds.append(max(csv_data.tell(), bounds[-1]))
+    bounds.append(file_size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+
+
+def read_partition(csv_file: str, start: int, end: int) -> pd.DataFrame:
+    with open(csv_file, "rb") as csv_data:
+        header = csv_data.readline()
+        csv_data.seek(start)
+        data = csv_data.read(end - start)
+    return pd.read_csv(io.BytesIO(header + data))
+
+
+_worker_engine = None
+""" per-process engine of a load worker (see init_load_worker) """
+
+
+def init_load_worker(database_uri: str):
+    global _worker_engine
+    _worker_engine = create_engine(database_uri, pool_size=1, max_overflow=0)
+
+
+def load_partition(csv_file: str, start: int, end: int, columns: dict) -> dict:
+    """
+    Worker: parse, convert and insert one partition, in one transaction
+    """
+    batch = patient_batch(read_partition(csv_file, start, end), columns)
+    with Session(_worker_engine) as worker_session:
+        counts = insert_patient_batch(batch, worker_session)
+        worker_session.commit()
+    return counts
+
+
+def _pool_context():
+    """
+    forkserver where available, else spawn - never fork the live server (its db pool, threads and locks).
+
+    Workers start in a clean interpreter and import this module for init_load_worker/load_partition;
+    the main module is re-imported as __mp_main__, so the server start must stay under __name__ == "__main__".
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["api.api_discovery.load_csv"])  # not __name__ - discovery loads this as module.name
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def _records(frame: pd.DataFrame) -> list:
+    """ DataFrame -> list of dicts with native python values (NaN -> None) """
+    frame = frame.astype(object).where(frame.notna(), None)
+    return frame.to_dict(orient="records")
@@ -6,7 +6,7 @@ import yaml
 from pathlib import Path
 from flask_cors import cross_origin
 import safrs
-from flask import request, jsonify
+from flask import request, jsonify, send_file
 from flask_jwt_extended import get_jwt, jwt_required, verify_jwt_in_request
 from safrs import jsonapi_rpc
 from database import models
@@ -21,10 +21,12 @@ from config.config import Args
 from config.config import Config
 import os
 from pathlib import Path
-from api.system.expression_parser import parsePayload
+from api.system.expression_parser import parsePayload, where_clause
 from api.system.gen_pdf_report import gen_report
 from api.system.gen_csv_report import gen_report as csv_gen_report
-from api.system.gen_pdf_report import export_pdf
+from api.system.gen_pdf_report import export_pdf, report_status, report_path
+import api.system.model_registry as model_registry
+import api.system.aggregate as aggregate_service
 #from api.gen_xlsx_report import xlsx_gen_report
 
 # This is the Ontimize Bridge API - all endpoints will be prefixed with /ontimizeweb/services/rest
@@ -57,6 +59,7 @@ def add_service(app, api, project_dir, swagger_host: str, PORT: str, method_deco
     """
     _project_dir = project_dir
     app_logger.debug("api/api_discovery/ontimize_api.py - services for ontimize") 
+    model_registry.build()  # resource metadata, once - not per request
 
     
     def admin_required():
@@ -85,8 +88,7 @@ def add_service(app, api, project_dir, swagger_host: str, PORT: str, method_deco
             return jsonify({})
         resource = find_model(entity)
         api_clz = resource["model"]
-        resources = getMetaData(api_clz.__name__)
-        attributes = resources["resources"][api_clz.__name__]["attributes"]
+        attributes = resource["attributes"]
         if type in ["csv",'CSV']:
             return csv_gen_report(api_clz, request, entity, queryParm, columns, columnTitles, attributes) 
         elif type == "pdf": 
@@ -107,8 +109,7 @@ def add_service(app, api, project_dir, swagger_host: str, PORT: str, method_deco
         entity = payload["entity"]
         resource = find_model(entity)
         api_clz = resource["model"]
-        resources = getMetaData(api_clz.__name__)
-        attributes = resources["resources"][api_clz.__name__]["attributes"]
+        attributes = resource["attributes"]
     
         return gen_report(api_clz, request, _project_dir, payload, attributes)
     @app.route("/api/export/csv", methods=['POST','OPTIONS'])
@@ -132,6 +133,29 @@ def add_service(app, api, project_dir, swagger_host: str, PORT: str, method_deco
             return jsonify(success=True)
         return _gen_report(request)
     
+    @app.route("/api/report/<key>", methods=['GET','OPTIONS'])
+    @app.route("/ontimizeweb/services/rest/report/<key>", methods=['GET','OPTIONS'])
+    @cross_origin()
+    @admin_required()
+    def report(key):
+        ''' poll a pdf report handle (from dynamicjasper / export pdf) '''
+        if request.method == "OPTIONS":
+            return jsonify(success=True)
+        return jsonify({"code":0,"data":[report_status(key)],"message": None})
+
+    @app.route("/api/report/<key>/pdf", methods=['GET','OPTIONS'])
+    @app.route("/ontimizeweb/services/rest/report/<key>/pdf", methods=['GET','OPTIONS'])
+    @cross_origin()
+    @admin_required()
+    def report_pdf(key):
+        ''' download a rendered pdf report as application/pdf '''
+        if request.method == "OPTIONS":
+            return jsonify(success=True)
+        path = report_path(key)
+        if path is None:
+            return jsonify({"code":1,"data":[report_status(key)],"message": f"Report {key} is not available"}), 404
+        return send_file(path, mimetype="application/pdf", download_name=f"{key}.pdf")
+
     @app.route("/api/bundle", methods=['POST','OPTIONS'])
     @app.route("/ontimizeweb/services/rest/bundle", methods=['POST','OPTIONS'])
     @cross_origin()
@@ -187,12 +211,12 @@ def add_service(app, api, project_dir, swagger_host: str, PORT: str, method_deco
         payload = '{}' if request.data == b'' else json.loads(request.data)
         expressions, filter, columns, sqltypes, offset, pagesize, orderBy, data = parsePayload(api_clz, payload)
         result = {}
+        pagesize = min(int(pagesize), Config.ONTIMIZE_MAX_PAGE_SIZE)
         if method == 'GET':
-            pagesize = 999 #if isSearch else pagesize
             return get_rows(request, api_clz, filter, orderBy, columns, pagesize, offset)
         
         if method in ['PUT','PATCH']:
-            sql_alchemy_row = session.query(api_clz).filter(text(filter)).one()
+            sql_alchemy_row = session.query(api_clz).filter(where_clause(filter)).one()
             for key in DotDict(data):
                 setattr(sql_alchemy_row, key , DotDict(data)[key])
             session.add(sql_alchemy_row)
@@ -201,7 +225,7 @@ def add_service(app, api, project_dir, swagger_host: str, PORT: str, method_deco
             
         if method == 'DELETE':
             #stmt = delete(api_clz).where(text(filter))
-            sql_alchemy_row = session.query(api_clz).filter(text(filter)).one()
+            sql_alchemy_row = session.query(api_clz).filter(where_clause(filter)).one()
             session.delete(sql_alchemy_row)
             result = sql_alchemy_row
             
@@ -225,9 +249,9 @@ def add_service(app, api, project_dir, swagger_host: str, PORT: str, method_deco
                 #GET (sent as POST)
                 #rows = get_rows_by_query(api_clz, filter, orderBy, columns, pagesize, offset)
                 if "TypeAggregate" in clz_type:
-                    return get_rows_agg(request, api_clz, clz_type, filter, columns)
+                    aggregates = payload.get("aggregates") if isinstance(payload, dict) else None
+                    return get_rows_agg(request, api_clz, clz_type, filter, columns, aggregates)
                 else:
-                    pagesize = 999 # if isSearch else pagesize
                     return get_rows(request, api_clz, None, orderBy, columns, pagesize, offset)
         try:        
             session.commit()
@@ -267,12 +291,10 @@ def add_service(app, api, project_dir, swagger_host: str, PORT: str, method_deco
             value = bool(value)
         return value
     def find_model(clz_name:str) -> any:
-        clz_members = getMetaData()
-        resources = clz_members.get("resources")
-        for resource in resources:
-            if resource == clz_name:
-                return resources[resource]
-        return None
+        resource = model_registry.get_resource(clz_name)
+        if resource is None:
+            return None
+        return {"attributes": resource.attributes, "model": resource.model}
     
     def login(request):
         url = f"{request.scheme}://{request.host}/api/auth/login"
@@ -308,92 +330,23 @@ def add_service(app, api, project_dir, swagger_host: str, PORT: str, method_deco
         #return jsonify(access_token=access_token)
         return jsonify({"code":0,"message":"Login Successful","data":{"access_token":access_token}})
     
-    def get_rows_agg(request: any, api_clz, agg_type, filter, columns):
-        key = api_clz.__name__
-        resources = getMetaData(key)
-        attributes = resources["resources"][key]["attributes"]
-        list_of_columns = ""
-        sep = ""
-        attr_list = list(api_clz._s_columns)
-        table_name = api_clz._s_type
-        #api_clz.__mapper__.attrs #TODO map the columns to the attributes to build the select list
-        for a in attributes:
-            name = a["name"]
-            t = a["type"] #INTEGER or VARCHAR(N)
-            #list_of_columns.append(api_clz._sa_class_manager.get(n))
-            attr = a["attr"]
-            #MAY need to do upper case compares
-            if name in columns:
-                list_of_columns = f'{list_of_columns}{sep}{name}'
-                sep = ","
-        sql = f' count(*), {list_of_columns} from {table_name} group by {list_of_columns}'
-        print(sql)
-        # TODO HARDCODED for now....
-        data = {}
-        if "customerTypeAggregate" == agg_type:
-            data = {"data": [
-                {
-                    "AMOUNT": 24,
-                    "DESCRIPTION": "Normal"
-                },
-                {
-                    "AMOUNT": 15,
-                    "DESCRIPTION": "VIP"
-                },
-                {
-                    "AMOUNT": 36,
-                    "DESCRIPTION": "Other"
-                }
-            ]
-            }
-        elif "accountTypeAggregate" == agg_type:
-            data = {"data": [
-                {
-                    "AMOUNT": 32,
-                    "ACCOUNTTYPENAME": "Savings",
-                    "ACCOUNTTYPEID": 1
-                },
-                {
-                    "AMOUNT": 36,
-                    "ACCOUNTTYPENAME": "Checking",
-                    "ACCOUNTTYPEID": 0
-                },
-                {
-                    "AMOUNT": 30,
-                    "ACCOUNTTYPENAME": "Payroll",
-                    "ACCOUNTTYPEID": 3
-                },
-                {
-                    "AMOUNT": 23,
-                    "ACCOUNTTYPENAME": "Market",
-                    "ACCOUNTTYPEID": 2
-                }
-            ]
-            }
-        elif "employeeTypeAggregate" == agg_type:
-            data = {"data": [
-                {
-                    "AMOUNT": 27,
-                    "EMPLOYEETYPENAME": "Manager"
-                },
-                {
-                    "AMOUNT": 485,
-                    "EMPLOYEETYPENAME": "Employee"
-                }
-            ]
-            }
-        data["code"] = 0
-        data["message"] = ""
-        data["sqlType"] = {}
-        #rows = session.query(text(sql)).all()
-        #rows = session.query(models.Account.ACCOUNTTYPEID,func.count(models.Account.AccountID)).group_by(models.Account.ACCOUNTTYPEID).all()
-        return data
+    def get_rows_agg(request: any, api_clz, agg_type, filter, columns, aggregates: list = None):
+        """
+        <entity>TypeAggregate - group by the requested attribute columns (default aggregate: count(*) as AMOUNT)
+
+        payload: {"columns": ["drug_id", "recommendation_date"], "filter": {...},
+                  "aggregates": [{"function": "sum", "column": "dosage", "alias": "TOTAL"}]}
+        """
+        try:
+            rows = aggregate_service.aggregate(api_clz.__name__, columns, aggregates, filter)
+        except ValueError as ex:
+            return {"code": 1, "message": f"{agg_type}: {ex}", "data": [], "sqlType": {}}
+        return {"code": 0, "message": "", "data": rows, "sqlType": {}}
     
     def get_rows(request: any, api_clz, filter: str, order_by: str, columns: list, pagesize: int, offset: int):
         # New Style
         key = api_clz.__name__.lower()
-        resources = getMetaData(api_clz.__name__)
-        attributes = resources["resources"][api_clz.__name__]["attributes"]
+        attributes = model_registry.get_resource(api_clz.__name__).attributes
         list_of_columns = []
         for a in attributes:
             name = a["name"]
@@ -409,7 +362,8 @@ def add_service(app, api, project_dir, swagger_host: str, PORT: str, method_deco
                 
         from api.system.custom_endpoint import CustomEndpoint
         request.method = 'GET'
-        r = CustomEndpoint(model_class=api_clz, fields=list_of_columns, filter_by=filter, pagesize=pagesize, offset=offset)
+        r = CustomEndpoint(model_class=api_clz, fields=list_of_columns, filter_by=filter, pagesize=pagesize, offset=offset
+                           , count=Config.ONTIMIZE_COUNT)
         result = r.execute(request=request)
         service_type: str = Config.ONTIMIZE_SERVICE_TYPE
         return r.transform(service_type, key, result) # JSONAPI or LAC or OntimizeEE ARGS.service_type
@@ -427,7 +381,7 @@ def add_service(app, api, project_dir, swagger_host: str, PORT: str, method_deco
             results = results.order_by(text(parseOrderBy(orderBy)))
 
         if filter:
-            results = results.filter(text(filter)) 
+            results = results.filter(where_clause(filter)) 
             
         results = results.limit(pagesize) \
             .offset(offset) 
@@ -485,39 +439,5 @@ def add_service(app, api, project_dir, swagger_host: str, PORT: str, method_deco
         return rows
 
 def getMetaData(resource_name:str = None, include_attributes: bool = True) -> dict:
-        import inspect
-        import sys
-        resource_list = []  # array of attributes[], name (so, the name is last...)
-        resource_objs = {}  # objects, named = resource_name
-
-        models_name = "database.models"
-        cls_members = inspect.getmembers(sys.modules["database.models"], inspect.isclass)
-        for each_cls_member in cls_members:
-            each_class_def_str = str(each_cls_member)
-            if (f"'{models_name}." in each_class_def_str and
-                            "Ab" not in each_class_def_str):
-                each_resource_name = each_cls_member[0]
-                each_resource_class = each_cls_member[1]
-                each_resource_mapper = each_resource_class.__mapper__
-                if resource_name is None or resource_name == each_resource_name:
-                    resource_object = {"name": each_resource_name}
-                    resource_list.append(resource_object)
-                    resource_objs[each_resource_name] = {}
-                    if include_attributes:
-                        attr_list = []
-                        for each_attr in each_resource_mapper.attrs:
-                            if not each_attr._is_relationship:
-                                try:
-                                    attribute_object = {"name": each_attr.key,
-                                                        "attr": each_attr,
-                                                        "type": str(each_attr.expression.type)}
-                                except Exception as ex:
-                                    attribute_object = {"name": each_attr.key,
-                                                        "exception": f"{ex}"}
-                                attr_list.append(attribute_object)
-                        resource_object["attributes"] = attr_list
-                        resource_objs[each_resource_name] = {"attributes": attr_list, "model": each_resource_class}
-        # pick the format you like
-        #return_result = {"resources": resource_list}
-        return_result = {"resources": resource_objs}
-        return return_result
\ No newline at end of file
+        """ {"resources": {name: {"attributes", "model"}}} - from the model registry (no reflection) """
+        return model_registry.get_metadata(resource_name, include_attributes)
@@ -0,0 +1,298 @@
+from functools import wraps
+from flask import request, jsonify
+from flask_jwt_extended import verify_jwt_in_request
+import logging
+import math
+from fractions import Fraction
+import safrs
+import numpy as np
+import pandas as pd
+from sqlalchemy import exists, insert, select
+from database import models
+
+db = safrs.DB
+session = db.session
+
+app_logger = logging.getLogger("api_logic_server_app")
+
+SCALE = 10_000
+""" Numeric(10, 4) columns are compared as integers scaled by SCALE, so results match Decimal comparisons """
+
+OZEMPIC_DRUG_ID = 7
+
+FRAME_COLUMNS = [
+    "reading_history_id", "patient_id", "reading_date",
+    "breakfast", "lunch", "dinner", "bedtime",
+    "creatine_mg_dl", "weight", "hba1c", "on_ozempic",
+]
+""" columnar input for recommend_batch - one row per ReadingHistory """
+
+RECOMMENDATION_COLUMNS = [
+    "row", "reading_history_id", "patient_id", "time_of_reading",
+    "drug_id", "dosage", "dosage_unit", "recommendation_date",
+]
+
+
+def add_service(app, api, project_dir, swagger_host: str, PORT: str, method_decorators = []):
+    pass
+
+    def admin_required():
+        """
+        Support option to bypass security (see ontimize_api.py)
+        """
+        def wrapper(fn):
+            @wraps(fn)
+            def decorator(*args, **kwargs):
+                from config.config import Args
+                if Args.instance.security_enabled == False:
+                    return fn(*args, **kwargs)
+                verify_jwt_in_request(True)  # must be issued if security enabled
+                return fn(*args, **kwargs)
+            return decorator
+        return wrapper
+
+    @app.route("/recommend_batch", methods=["GET", "POST"])
+    @admin_required()
+    def recommend_batch_endpoint():
+        """
+        Score every ReadingHistory (optionally for given patients / reading date) in one pass
+
+        curl 'http://localhost:5656/recommend_batch?patient_id=1&patient_id=2'
+        curl 'http://localhost:5656/recommend_batch?reading_date=2025-03-16&persist=true'
+        """
+        payload = (request.get_json(silent=True) or {}) if request.method == "POST" else {}
+        patient_ids = payload.get("patient_ids") or request.args.getlist("patient_id", type=int)
+        reading_date = payload.get("reading_date") or request.args.get("reading_date")
+        persist = str(payload.get("persist") or request.args.get("persist", "false")).lower() == "true"
+
+        frame = reading_history_frame(patient_ids=patient_ids, reading_date=reading_date)
+        recommendations = recommend_batch(frame)
+        if persist and len(recommendations):
+            save_recommendations(recommendations)
+        records = recommendations.drop(columns=["row"]).to_dict(orient="records")
+        for each_record in records:
+            each_record["recommendation_date"] = str(each_record["recommendation_date"])
+        return jsonify({"readings": len(frame), "recommendations": records, "persisted": persist}), 200
+
+
+def reading_history_frame(patient_ids: list = None, reading_date: str = None) -> pd.DataFrame:
+    """
+    Columnar frame of ReadingHistory joined to its Patient, as consumed by recommend_batch
+    """
+    on_ozempic = (
+        exists()
+        .where(models.PatientMedication.patient_id == models.Patient.id)
+        .where(models.PatientMedication.drug_id == OZEMPIC_DRUG_ID)
+    )
+    stmt = (
+        select(
+            models.ReadingHistory.id, models.ReadingHistory.patient_id, models.ReadingHistory.reading_date,
+            models.ReadingHistory.breakfast, models.ReadingHistory.lunch,
+            models.ReadingHistory.dinner, models.ReadingHistory.bedtime,
+            models.Patient.creatine_mg_dl, models.Patient.weight, models.Patient.hba1c,
+            on_ozempic.label("on_ozempic"),
+        )
+        .join(models.Patient, models.Patient.id == models.ReadingHistory.patient_id)
+        .order_by(models.ReadingHistory.id)
+    )
+    if patient_ids:
+        stmt = stmt.where(models.ReadingHistory.patient_id.in_(patient_ids))
+    if reading_date:
+        stmt = stmt.where(models.ReadingHistory.reading_date == reading_date)
+    rows = session.execute(stmt).all()
+    return pd.DataFrame.from_records(rows, columns=FRAME_COLUMNS)
+
+
+def save_recommendations(recommendations: pd.DataFrame):
+    """
+    Insert recommend_batch output with a single executemany (like create_recommendation, no logic fires)
+    """
+    records = recommendations[[
+        "patient_id", "time_of_reading", "drug_id", "dosage", "dosage_unit", "recommendation_date",
+    ]].to_dict(orient="records")
+    session.execute(insert(models.Recommendation), records)
+    session.commit()
+
+
+def recommend_batch(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Vectorized recommend_drug over a whole cohort.
+
+    Emits the same recommendations, in the same order, as calling recommend_drug
+    for each row of frame (see FRAME_COLUMNS).  Missing values (None) are evaluated
+    as recommend_drug does - short-circuit, so a None compared only when it is reached:
+    a row where recommend_drug would raise yields just the recommendations emitted before the raise.
+
+    Returns:
+        pd.DataFrame: RECOMMENDATION_COLUMNS, "row" being the position in frame
+    """
+    from api.api_discovery.recommend_drug import insulin_rule_index
+
+    if len(frame) == 0:
+        return pd.DataFrame(columns=RECOMMENDATION_COLUMNS)
+    index = insulin_rule_index()
+
+    breakfast = _scaled(frame["breakfast"])
+    lunch = _scaled(frame["lunch"])
+    dinner = _scaled(frame["dinner"])
+    bedtime = _scaled(frame["bedtime"])
+    creatine = _scaled(frame["creatine_mg_dl"])
+    weight = _scaled(frame["weight"])
+    hba1c = _scaled(frame["hba1c"])
+    on_ozempic = frame["on_ozempic"].fillna(False).to_numpy(dtype=bool)
+    no_breakfast, no_bedtime = np.isnan(breakfast), np.isnan(bedtime)
+    no_creatine, no_weight, no_hba1c = np.isnan(creatine), np.isnan(weight), np.isnan(hba1c)
+
+    # int(row.breakfast) in [lo, hi]  <=>  lo <= breakfast < hi + 1  (readings are positive)
+    breakfast_80_400 = (no_breakfast, _at_least(breakfast, 80) & _below(breakfast, 401))
+    breakfast_100_600 = (no_breakfast, _at_least(breakfast, 100) & _below(breakfast, 601))
+    weight_100_400 = (no_weight, _at_least(weight, 100) & _at_most(weight, 400))
+    hba1c_6_5_14 = (no_hba1c, _at_least(hba1c, 6.5) & _at_most(hba1c, 14))
+
+    # each rule, in recommend_drug order: rows that raise emit nothing further
+    alive = np.ones(len(frame), dtype=bool)
+    metformin, raises = _all(breakfast_80_400, (no_creatine, _at_most(creatine, 1.0)),
+                             weight_100_400, hba1c_6_5_14)
+    alive &= ~raises
+    tradjenta, raises = _all(breakfast_80_400, (no_creatine, _above(creatine, 1.0)),
+                             weight_100_400, hba1c_6_5_14)
+    tradjenta &= alive & ~on_ozempic
+    alive &= ~raises
+    ozempic, raises = _all(breakfast_100_600, (no_creatine, _at_least(creatine, 1) & _at_most(creatine, 6)),
+                           (no_weight, _above(weight, 180)), hba1c_6_5_14)
+    ozempic &= alive
+    alive &= ~raises
+    farxiga, raises = _all((no_creatine, _at_least(creatine, 1.1) & _at_most(creatine, 2)))
+    farxiga &= alive
+    alive &= ~raises
+
+    no_lispro, raises = _all((no_creatine, _at_least(creatine, 1)), (no_hba1c, _at_most(hba1c, 9)))
+    alive &= ~raises
+    lispro_gate = alive & ~no_lispro
+    lispro_breakfast = _lookup(index, breakfast, "Before_Breakfast", "lispro_before_breakfast")
+    lispro_lunch = _lookup(index, lunch, "Before_Lunch", "lispro_before_lunch")
+    lispro_dinner = _lookup(index, dinner, "Before_Dinner", "lispro_before_dinner")
+    given_breakfast = lispro_gate & _truthy(lispro_breakfast)
+    given_lunch = lispro_gate & ~given_breakfast & _truthy(lispro_lunch)
+    given_dinner = lispro_gate & ~given_breakfast & ~given_lunch & _truthy(lispro_dinner)
+    # recommend_drug does not mark lunch lispro as given, so glimepiride still follows it
+    # (same conditions as metformin - rows where those raise stopped there)
+    glimepiride = lispro_gate & ~(given_breakfast | given_dinner) & metformin
+
+    glargine = _lookup(index, _round_half_even(bedtime), "Before_Breakfast", "glargine_before_dinner")
+    given_glargine = alive & ~no_bedtime & _truthy(glargine)  # round(None) raises
+    skipped = ~alive | no_bedtime
+    if skipped.any():
+        app_logger.info(f"recommend_batch: {int(skipped.sum())} readings stop early (missing values)")
+
+    # (mask, drug_id, time_of_reading, dosage) in recommend_drug emission order
+    emitted = [
+        (metformin, 1, "breakfast", 1000),
+        (metformin, 1, "dinner", 1000),
+        (tradjenta, 3, "breakfast", 5),
+        (ozempic, 7, "breakfast", 1),
+        (farxiga, 6, "breakfast", 10),
+        (given_breakfast, 5, "breakfast", lispro_breakfast),
+        (given_lunch, 5, "lunch", lispro_lunch),
+        (given_dinner, 5, "dinner", lispro_dinner),
+        (glimepiride, 2, "breakfast", 2),
+        (given_glargine, 4, "bedtime", glargine),
+    ]
+    parts = []
+    for seq, (mask, drug_id, time_of_reading, dosage) in enumerate(emitted):
+        rows = np.flatnonzero(mask)
+        if len(rows) == 0:
+            continue
+        dosages = dosage[rows] if isinstance(dosage, np.ndarray) else np.full(len(rows), dosage)
+        parts.append(pd.DataFrame({
+            "row": rows,
+            "seq": seq,
+            "drug_id": drug_id,
+            "time_of_reading": time_of_reading,
+            "dosage": dosages.astype("int64"),
+        }))
+    if not parts:
+        return pd.DataFrame(columns=RECOMMENDATION_COLUMNS)
+    result = pd.concat(parts, ignore_index=True).sort_values(["row", "seq"], kind="stable")
+    source = frame.iloc[result["row"].to_numpy()]
+    result["reading_history_id"] = source["reading_history_id"].to_numpy()
+    result["patient_id"] = source["patient_id"].to_numpy()
+    result["recommendation_date"] = source["reading_date"].to_numpy()
+    result["dosage_unit"] = "mg"
+    return result[RECOMMENDATION_COLUMNS].reset_index(drop=True)
+
+
+def _all(*terms) -> tuple:
+    """
+    Python's "a and b and ..." over arrays of (missing, condition) terms
+
+    Like recommend_drug, a term is only evaluated if the ones before it are true,
+    and a missing (None) value raises TypeError when evaluated.
+
+    Returns:
+        tuple: (result, raises) boolean arrays
+    """
+    reached = np.ones(len(terms[0][0]), dtype=bool)
+    raises = np.zeros(len(terms[0][0]), dtype=bool)
+    for missing, condition in terms:
+        raises |= reached & missing
+        reached &= ~missing & condition
+    return reached, raises
+
+
+def _scaled(column: pd.Series) -> np.ndarray:
+    """ values * SCALE as integral float64 (NaN when missing) - exact for Numeric(10, 4) """
+    return np.rint(pd.to_numeric(column, errors="coerce").to_numpy(dtype="float64") * SCALE)
+
+
+def _at_least(values: np.ndarray, threshold) -> np.ndarray:
+    """ threshold <= value, compared exactly as Python compares Decimal to float """
+    return values >= math.ceil(Fraction(threshold) * SCALE)
+
+
+def _at_most(values: np.ndarray, threshold) -> np.ndarray:
+    return values <= math.floor(Fraction(threshold) * SCALE)
+
+
+def _above(values: np.ndarray, threshold) -> np.ndarray:
+    return values > math.floor(Fraction(threshold) * SCALE)
+
+
+def _below(values: np.ndarray, threshold) -> np.ndarray:
+    return values < math.ceil(Fraction(threshold) * SCALE)
+
+
+def _truthy(dosages: np.ndarray) -> np.ndarray:
+    """ matches 'if dosage:' - found, and non-zero """
+    return ~np.isnan(dosages) & (dosages != 0)
+
+
+def _round_half_even(values: np.ndarray) -> np.ndarray:
+    """ round(Decimal) of scaled values, returned scaled """
+    whole = np.floor_divide(values, SCALE)
+    fraction = values - whole * SCALE
+    up = (fraction > SCALE / 2) | ((fraction == SCALE / 2) & (np.mod(whole, 2) == 1))
+    return (whole + up) * SCALE
+
+
+def _lookup(index, readings: np.ndarray, blood_sugar_reading: str, dosage_column: str) -> np.ndarray:
+    """
+    searchsorted join of scaled readings against the insulin rule index (see InsulinRuleIndex.lookup)
+
+    Returns:
+        np.ndarray: dosage per reading, NaN where no rule matches
+    """
+    from api.api_discovery.recommend_drug import READING_WINDOW
+
+    result = np.full(len(readings), np.nan)
+    intervals = index.intervals(blood_sugar_reading, dosage_column)
+    if intervals is None:
+        return result
+    levels = np.asarray(intervals.levels, dtype="float64") * SCALE
+    dosages = np.asarray(intervals.dosages, dtype="float64")
+    position = np.searchsorted(levels, readings, side="left")  # NaN readings sort past the end
+    found = position < len(levels)
+    position = np.minimum(position, len(levels) - 1)
+    found &= levels[position] <= readings + READING_WINDOW * SCALE
+    result[found] = dosages[position[found]]
+    return result
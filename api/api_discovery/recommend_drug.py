@@ -1,5 +1,8 @@
 from flask import request, jsonify
 import logging
+import threading
+from bisect import bisect_left
+from typing import Dict, NamedTuple, Optional, Tuple
 import safrs
 from database import models
 from logic_bank.exec_row_logic.logic_row import LogicRow
@@ -226,27 +229,14 @@ def _glargine(reading_value: any, time_of_reading: str) -> str:
     Glargine (Only given Before Bedtime):
     Refer to Insulin dosage rule spreadsheet
     """
-    reading = reading_value
-    insulin = (
-        session.query(models.InsulinRule)
-        .filter(
-            models.InsulinRule.blood_sugar_reading == "Before_Breakfast"
-            and models.InsulinRule.blood_sugar_level <= reading + 10
-            and models.InsulinRule.blood_sugar_level >= reading
-        )
-        .order_by(models.InsulinRule.blood_sugar_level)
-        .all()
+    if time_of_reading != "bedtime":
+        return None
+    dosage = insulin_rule_index().lookup(
+        "Before_Breakfast", "glargine_before_dinner", reading_value
     )
-    for insulin_reading in insulin:
-        if (
-            insulin_reading.glargine_before_dinner is not None
-            and time_of_reading == "bedtime"
-            and insulin_reading.blood_sugar_level <= reading + 10
-        ):
-            print(f"Glargine before dinner: {insulin_reading.glargine_before_dinner}")
-            return insulin_reading.glargine_before_dinner
-
-    return None
+    if dosage is not None:
+        app_logger.debug(f"Glargine before dinner: {dosage}")
+    return dosage
 
 
 def lispro(row: models.Reading, blood_sugar_reading: str) -> str:
@@ -259,44 +249,110 @@ def _lispro(reading_value, time_of_reading, blood_sugar_reading: str) -> str:
     Refer to Insulin dosage rule spreadsheet
 
     """
-    reading = reading_value
-    insulin = (
-        session.query(models.InsulinRule)
-        .filter(
-            models.InsulinRule.blood_sugar_reading == blood_sugar_reading
-            and models.InsulinRule.blood_sugar_level >= reading
-            and models.InsulinRule.blood_sugar_level <= reading + 10
-        )
-        .order_by(models.InsulinRule.blood_sugar_level)
-        .all()
-    )
-    if time_of_reading == "breakfast":
-        for insulin_reading in insulin:
-            if (
-                insulin_reading.lispro_before_breakfast is not None
-                and insulin_reading.blood_sugar_level <= reading + 10
-            ):
-                print(
-                    f"Lispro before breakfast: {insulin_reading.lispro_before_breakfast}"
-                )
-                return insulin_reading.lispro_before_breakfast
-
-    elif time_of_reading == "lunch":
-        for insulin_reading in insulin:
-            if (
-                insulin_reading.lispro_before_lunch is not None
-                and insulin_reading.blood_sugar_level <= reading + 10
-            ):
-                print(f"Lispro before lunch: {insulin_reading.lispro_before_lunch}")
-                return insulin_reading.lispro_before_lunch
-
-    elif time_of_reading == "dinner":
-        for insulin_reading in insulin:
-            if (
-                insulin_reading.lispro_before_dinner is not None
-                and insulin_reading.blood_sugar_level <= reading + 10
-            ):
-                print(f"Lispro before dinner: {insulin_reading.lispro_before_dinner}")
-                return insulin_reading.lispro_before_dinner
+    dosage_column = _LISPRO_COLUMNS.get(time_of_reading)
+    if dosage_column is None:
+        return None
+    dosage = insulin_rule_index().lookup(blood_sugar_reading, dosage_column, reading_value)
+    if dosage is not None:
+        app_logger.debug(f"Lispro before {time_of_reading}: {dosage}")
+    return dosage
 
-    return None
+
+#####################
+# Insulin Rule Index
+#####################
+
+_LISPRO_COLUMNS = {
+    "breakfast": "lispro_before_breakfast",
+    "lunch": "lispro_before_lunch",
+    "dinner": "lispro_before_dinner",
+}
+
+_DOSAGE_COLUMNS = ("glargine_before_dinner",) + tuple(_LISPRO_COLUMNS.values())
+
+READING_WINDOW = 10
+""" a rule matches a reading when reading <= blood_sugar_level <= reading + READING_WINDOW """
+
+
+class _DosageIntervals(NamedTuple):
+    levels: Tuple[int, ...]
+    dosages: Tuple[int, ...]
+
+
+class InsulinRuleIndex:
+    """
+    Immutable, in-memory interval index over insulin_rules.
+
+    Keyed by (blood_sugar_reading, dosage column), each entry holds the sorted
+    blood_sugar_level breakpoints of the rules that define that dosage,
+    so a lookup is a bisect - no database access on the recommendation path.
+    """
+
+    __slots__ = ("_intervals", "rule_count")
+
+    def __init__(self, rules):
+        breakpoints: Dict[Tuple[str, str], list] = {}
+        rule_count = 0
+        for each_rule in sorted(rules, key=lambda r: (r.blood_sugar_level, r.id or 0)):
+            rule_count += 1
+            for each_column in _DOSAGE_COLUMNS:
+                dosage = getattr(each_rule, each_column)
+                if dosage is not None:
+                    breakpoints.setdefault((each_rule.blood_sugar_reading, each_column), []).append(
+                        (each_rule.blood_sugar_level, dosage)
+                    )
+        self._intervals = {
+            key: _DosageIntervals(tuple(l for l, _ in pairs), tuple(d for _, d in pairs))
+            for key, pairs in breakpoints.items()
+        }
+        self.rule_count = rule_count
+
+    def intervals(self, blood_sugar_reading: str, dosage_column: str) -> Optional[_DosageIntervals]:
+        """
+        Sorted (levels, dosages) for a reading time and dosage column, or None
+        """
+        return self._intervals.get((blood_sugar_reading, dosage_column))
+
+    def lookup(self, blood_sugar_reading: str, dosage_column: str, reading_value) -> Optional[int]:
+        """
+        Returns the dosage of the lowest rule in [reading, reading + READING_WINDOW], or None
+        """
+        if reading_value is None:
+            return None
+        intervals = self.intervals(blood_sugar_reading, dosage_column)
+        if intervals is None:
+            return None
+        i = bisect_left(intervals.levels, reading_value)
+        if i < len(intervals.levels) and intervals.levels[i] <= reading_value + READING_WINDOW:
+            return intervals.dosages[i]
+        return None
+
+
+_insulin_rule_index: Optional[InsulinRuleIndex] = None
+_insulin_rule_index_lock = threading.Lock()
+
+
+def insulin_rule_index() -> InsulinRuleIndex:
+    """
+    Process-wide insulin rule index, loaded on first use.
+    """
+    index = _insulin_rule_index
+    if index is None:
+        with _insulin_rule_index_lock:
+            index = _insulin_rule_index
+            if index is None:
+                index = reload_insulin_rules()
+    return index
+
+
+def reload_insulin_rules() -> InsulinRuleIndex:
+    """
+    Rebuild the index from insulin_rules (e.g., after /load_insulin), and swap it in.
+    """
+    global _insulin_rule_index
+    with db.session.no_autoflush:
+        rules = db.session.query(models.InsulinRule).all()
+    index = InsulinRuleIndex(rules)
+    _insulin_rule_index = index
+    app_logger.info(f"Insulin rule index loaded: {index.rule_count} rules")
+    return index
@@ -4,6 +4,7 @@ import importlib
 import pathlib
 import logging as logging
 import flask_sqlalchemy
+from api.system.opt_locking import opt_locking
 
 # use absolute path import for easier multi-{app,model,db} support
 database = __import__('database')
@@ -16,9 +17,9 @@ def add_check_sum(cls):
     """
     @safrs.jsonapi_attr
     def _check_sum_(self):
-        if isinstance(self, flask_sqlalchemy.model.DefaultMeta) or not hasattr(self, "_check_sum_property"):   # property does not exist during initialization
+        if isinstance(self, flask_sqlalchemy.model.DefaultMeta):   # property does not exist during initialization
             return None
-        return self._check_sum_property
+        return opt_locking.row_checksum(self)  # computed on first access
 
     @_check_sum_.setter
     def _check_sum_(self, value):
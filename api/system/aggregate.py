@@ -0,0 +1,140 @@
+"""
+Aggregate Service - GROUP BY queries for the Ontimize <entity>TypeAggregate requests
+
+Group columns and aggregate functions are validated against the model_registry metadata,
+and run as a single GROUP BY in the database.  Results are cached for CACHE_SECONDS,
+per entity / group columns / aggregates / filter / user, so dashboard tiles
+(eg, recommendations per drug per day) do not re-run the query on every refresh.
+"""
+import contextlib
+import datetime
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+from typing import List, Optional
+import safrs
+from sqlalchemy import func, select
+import api.system.model_registry as model_registry
+from api.system.expression_parser import where_clause
+
+app_logger = logging.getLogger(__name__)
+
+db = safrs.DB
+session = db.session
+
+AGGREGATE_FUNCTIONS = {"count": func.count, "sum": func.sum, "avg": func.avg, "min": func.min, "max": func.max}
+NUMERIC_FUNCTIONS = ("sum", "avg")
+DEFAULT_AGGREGATES = [{"function": "count", "column": "*", "alias": "AMOUNT"}]
+""" Ontimize aggregate charts expect count(*) as AMOUNT """
+
+CACHE_SECONDS = float(os.getenv("APILOGICPROJECT_AGGREGATE_CACHE_SECONDS", "30"))
+CACHE_SIZE = 256
+
+_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+""" key => (expires, rows), least recently used first """
+_lock = threading.Lock()
+
+
+def aggregate(resource_name: str, group_by: List[str], aggregates: Optional[List[dict]] = None,
+              filter: Optional[str] = None) -> List[dict]:
+    """
+    select <group_by>, <aggregates> from <resource> where <filter> group by <group_by>
+
+    Args:
+        resource_name (str): model class name, eg, Recommendation
+        group_by (List[str]): attribute names (names that are not attributes are ignored, as Ontimize sends AMOUNT etc)
+        aggregates (List[dict]): {"function": count|sum|avg|min|max, "column": attribute or "*", "alias": name}
+            Defaults to count(*) as AMOUNT
+        filter (CompiledFilter | str): where clause, as built by parsePayload
+
+    Raises:
+        ValueError: unknown resource, function or column, or sum / avg of a non-numeric column
+
+    Returns:
+        List[dict]: 1 row per group, eg, {"drug_id": 5, "recommendation_date": "2025-03-16", "AMOUNT": 12}
+    """
+    resource = model_registry.get_resource(resource_name)
+    if resource is None:
+        raise ValueError(f"Resource {resource_name} not found")
+    group_names = [name for name in group_by or [] if name in resource.columns]
+    aggregate_columns = [_aggregate_column(resource, each) for each in aggregates or DEFAULT_AGGREGATES]
+
+    key = (resource_name, tuple(group_names),
+           tuple((each.name, str(each.element)) for each in aggregate_columns),
+           getattr(filter, "key", filter), _user_key())
+    now = time.monotonic()
+    with _lock:
+        cached = _cache.get(key)
+        if cached is not None and cached[0] > now:
+            _cache.move_to_end(key)
+            return cached[1]
+
+    group_columns = [getattr(resource.model, name) for name in group_names]
+    stmt = select(*[column.label(name) for column, name in zip(group_columns, group_names)], *aggregate_columns) \
+        .select_from(resource.model)
+    if filter:
+        stmt = stmt.where(where_clause(filter))
+    if group_columns:
+        stmt = stmt.group_by(*group_columns).order_by(*group_columns)
+    app_logger.debug(f"aggregate on {resource_name}: {stmt}")
+    rows = [{name: _json_value(value) for name, value in each_row._mapping.items()}
+            for each_row in session.execute(stmt)]
+
+    with _lock:
+        _cache[key] = (now + CACHE_SECONDS, rows)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return rows
+
+
+def clear_cache():
+    """ drop cached results (eg, after a bulk load) """
+    with _lock:
+        _cache.clear()
+
+
+def _aggregate_column(resource: model_registry.ResourceMetadata, aggregate: dict):
+    function_name = str(aggregate.get("function", "count")).lower()
+    column_name = aggregate.get("column") or "*"
+    alias = aggregate.get("alias") or f"{function_name}_{column_name}".replace("*", "all")
+    if function_name not in AGGREGATE_FUNCTIONS:
+        raise ValueError(f"Unsupported aggregate function {function_name}")
+    if column_name == "*":
+        if function_name != "count":
+            raise ValueError(f"{function_name}(*) is not supported")
+        return func.count().label(alias)
+    if column_name not in resource.columns:
+        raise ValueError(f"Attribute {column_name} not found in {resource.name}")
+    column = getattr(resource.model, column_name)
+    if function_name in NUMERIC_FUNCTIONS and not _is_numeric(resource.columns[column_name]):
+        raise ValueError(f"{function_name}({column_name}) requires a numeric attribute")
+    return AGGREGATE_FUNCTIONS[function_name](column).label(alias)
+
+
+def _is_numeric(column) -> bool:
+    try:
+        return issubclass(column.type.python_type, (int, float, Decimal)) \
+            and not issubclass(column.type.python_type, bool)
+    except NotImplementedError:
+        return False
+
+
+def _json_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+def _user_key():
+    """ grants filter rows by user, so cached results are per user """
+    with contextlib.suppress(Exception):
+        from security.system.authorization import Security
+        user = Security.current_user()
+        return getattr(user, "id", None) or str(user)
+    return None
@@ -4,7 +4,7 @@ import logging
 import contextlib
 from sqlalchemy import Column, Table, ForeignKey
 from sqlalchemy.orm.decl_api import DeclarativeMeta #sqlalchemy.orm.decl_api.DeclarativeMeta
-from sqlalchemy.orm import relationships, relationship
+from sqlalchemy.orm import relationships, relationship, selectinload, load_only
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy_utils import get_referencing_foreign_keys
 from sqlalchemy import event, MetaData, and_, or_
@@ -18,10 +18,14 @@ from safrs.errors import JsonapiError, ValidationError
 from security.system.authorization import Security
 from typing import List, Dict, Tuple
 import json 
+import re
+import base64
+import datetime
+from decimal import Decimal
 import requests
 import config.config as config
 from config.config import Args
-from api.system.expression_parser import parsePayload
+from api.system.expression_parser import parsePayload, where_clause
 
 resource_logger = logging.getLogger("api.customize_api")
 
@@ -30,6 +34,105 @@ db = safrs.DB
 
 session = db.session  # type: sqlalchemy.orm.scoping.scoped_session
 
+IN_CHUNK_SIZE = 1000
+""" max parent keys bound into 1 child-level IN query """
+EXPLAIN_OPTION = "explain_plan"
+""" execution option: session.execute returns the select's EXPLAIN (FORMAT JSON) instead of its rows """
+
+
+def explain_sql(statement, dialect) -> tuple:
+    """ (EXPLAIN sql, params) for statement - IN lists (postcompile) are rendered as individual binds """
+    compiled = statement.compile(dialect=dialect, compile_kwargs={"render_postcompile": True})
+    return f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params
+
+
+@event.listens_for(session, "do_orm_execute")
+def _explain_plan(orm_execute_state):
+    """
+    With EXPLAIN_OPTION, run the EXPLAIN of the select as security would run the select:
+    the authorization do_orm_execute listener (registered first, on import) has added the grants.
+    """
+    if orm_execute_state.execution_options.get(EXPLAIN_OPTION):
+        connection = orm_execute_state.session.connection()
+        sql, params = explain_sql(orm_execute_state.statement, connection.dialect)
+        return connection.exec_driver_sql(sql, params)
+
+
+def _decimal_to_str(value):
+    return str(value) if isinstance(value, Decimal) else value
+
+
+def _date_to_str(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S') if isinstance(value, datetime.date) else value
+
+
+def _to_str(value):
+    return _date_to_str(_decimal_to_str(value))
+
+
+class RowSerializer():
+    """
+    Compiled rows_to_dict for 1 model class and attribute list.
+
+    The converter for each column (Decimal => str, date => '%Y-%m-%d %H:%M:%S') is chosen
+    once, from the column type, instead of testing every value of every row.
+
+    As rows' __dict__ did, the dict also has the loaded relationships and (with optimistic locking)
+    the _check_sum_property - only for rows with every column loaded, since the checksum reads them all
+    (so partial selects, eg load_only, would lazy load each missing column of each row).
+    """
+
+    __slots__ = ("model_class", "converters", "add_id", "relationship_keys", "add_checksum", "column_keys")
+
+    def __init__(self, model_class: DeclarativeMeta, attr_keys: tuple = None):
+        self.model_class = model_class
+        self.converters = []
+        for each_attr in inspect(model_class).column_attrs:
+            if attr_keys is not None and each_attr.key not in attr_keys:
+                continue
+            try:
+                python_type = each_attr.columns[0].type.python_type
+                converter = _decimal_to_str if issubclass(python_type, Decimal) \
+                    else _date_to_str if issubclass(python_type, datetime.date) \
+                    else None
+            except NotImplementedError:
+                converter = _to_str
+            self.converters.append((each_attr.key, converter))
+        self.add_id = "id" not in [key for key, _ in self.converters] and hasattr(model_class, "id")
+        self.relationship_keys = tuple(inspect(model_class).relationships.keys())
+        self.add_checksum = hasattr(model_class, "S_CheckSum")
+        self.column_keys = frozenset(inspect(model_class).column_attrs.keys())
+
+    def __call__(self, row) -> dict:
+        loaded = row.__dict__
+        row_as_dict = {}
+        for key, converter in self.converters:
+            value = loaded[key] if key in loaded else getattr(row, key)
+            row_as_dict[key] = value if value is None or converter is None else converter(value)
+        for key in self.relationship_keys:
+            if key in loaded:  # loaded only - do not lazy load
+                row_as_dict[key] = loaded[key]
+        if self.add_checksum and (loaded.keys() >= self.column_keys or "_check_sum_property" in loaded):
+            checksum_value = row.S_CheckSum  # computed on first access (None without optimistic locking)
+            if checksum_value is not None:
+                row_as_dict["_check_sum_property"] = checksum_value
+        if self.add_id:
+            with contextlib.suppress(Exception):
+                row_as_dict["id"] = row.id
+        return row_as_dict
+
+
+_serializers: Dict[tuple, RowSerializer] = {}
+
+
+def row_serializer(model_class: DeclarativeMeta, attr_keys: tuple = None) -> RowSerializer:
+    """ cached RowSerializer for model_class / attr_keys (None means all columns) """
+    key = (model_class, attr_keys)
+    serializer = _serializers.get(key)
+    if serializer is None:
+        serializer = _serializers[key] = RowSerializer(model_class, attr_keys)
+    return serializer
+
 
 class DotDict(dict):
     """ dot.notation access to dictionary attributes """
@@ -81,6 +184,7 @@ class CustomEndpoint():
             , isCombined: bool = False
             , pagesize: int = 100
             , offset: int = 0
+            , count: str = None
             ):
         """
 
@@ -97,6 +201,7 @@ class CustomEndpoint():
             :order_by is Column object used to sort aac result (e.g. order_by=models.Customer.Name)
             :isParent = if True - use parent foreign key to join single lookup (ManyToOne)
             :isCombined =  combine the fields of the isParent = routeTrue with the _parentResource (flatten) 
+            :count = totalQueryRecordsNumber: None (999), "approximate" (planner estimate) or "exact"
             
         """
         if not model_class:
@@ -116,8 +221,10 @@ class CustomEndpoint():
         self.isParent= isParent 
         self.pagesize = pagesize
         self.offset = offset
+        self.count = count
         self.totalQueryRecordsNumber =  999
         self.startRecordIndex = 0
+        self.nextCursor = None # opaque keyset cursor for the page after this one (None on the last page)
         if isinstance(join_on, tuple):
             if len(join_on) > 0:
                 # get parent or child
@@ -134,14 +241,15 @@ class CustomEndpoint():
         self._pkeyList: list = [] # primary key list  collect when needed - do not store
         self._fkeyList: list = [] # foreign_key list (used by isParent)  collect when needed - do not store
         self._dictRows: list = [] # temporary holding for query results (Phase 1)
+        self._rowIndex: dict = {} # join key name => {str(key value): [dictRow]} (hash join of _dictRows)
+        self._result = None # (encoded, result) of the last execute - lets transform skip json.loads
+        self._cursor = None # decoded cursor (page starts after this row), from payload cursor / page[cursor]
         self._parentRow = Dict[str, any] # keep track of linkage
         self._method = None
         self._href = None
         self._columnNames = [k.key for k in self._model_class._s_columns]
-        key = self._model_class_name
-        from api.api_discovery.ontimize_api import getMetaData
-        resources = getMetaData(key)
-        self._attributes = resources["resources"][key]["attributes"]
+        import api.system.model_registry as model_registry
+        self._attributes = model_registry.get_resource(self._model_class_name).attributes
         self._quote = '`' if Args.backtic_as_quote else '"'
         
     def __str__(self):
@@ -162,37 +270,128 @@ class CustomEndpoint():
         if request.method == 'OPTIONS':
             return jsonify(success=True)
         
-        serverURL = f"{request.host_url}api"
-        query = f"{serverURL}/{self._model_class_name}?include={include}"
         args = request.args
         key, value,  limit, offset, order_by, filter_ = self.parseArgs(args)
+        filters = {}
         if altKey is not None:
-            query += f"&filter%5B{self.primaryKey}%5D={altKey}"
+            filters[self.primaryKey] = altKey
         elif key is not None and value is not None:
-            query += f"&filter%5B{key}%5D={value}"
-        else: 
-            #query =  query if filter_ is None or filter_ is '1=1' else f"{query} and {filter_}"
-            query = (
-                query
-                if filter_ is None or filter_ == '1=1'
-                else f"{query} and {filter_}"
-            )
+            filters[key] = value
+        elif filter_ is not None and filter_ != '1=1':
+            filters = None
         self._href = f"{request.url_root[:-1]}{request.path}"
-        print(f"limit: {limit}, offset: {offset}, sort: {order_by}, query: {query}")
-        params = {'page[limit]': limit, 'page[offset]': offset}
-        resource_logger.debug(f"CustomEndpoint get using query: {query}")
-        if Args.security_enabled:
-            jwt = request.headers.get("Authorization") or ""
-            header = {"Authorization": jwt,"Content-Type": "application/json"}
-            result = requests.get(query, headers=header, params=params)
-        else:
-            result = requests.get(query, params=params)
-        if result.status_code == 200:
-            jsonResult = json.loads(result.content)
-            self._populateResponse(jsonResult) # Pass the JSON result to CustomEndpoint 
-            result = self.execute(request) # a dict of args
-            return result
-        return {"error": result.status_code}
+        resource_logger.debug(f"CustomEndpoint get on {self._model_class_name} using include: {include} filters: {filters} "
+                              f"limit: {limit}, offset: {offset}, sort: {order_by}")
+        try:
+            jsonResult = self._query_jsonapi(include=include, filters=filters, filter_=filter_, limit=limit, offset=offset)
+        except Exception as ex:
+            resource_logger.error(f"CustomEndpoint get error {ex}")
+            return {"error": f"{ex}"}
+        self._populateResponse(jsonResult) # Pass the JSON result to CustomEndpoint 
+        result = self.execute(request) # a dict of args
+        return result
+
+    def _query_jsonapi(self, include: str, filters: dict = None, filter_: str = None, limit: int = 20, offset: int = 0) -> dict:
+        """
+        In-process equivalent of GET /api/<model>?include=... (no http call back to this server)
+
+        Includes are loaded with selectinload, in the request's session (so grants apply as usual).
+
+        Args:
+            :include (str): relationship path(s), eg, "OrderList,OrderList.OrderDetailList"
+            :filters (dict): attribute name => value (the filter[name]=value args), None to use filter_ instead
+            :filter_ (str): name=value conditions, joined by " and " (when filters is None)
+            :limit (int): page[limit]
+            :offset (int): page[offset]
+
+        Returns:
+            dict: {"data": [...], "included": [...]} - jsonapi resource objects (type, id, attributes)
+        """
+        model_class = self._model_class
+        qry = session.query(model_class)
+        if filters is None:
+            filters = self._filter_conditions(filter_)
+        for attr_name, attr_value in filters.items():
+            attr = inspect(model_class).column_attrs.get(attr_name.strip('"'))
+            if attr is None:
+                raise ValidationError(f"Invalid filter on {self._model_class_name}: {attr_name} is not an attribute")
+            qry = qry.filter(getattr(model_class, attr.key) == f"{attr_value}".strip("'"))  # bound parameter
+        include_paths = self._include_paths(include)
+        for each_path in include_paths:
+            qry = qry.options(self._include_loader(each_path))
+        rows = qry.order_by(*inspect(model_class).primary_key).limit(int(limit)).offset(int(offset)).all()
+
+        included = {}
+        for each_path in include_paths:
+            level = rows
+            for each_relationship in each_path:
+                next_level = []
+                for each_row in level:
+                    related = getattr(each_row, each_relationship)
+                    if related is None:
+                        continue
+                    for each_related in related if isinstance(related, list) else [related]:
+                        next_level.append(each_related)
+                        included.setdefault((each_related._s_type, each_related.jsonapi_id), each_related)
+                level = next_level
+        return {"data": [self._jsonapi_object(each_row) for each_row in rows],
+                "included": [self._jsonapi_object(each_row) for each_row in included.values()]}
+
+    def _filter_conditions(self, filter_: str) -> dict:
+        """ "name=value and name2='value2'" => {name: value, name2: value2} - other expressions are rejected """
+        conditions = {}
+        for each_condition in re.split(r"\s+and\s+", filter_ or "", flags=re.IGNORECASE):
+            attr_name, equals, attr_value = each_condition.partition("=")
+            if not equals or not attr_name.strip():
+                raise ValidationError(f"Invalid filter on {self._model_class_name}: {each_condition}")
+            conditions[attr_name.strip()] = attr_value.strip()
+        return conditions
+
+    def _include_paths(self, include: str) -> list:
+        """ "A,A.B" => [["A"], ["A", "B"]] - unknown relationships are ignored (as safrs does) """
+        paths = []
+        for each_include in (include or "").replace("&", ",").split(","):
+            each_include = each_include.strip()
+            if each_include.startswith("include="):
+                each_include = each_include[len("include="):]
+            if not each_include:
+                continue
+            path = []
+            model_class = self._model_class
+            for each_name in each_include.split("."):
+                relationship = inspect(model_class).relationships.get(each_name)
+                if relationship is None:
+                    resource_logger.debug(f"CustomEndpoint include {each_include} - {each_name} is not a relationship of {model_class.__name__}")
+                    break
+                path.append(each_name)
+                model_class = relationship.mapper.class_
+            if path:
+                paths.append(path)
+        return paths
+
+    def _include_loader(self, path: list):
+        """ selectinload chain for a relationship path (1 query per level, not per row) """
+        model_class = self._model_class
+        loader = None
+        for each_name in path:
+            attr = getattr(model_class, each_name)
+            loader = selectinload(attr) if loader is None else loader.selectinload(attr)
+            model_class = attr.property.mapper.class_
+        return loader
+
+    @staticmethod
+    def _jsonapi_object(row) -> dict:
+        """ row => jsonapi resource object, attribute values as the safrs json encoder renders them """
+        attributes = {}
+        for attr_name, attr_value in row.to_dict().items():
+            if isinstance(attr_value, Decimal):
+                attr_value = str(attr_value)
+            elif isinstance(attr_value, (datetime.date, datetime.time)):
+                attr_value = attr_value.isoformat()
+            elif isinstance(attr_value, bytes):
+                attr_value = attr_value.decode("utf-8", errors="replace")
+            attributes[attr_name] = attr_value
+        return {"type": row._s_type, "id": row.jsonapi_id, "attributes": attributes}
         
     def execute(self: CustomEndpoint, request: safrs.request.SAFRSRequest, altKey: str = None) -> dict:
         """
@@ -257,6 +456,14 @@ class CustomEndpoint():
         #serverURL = f"{request.host_url}api"
         #query = f"{serverURL}/{self._model_class_name}"
         self.startRecordIndex = int(offset)
+        cursor = payload.get("cursor") if isinstance(payload, dict) else None
+        cursor = cursor or args.get("page[cursor]")
+        if cursor:
+            try:
+                self._cursor = self._decodeCursor(cursor)
+            except Exception as ex:
+                raise ValidationError(f'Invalid cursor on entity {self._model_class_name}') from ex
+            self.startRecordIndex = self._cursor["i"]
         resource_logger.debug(f"CustomEndpoint execute on: {self._model_class_name} using alias: {self.alias}")
         filter_by = None
         #key = args.get(pkey) if args.get(pkey) is not None else args.get(f"filter[{pkey}]")
@@ -267,7 +474,7 @@ class CustomEndpoint():
         elif altKey is not None:
             filter_by = f'{_quote}{pkey}{_quote} = {self.quoteStr(altKey)}'
             self._pkeyList.append(self.quoteStr(altKey))
-        filter_by = filter_by if filter_ is None else f"{filter_by} and {filter_}" if filter_by is not None else filter_
+        filter_by = filter_by if filter_ is None else and_(where_clause(filter_by), where_clause(filter_)) if filter_by is not None else filter_
         self._href = f"{request.url_root[:-1]}{request.path}"
         limit =  max(self.pagesize, int(limit))
         print(f"limit: {limit}, offset: {offset}, sort: {order_by},filter_by: {filter_by}, add_filter {filter_}")
@@ -275,7 +482,9 @@ class CustomEndpoint():
             self._createRows(limit=limit,offset=offset,order_by=order_by,filter_by=filter_by, expressions=expressions) 
             self._executeChildren()
             self._modifyRows(result)
-            return json.dumps(result, indent=4, ensure_ascii=False).encode('utf8')
+            encoded = json.dumps(result, separators=(',', ':'), ensure_ascii=False).encode('utf8')
+            self._result = (encoded, result)
+            return encoded
         except Exception as ex:
             resource_logger.error(f"CustomEndpoint error {ex}")
             return f"'error': {ex}"
@@ -295,32 +504,26 @@ class CustomEndpoint():
                 child._processChildren()
         
     def _collectPKeys(self, keyName)-> list:
-        keyList = []
         if keyName is None:
-            return keyList
-        for row in self._dictRows:
-            if keyName in row:
-                key = row.get(keyName)
-                if key is not None and key not in keyList:
-                    keyList.append(key)
-
+            return []
+        keyList = self._distinctKeys(self._dictRows, keyName)
         self._pkeyList = keyList
         return keyList
         
     def _collectParentKeys(self, keyName: str) -> list:
-        keyList = []
         #if not self.isParent or keyName is None:
         if self._parentResource is None or keyName is None:
             return self._parentResource._pkeyList
-        for row in self._parentResource._dictRows:
-            if keyName in row:
-                key = row.get(keyName)
-                if key is not None and key not in keyList:
-                    keyList.append(key)
-
+        keyList = self._distinctKeys(self._parentResource._dictRows, keyName)
         self._fkeyList = keyList
         return keyList
 
+    @staticmethod
+    def _distinctKeys(rows: list, keyName: str) -> list:
+        """ distinct non-null row[keyName] values, in row order """
+        return list(dict.fromkeys(
+            row[keyName] for row in rows if row.get(keyName) is not None))
+
     def _createRows(self,limit:int = 10, offset = 0, filter_by: str = None, order_by: str = None, expressions: list = []):
         """
         execute and store rows based on list of keys in model
@@ -338,27 +541,31 @@ class CustomEndpoint():
             return
         model_class = self._model_class
         model_class_name = self._model_class_name
+        if self._parentResource is not None and self.join_on is not None:
+            rows = self._createRowsFromKeys()
+            self._setRows(self.rows_to_dict(rows) if rows else [])
+            return
         queryFilter = self._createFilterFromKeys()
-        session_qry= session.query(model_class)
+        session_qry= self._query()
         #result = session.execute(select(model_class).where(text("Id = 'ALFKI'"))).all() #.join(models.Customer.OrderList)).order()
         if queryFilter is None or queryFilter == 'None':
             #query = select(self._model_class)
             resource_logger.debug(
                     f"CreateRows on {model_class_name} using filter_by: {self.filter_by} order_by: {self.order_by}")
             if self.filter_by is not None:
-                qry = session_qry.filter(text(self.filter_by))
+                qry = session_qry.filter(where_clause(self.filter_by))
                 if self.order_by is not None:
                     qry = qry.order_by(self.order_by)
-                if filter_by is not None and 'undefined' not in filter_by:
+                if filter_by is not None and not (isinstance(filter_by, str) and 'undefined' in filter_by):
                     resource_logger.debug(
                     f"Adding filter_by: {filter_by}")
-                    qry = qry.filter(text(filter_by))
-                rows = qry.limit(limit).offset(offset).all()
+                    qry = qry.filter(where_clause(filter_by))
+                rows = self._page(qry, limit, offset, order_by)
             else:
                 if filter_by is not None:
                     resource_logger.debug(
                     f"Adding filter_by: {filter_by}")
-                    session_qry = session_qry.filter(text(filter_by))
+                    session_qry = session_qry.filter(where_clause(filter_by))
                 
                 if order_by:
                     if isinstance(order_by, list) and len(order_by) > 0:
@@ -374,7 +581,7 @@ class CustomEndpoint():
                     else:
                         if order_by in self._attributes:
                             session_qry = session_qry.order_by(text(order_by))
-                rows = session_qry.limit(limit).offset(offset).all()
+                rows = self._page(session_qry, limit, offset, order_by)
         else:
             resource_logger.debug(
                 f"CreateRows on {model_class_name} using QueryFilter: {queryFilter} order_by: {self.order_by}")
@@ -384,10 +591,10 @@ class CustomEndpoint():
             elif  self.filter_by is None:
                 session_qry = session_qry.filter(text(queryFilter))
             else:
-                if filter_by:
+                if filter_by is not None:
                     resource_logger.debug(
                     f"Adding on {model_class_name} using filter_by: {filter_by}")
-                    session_qry = session_qry.filter(text(filter_by))#.filter(text(self.filter_by))
+                    session_qry = session_qry.filter(where_clause(filter_by))#.filter(text(self.filter_by))
             if order_by:
                 col_name = order_by[0]["columnName"]
                 for a in self._attributes:
@@ -398,7 +605,215 @@ class CustomEndpoint():
             rows = session_qry.limit(limit).offset(offset).all()
         if rows:    
             dictRows = self.rows_to_dict(rows)
-            self._dictRows = dictRows
+            self._setRows(dictRows)
+
+    def _page(self, session_qry, limit: int, offset, order_by) -> list:
+        """
+        Fetch 1 page of root rows, ordered by the sort columns then the primary key (nulls last).
+
+        With a cursor, the page starts after the cursor row (keyset) instead of skipping
+        offset rows, so deep pages cost the same as the first one.
+        Sets nextCursor (when the page is full) and totalQueryRecordsNumber (per count).
+        """
+        keys = self._keysetColumns(order_by)
+        session_qry = session_qry.order_by(None)
+        if self.count is not None:
+            self.totalQueryRecordsNumber = self._countRows(session_qry)
+        if self._cursor is not None:
+            if len(self._cursor["k"]) != len(keys):
+                raise ValidationError(f'Invalid cursor on entity {self._model_class_name} - sort changed')
+            session_qry = session_qry.filter(self._keysetAfter(keys, self._cursor["k"]))
+            offset = 0
+        session_qry = session_qry.order_by(*[self._keysetOrder(column, ascending) for column, ascending in keys])
+        rows = session_qry.limit(limit).offset(offset).all()
+        self.nextCursor = None
+        if rows and len(rows) == int(limit):
+            last = rows[-1]
+            self.nextCursor = self._encodeCursor(
+                [getattr(last, column.key) for column, _ in keys], self.startRecordIndex + len(rows))
+        return rows
+
+    def _keysetColumns(self, order_by) -> list:
+        """
+        Returns:
+            list: (column, ascending) - each sort column, then the (other) primary key columns, ascending
+        """
+        mapper = inspect(self._model_class)
+        pkey_columns = [getattr(self._model_class, mapper.get_property_by_column(c).key) for c in mapper.primary_key]
+        sort_keys = []
+        if isinstance(order_by, list):
+            for each_sort in order_by:
+                sort_keys.append((getattr(self._model_class, each_sort["columnName"], None),
+                                  each_sort["ascendent"] if "ascendent" in each_sort else False))
+        elif isinstance(order_by, str) and order_by:
+            for each_sort in order_by.split(","):
+                each_sort = each_sort.strip()
+                sort_keys.append((getattr(self._model_class, each_sort.lstrip("-"), None), not each_sort.startswith("-")))
+        elif self.order_by is not None and not isinstance(order_by, str):
+            sort_keys = [(each_column, True) for each_column in
+                         (self.order_by if isinstance(self.order_by, (list, tuple)) else [self.order_by])]
+        keys = []
+        for column, ascending in [*sort_keys, *[(column, True) for column in pkey_columns]]:
+            if isinstance(column, sqlalchemy.orm.attributes.InstrumentedAttribute) \
+                    and isinstance(column.property, sqlalchemy.orm.ColumnProperty) \
+                    and column.key not in [each_column.key for each_column, _ in keys]:
+                keys.append((column, ascending))
+        return keys
+
+    @staticmethod
+    def _nullable(column) -> bool:
+        return any(each.nullable for each in column.property.columns)
+
+    def _keysetOrder(self, column, ascending: bool):
+        order = column.asc() if ascending else column.desc()
+        return order.nulls_last() if self._nullable(column) else order
+
+    def _keysetAfter(self, keys: list, cursor_values: list):
+        """
+        Rows after the cursor row, in _keysetOrder (nulls last) - the expanded form of
+        (a, b, id) > (:a, :b, :id), so each key keeps its own direction, and null keys are not lost
+
+            (a after :a) or (a = :a and b after :b) or (a = :a and b = :b and id > :id)
+        """
+        alternatives = []
+        equal_so_far = []
+        for (column, ascending), value in zip(keys, cursor_values):
+            value = self._cursorValue(column, value)
+            if value is None:  # nulls are last - nothing after a null, other nulls are equal
+                after = None
+                equal = column.is_(None)
+            else:
+                after = column > value if ascending else column < value
+                if self._nullable(column):
+                    after = or_(after, column.is_(None))
+                equal = column == value
+            if after is not None:
+                alternatives.append(and_(*equal_so_far, after))
+            equal_so_far.append(equal)
+        return or_(*alternatives) if alternatives else sqlalchemy.false()
+
+    def _countRows(self, session_qry) -> int:
+        """ exact count(*), or the postgresql planner's row estimate (cost does not grow with the table) """
+        if self.count == "approximate":
+            if session.connection().dialect.name == "postgresql":
+                plan = session.execute(session_qry.statement, execution_options={EXPLAIN_OPTION: True}).scalar()
+                plan = json.loads(plan) if isinstance(plan, str) else plan
+                return int(plan[0]["Plan"]["Plan Rows"])
+        return session_qry.count()
+
+    @staticmethod
+    def _encodeCursor(values: list, start: int) -> str:
+        """ opaque (url safe) cursor: the keyset values of the last row, and the next startRecordIndex """
+        values = [v.isoformat() if isinstance(v, (datetime.date, datetime.time)) \
+                  else str(v) if isinstance(v, Decimal) else v for v in values]
+        return base64.urlsafe_b64encode(json.dumps({"k": values, "i": start}).encode()).decode()
+
+    @staticmethod
+    def _decodeCursor(cursor: str) -> dict:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return {"k": list(decoded["k"]), "i": int(decoded.get("i", 0))}
+
+    @staticmethod
+    def _cursorValue(column, value):
+        """ cursor json value => bind value of column's python type """
+        if value is None:
+            return None
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            return value
+        if python_type is datetime.datetime:
+            value = datetime.datetime.fromisoformat(value)
+        elif python_type is datetime.date:
+            value = datetime.date.fromisoformat(value)
+        elif python_type is Decimal:
+            value = Decimal(value)
+        return sqlalchemy.literal(value, type_=column.type)
+
+    def _setRows(self, dictRows: list):
+        self._dictRows = dictRows
+        self._rowIndex = {}
+
+    def _createRowsFromKeys(self) -> list:
+        """
+        Load this (child / parent lookup) level for all the parent resource rows at once.
+
+        Parent keys are bound into 1 IN query per IN_CHUNK_SIZE keys, so the number
+        of queries follows the depth of the tree, not the number of parent rows.
+        Rows are linked back to their parent rows by _linkAndModifyRows (hash join).
+
+        Returns:
+            list: SQLAlchemy rows
+        """
+        criteria = []
+        for join in self.join_on if isinstance(self.join_on, list) else [self.join_on]:
+            fkeyName, keyName = self._joinKeyNames(join)
+            keys = self._collectParentKeys(keyName)
+            if not keys:
+                return []
+            criteria.append((self._column(fkeyName), keys))
+        (chunked_column, chunked_keys), other_criteria = criteria[0], criteria[1:]
+        resource_logger.debug(
+            f"CreateRows on {self._model_class_name} for {len(chunked_keys)} {chunked_column.key} keys")
+        session_qry = self._query()
+        for column, keys in other_criteria:
+            session_qry = session_qry.filter(column.in_(keys))
+        if self.filter_by is not None:
+            session_qry = session_qry.filter(where_clause(self.filter_by))
+        if self.order_by is not None:
+            session_qry = session_qry.order_by(self.order_by)
+        rows = []
+        for start in range(0, len(chunked_keys), IN_CHUNK_SIZE):
+            rows.extend(session_qry.filter(
+                chunked_column.in_(chunked_keys[start:start + IN_CHUNK_SIZE])).all())
+        return rows
+
+    def _query(self):
+        """ session query on the model, loading only the columns this resource uses """
+        session_qry = session.query(self._model_class)
+        attr_keys = self._selectedAttributes()
+        if attr_keys is not None:
+            session_qry = session_qry.options(
+                load_only(*[getattr(self._model_class, key) for key in attr_keys]))
+        return session_qry
+
+    def _selectedAttributes(self) -> tuple:
+        """
+        Attribute keys to load / serialize: fields, plus primary and join keys (None means all columns)
+        """
+        if not self.fields or self.calling is not None:
+            return None
+        mapper = inspect(self._model_class)
+        column_keys = {each_attr.key for each_attr in mapper.column_attrs}
+        selected = set()
+        fields = [self.fields] if isinstance(self.fields, sqlalchemy.orm.attributes.InstrumentedAttribute) else self.fields
+        for f in fields:
+            if isinstance(f, str):
+                selected.add(f)
+            elif isinstance(f, tuple):
+                selected.add(f[1] if isinstance(f[0], sqlalchemy.sql.schema.Column) else f[0].key)
+            else:
+                selected.add(f.key)
+        selected.update(mapper.get_property_by_column(c).key for c in mapper.primary_key)
+        selected.update(mapper.get_property_by_column(c).key
+                        for c in self._model_class.__table__.columns if c.foreign_keys)
+        children = [self.children] if isinstance(self.children, CustomEndpoint) else self.children
+        for each_endpoint in [self, *children]:
+            joins = each_endpoint.join_on if isinstance(each_endpoint.join_on, list) else [each_endpoint.join_on]
+            for join in joins:
+                for each_key in join if isinstance(join, tuple) else [join]:
+                    if each_key is not None:
+                        selected.add(each_key.key)
+            selected.add(each_endpoint.primaryKey)
+        selected.update(("id", "S_CheckSum"))
+        if not column_keys - selected:
+            return None
+        return tuple(sorted(selected & column_keys))
+
+    def _column(self, keyName: str) -> Column:
+        """ mapped attribute for keyName (attribute key, or column name) """
+        attr = getattr(self._model_class, keyName, None)
+        return attr if attr is not None else self._model_class.__table__.c[keyName]
         
 
     def _createFilterFromKeys(self):
@@ -422,31 +837,36 @@ class CustomEndpoint():
         return aFilter
 
     def buildJoin(self, andOp: str, join: Column) -> str:
-        joinStr = None
         if join is not None:
-            if join.__class__.__name__ == 'InstrumentedAttribute':
-                if hasattr(join,"prop") and join.prop.__class__.__name__ == 'RelationshipProperty':
-                #    pass #oin.prop._join_condition.foreign_key_columns
-                    for l in join.prop._join_condition.foreign_key_columns: 
-                        fkeyName = self.primaryKey if self.isParent else l.key
-                        self.foreignKey = l
-                        keyName = l.key if self.isParent else self.primaryKey
-                else:
-                    fkeyName = self.primaryKey if self.isParent else join.key #child - parent pkey is implied
-                    keyName = join.key if self.isParent else self.primaryKey
-                
-            elif len(join) == 2:
-                pkeyName = join[0].key #parent
-                fkeyName = join[1].key #child
-                self.primaryKey = fkeyName if self.isParent else self.primaryKey
-                self.foreignKey = join[1] if self.isParent else join[0]
-                keyName = join[1].key if self.isParent else pkeyName
-            
+            fkeyName, keyName = self._joinKeyNames(join)
             keys = self._collectParentKeys(keyName)
             if keys is not None:
                 joinStrKeys = self._extractedFromKeys(fkeyName , keys)
             return f"{andOp}{joinStrKeys}"
         return None
+
+    def _joinKeyNames(self, join: Column) -> tuple:
+        """
+        Returns:
+            tuple: (fkeyName - key name in this resource's rows, keyName - key name in the parent resource rows)
+        """
+        if join.__class__.__name__ == 'InstrumentedAttribute':
+            if hasattr(join,"prop") and join.prop.__class__.__name__ == 'RelationshipProperty':
+            #    pass #oin.prop._join_condition.foreign_key_columns
+                for l in join.prop._join_condition.foreign_key_columns: 
+                    fkeyName = self.primaryKey if self.isParent else l.key
+                    self.foreignKey = l
+                    keyName = l.key if self.isParent else self.primaryKey
+            else:
+                fkeyName = self.primaryKey if self.isParent else join.key #child - parent pkey is implied
+                keyName = join.key if self.isParent else self.primaryKey
+        elif len(join) == 2:
+            pkeyName = join[0].key #parent
+            fkeyName = join[1].key #child
+            self.primaryKey = fkeyName if self.isParent else self.primaryKey
+            self.foreignKey = join[1] if self.isParent else join[0]
+            keyName = join[1].key if self.isParent else pkeyName
+        return fkeyName, keyName
             
 
     def _extractedFromKeys(self, keyName: str, keys: object):
@@ -523,18 +943,29 @@ class CustomEndpoint():
         self._parentRow  = DotDict(row)
         pkeyValue = row[self.foreignKey.key] if self.isParent and self.foreignKey.key in row else row[self.primaryKey]
         fkey = self.primaryKey  if self.isParent and self.primaryKey in row else self.foreignKey.key if self.foreignKey is not None else None
-        for dictRow in self._dictRows:
-            if fkey is not None and f"{pkeyValue}" == f"{dictRow[fkey]}":
-                newRow = self._modifyRow(dictRow)
-                if self.isParent and self.isCombined:
-                    modifiedRow |= newRow
-                else:
-                    modifiedRow[self.alias].append(newRow)
-                if isinstance(self.children, CustomEndpoint):
-                    self.children._linkAndModifyRows(dictRow, newRow)
-                elif len(self.children) > 0:
-                    for include in self.children:
-                        include._linkAndModifyRows(dictRow, newRow)
+        if fkey is None:
+            return
+        for dictRow in self._rowsByKey(fkey).get(f"{pkeyValue}", []):
+            newRow = self._modifyRow(dictRow)
+            if self.isParent and self.isCombined:
+                modifiedRow |= newRow
+            else:
+                modifiedRow[self.alias].append(newRow)
+            if isinstance(self.children, CustomEndpoint):
+                self.children._linkAndModifyRows(dictRow, newRow)
+            elif len(self.children) > 0:
+                for include in self.children:
+                    include._linkAndModifyRows(dictRow, newRow)
+
+    def _rowsByKey(self, keyName: str) -> dict:
+        """ _dictRows grouped by str(row[keyName]) - built once per key, so linking is a hash join """
+        index = self._rowIndex.get(keyName)
+        if index is None:
+            index = {}
+            for dictRow in self._dictRows:
+                index.setdefault(f"{dictRow.get(keyName)}", []).append(dictRow)
+            self._rowIndex[keyName] = index
+        return index
 
     def _modifyRow(self, dict_row: dict) -> dict:
         #row = self.transform('LAC','',dict_row)
@@ -621,10 +1052,11 @@ class CustomEndpoint():
             if self.primaryKey == "id" and "id" not in row:
                 row["id"] = key #this is a hack since id is a jsonapi reserved value
             self._dictRows.append(row) 
-            if key not in self._pkeyList:
-                self._pkeyList.append(key)
+            self._pkeyList.append(key)
             model_type = data["type"]
             resource_logger.debug(f"_populateResponse row class on {self._model_class_name} using model_type: {model_type} with key {key}")
+        self._pkeyList = list(dict.fromkeys(self._pkeyList))
+        self._rowIndex = {}
         if self.children is not None:
             included = jsonDict.included
             if len(included) == 0:
@@ -638,23 +1070,23 @@ class CustomEndpoint():
                 self.children.processIncludedRows(included)
 
     def processIncludedRows(self, included: list):
-        for parentKey in self._parentResource._pkeyList:
-            for row in included:
-                model_class_name = row["type"]
-                if model_class_name == self._model_class_name:
-                    resource_logger.debug(f"includeRow for {self._model_class_name}")
-                    attrRow = row["attributes"]
-                    if "id" not in "attrs" and "id" in row:
-                        attrRow["id"] = row["id"]
-                    keyName = self.primaryKey if self.isParent else self.join_on.key
-                    if keyName in attrRow and parentKey == attrRow[keyName]:
-                        resource_logger.debug(f"includeRow for {self._model_class_name} checking {model_class_name} using Key: {keyName} ")
-                        #links = row["links"]
-                        #relns = row["relationships"]
-                        self._dictRows.append(attrRow)
-                        key = attrRow[self.primaryKey]
-                        if key not in self._pkeyList:
-                            self._pkeyList.append(key)
+        parentKeys = set(self._parentResource._pkeyList)
+        keyName = self.primaryKey if self.isParent else self.join_on.key if self.join_on is not None else None
+        for row in included:
+            model_class_name = row["type"]
+            if model_class_name == self._model_class_name:
+                resource_logger.debug(f"includeRow for {self._model_class_name}")
+                attrRow = row["attributes"]
+                if "id" not in "attrs" and "id" in row:
+                    attrRow["id"] = row["id"]
+                if keyName in attrRow and attrRow[keyName] in parentKeys:
+                    resource_logger.debug(f"includeRow for {self._model_class_name} checking {model_class_name} using Key: {keyName} ")
+                    #links = row["links"]
+                    #relns = row["relationships"]
+                    self._dictRows.append(attrRow)
+                    self._pkeyList.append(attrRow[self.primaryKey])
+        self._pkeyList = list(dict.fromkeys(self._pkeyList))
+        self._rowIndex = {}
         if self.children is not None:
             if isinstance(self.children, list):
                 for child in self.children:
@@ -774,26 +1206,19 @@ class CustomEndpoint():
         Returns:
             dict: dict array
         """
-        from decimal import Decimal
-        import datetime 
         rows = []
+        serializer = None
+        attr_keys = self._selectedAttributes()
         for each_row in result:
-            row_as_dict = {}
-            print(f'type(each_row): {type(each_row)}')
             if isinstance (each_row, sqlalchemy.engine.row.Row):  # sqlalchemy.engine.row
                 row_as_dict = each_row._asdict()
+                if hasattr(each_row,"id"):
+                    with contextlib.suppress(Exception):
+                        row_as_dict["id"] = each_row.id
             else:
-                for a,v, in each_row.__dict__.items(): 
-                    if a != "_sa_instance_state":
-                        if isinstance(v, Decimal):
-                            row_as_dict[a] = str(v) 
-                        elif isinstance(v, datetime.date):
-                            row_as_dict[a] = v.strftime('%Y-%m-%d %H:%M:%S')
-                        else:
-                            row_as_dict[a] = v
-            if hasattr(each_row,"id"):
-                with contextlib.suppress(Exception):
-                    row_as_dict["id"] = each_row.id
+                if serializer is None or serializer.model_class is not type(each_row):
+                    serializer = row_serializer(type(each_row), attr_keys)
+                row_as_dict = serializer(each_row)
             rows.append(row_as_dict)
         return rows
 
@@ -882,7 +1307,10 @@ class CustomEndpoint():
             if self._method == 'OPTIONS':
                 return json_
             #TODO - fixup asscii to utf-8
-            json_dict = json.loads(json_) if isinstance(json_, bytes) else json_
+            if self._result is not None and json_ is self._result[0]:
+                json_dict = self._result[1] # execute result, no need to parse it back
+            else:
+                json_dict = json.loads(json_) if isinstance(json_, bytes) else json_
             json_result = json_dict.get(key, json_dict) if key in json_dict else json_dict if isinstance(json_dict, list) else [json_dict]
         except Exception as ex:
             resource_logger.error(f"Transform Error on style {style} using key: {key} on {json_} error: {ex}")
@@ -909,6 +1337,7 @@ class CustomEndpoint():
             data = {"data": data,
                 "meta": {
                     "count": len(result),
+                    "cursor": self.nextCursor,
                     "limit": self.pagesize,
                     "total": len(result)
                 }        
@@ -918,7 +1347,7 @@ class CustomEndpoint():
             #API Bridge - lets Ontimize work out-of-the-box
             recordsNumber = self.totalQueryRecordsNumber #if len(result) == 0 else self.startRecordIndex
             startRecord = self.startRecordIndex
-            result = {"code":0,"totalQueryRecordsNumber": recordsNumber, "startRecordIndex": startRecord, "message":"ApiLogicServer","data": result ,"sqlTypes":{}}
+            result = {"code":0,"totalQueryRecordsNumber": recordsNumber, "startRecordIndex": startRecord, "cursor": self.nextCursor, "message":"ApiLogicServer","data": result ,"sqlTypes":{}}
         #if style == "LAC": default
         return result
     
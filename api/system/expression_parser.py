@@ -8,45 +8,49 @@ JSON:API filtering strategies
 import sqlalchemy
 import safrs
 import json
+import logging
+import datetime
+import itertools
+import threading
+from collections import OrderedDict
 from flask import request
 from sqlalchemy.orm import joinedload, Query
 from operator import not_, and_, or_, eq, ne, lt, le, gt, ge
 from sqlalchemy import or_ as OR_
 from sqlalchemy import and_ as AND_
+from sqlalchemy import not_ as NOT_
+from sqlalchemy import bindparam, text, true
+from sqlalchemy.inspection import inspect
+from sqlalchemy.sql.elements import ClauseElement
+from sqlalchemy.sql.visitors import cloned_traverse
 from decimal import Decimal
 
+app_logger = logging.getLogger(__name__)
+
 BASIC_EXPRESSION =  "@basic_expression"
 """Ontimize Advanced Filter Expressions"""
 FILTER_EXPRESSION = "@filter_expression"
 """Ontimize Advanced Filter Expressions"""
-# Ontimize Advanced Filter Expressions
-ONTIMIZE_OPERATORS = {
-    'LESS' : " < ",
-    'LESS_EQUAL' : " <= ",
-    'EQUAL' : " = ",
-    'EQ' : " = ",
-    'GT' : " > ",
-    'GE' : " >= ",
-    "LT" :  " < ",
-    "LE" : " <= ",
-    "NE" : " <> ",
-    "IN" : " IN ",
-    "NOT_IN" : " NOT IN ",
-    'MORE_EQUAL' : " >= ",
-    'MORE' : " > ",
-    'NULL' : " IS NULL ",
-    'IS_NULL' : " IS NULL ",
-    'NOT_EQUAL' : "<>",
-    'NOT_NULL' : " IS NOT NULL ",
-    'NOTNULL' : " IS NOT NULL ",
-    'LIKE' : " LIKE ",
-    'NOT_LIKE' : " NOT LIKE ",
-    'NOTLIKE' : " NOT LIKE ",
-    'OR' : " OR ",
-    'AND' : " AND ",
-    'OR_NOT' : " OR NOT ",
-    'AND_NOT' : " AND NOT "
+
+COMPARISON_OPERATORS = {
+    '=': 'EQ', 'EQ': 'EQ', 'EQUAL': 'EQ',
+    '<>': 'NE', '!=': 'NE', 'NE': 'NE', 'NOT_EQUAL': 'NE',
+    '<': 'LT', 'LT': 'LT', 'LESS': 'LT',
+    '<=': 'LE', 'LE': 'LE', 'LESS_EQUAL': 'LE',
+    '>': 'GT', 'GT': 'GT', 'MORE': 'GT',
+    '>=': 'GE', 'GE': 'GE', 'MORE_EQUAL': 'GE',
+    'LIKE': 'LIKE', 'ILIKE': 'ILIKE', 'MATCH': 'ILIKE',
+    'NOT_LIKE': 'NOT_LIKE', 'NOTLIKE': 'NOT_LIKE',
+    'IN': 'IN', 'NOT_IN': 'NOT_IN', 'NOTIN': 'NOT_IN',
+    'NULL': 'IS_NULL', 'IS_NULL': 'IS_NULL',
+    'NOT_NULL': 'NOT_NULL', 'NOTNULL': 'NOT_NULL', 'IS_NOT_NULL': 'NOT_NULL',
 }
+"""Ontimize / JSON:API operator => compiled filter operator"""
+BOOLEAN_OPERATORS = ('AND', 'OR', 'AND_NOT', 'OR_NOT')
+NULL_OPERATORS = ('IS_NULL', 'NOT_NULL')
+
+FILTER_CACHE_SIZE = 256
+"""compiled filter templates kept (LRU), keyed by entity + filter shape"""
 
 
 class DotDict(dict):
@@ -58,6 +62,200 @@ class DotDict(dict):
     __delattr__ = dict.__delitem__
 
 
+class CompiledFilter():
+    """
+    A parsed filter: a cached SQLAlchemy expression template (bound parameters p0, p1...) + this request's values
+
+    Filters that differ only in their values share 1 template, and so 1 SQL statement (the database can reuse its plan).
+    Use where_clause(filter) to get the expression, for session.query(...).filter() or select().where().
+    """
+
+    __slots__ = ("template", "values", "key")
+
+    def __init__(self, template: ClauseElement, values: dict, key: tuple):
+        self.template = template
+        self.values = values
+        self.key = key
+        """ hashable (entity, shape, values) - eg, for result caches """
+
+    def clause(self) -> ClauseElement:
+        """ copy of the template, with this request's values bound (ClauseElement.params() is deprecated in 2.1) """
+        if not self.values:
+            return self.template
+        values = self.values
+
+        def bind_value(bind):
+            if bind.key in values:
+                bind.value = values[bind.key]
+                bind.required = False
+        return cloned_traverse(self.template, {"maintain_key": True}, {"bindparam": bind_value})
+
+    def __str__(self):
+        return f"{self.template} {self.values}"
+
+
+def where_clause(filter) -> ClauseElement:
+    """ CompiledFilter, expression or sql string => expression (true() when there is no filter) """
+    if isinstance(filter, CompiledFilter):
+        return filter.clause()
+    if isinstance(filter, ClauseElement):
+        return filter
+    if filter is None or filter == "":
+        return true()
+    return text(filter)
+
+
+_filter_templates: "OrderedDict[tuple, ClauseElement]" = OrderedDict()
+_filter_lock = threading.Lock()
+_attribute_names: dict = {}
+""" model class => {upper case attribute / column name: attribute key} """
+
+
+def compile_filter(clz, shape: tuple, values: list) -> CompiledFilter:
+    """
+    Compiled filter for a filter shape (see _expression_shape), from the LRU template cache
+
+    Args:
+        clz: model class
+        shape (tuple): operators and attribute keys (no values) - ("ALL", node...), ("AND", left, right), ("EQ", "name")
+        values (list): the values, in shape (depth first) order
+    """
+    key = (clz.__name__, shape)
+    with _filter_lock:
+        template = _filter_templates.get(key)
+        if template is not None:
+            _filter_templates.move_to_end(key)
+    if template is None:
+        template = _compile_shape(clz, shape, itertools.count())
+        with _filter_lock:
+            _filter_templates[key] = template
+            while len(_filter_templates) > FILTER_CACHE_SIZE:
+                _filter_templates.popitem(last=False)
+    params = {f"p{i}": value for i, value in enumerate(values)}
+    return CompiledFilter(template, params, (key, tuple(_hashable(value) for value in values)))
+
+
+def _compile_shape(clz, shape: tuple, counter) -> ClauseElement:
+    op = shape[0]
+    if op == "ALL":
+        return AND_(*[_compile_shape(clz, each, counter) for each in shape[1:]])
+    if op in BOOLEAN_OPERATORS:
+        left = _compile_shape(clz, shape[1], counter)
+        if shape[2] is None:
+            return left
+        right = _compile_shape(clz, shape[2], counter)
+        if op == "AND":
+            return AND_(left, right)
+        if op == "OR":
+            return OR_(left, right)
+        return AND_(left, NOT_(right)) if op == "AND_NOT" else OR_(left, NOT_(right))
+    column = getattr(clz, shape[1])
+    if op == "IS_NULL":
+        return column.is_(None)
+    if op == "NOT_NULL":
+        return column.is_not(None)
+    param = bindparam(f"p{next(counter)}", type_=column.type, expanding=op in ("IN", "NOT_IN"))
+    if op == "EQ":
+        return column == param
+    if op == "NE":
+        return column != param
+    if op == "LT":
+        return column < param
+    if op == "LE":
+        return column <= param
+    if op == "GT":
+        return column > param
+    if op == "GE":
+        return column >= param
+    if op == "LIKE":
+        return column.like(param)
+    if op == "ILIKE":
+        return column.ilike(param)
+    if op == "NOT_LIKE":
+        return column.not_like(param)
+    if op == "IN":
+        return column.in_(param)
+    return column.not_in(param)
+
+
+def _expression_shape(clz, expr: dict, sqltypes: dict, values: list, filters: list) -> tuple:
+    """ Ontimize {"lop", "op", "rop"} tree => shape, appending values (and filter dicts) in depth first order """
+    lop = expr["lop"]
+    op = _operator(expr["op"])
+    rop = expr.get("rop")
+    if isinstance(lop, dict):
+        if op not in BOOLEAN_OPERATORS:
+            raise safrs.ValidationError(f'Invalid filter {expr}, unknown operator: {op}')
+        left = _expression_shape(clz, lop, sqltypes, values, filters)
+        right = _expression_shape(clz, rop, sqltypes, values, filters) if isinstance(rop, dict) else None
+        return (op, left, right)
+    return _comparison_shape(clz, lop, op, rop, (sqltypes or {}).get(lop), values, filters)
+
+
+def _comparison_shape(clz, name: str, op: str, value: any, sqltype: int, values: list, filters: list) -> tuple:
+    if op not in COMPARISON_OPERATORS:
+        raise safrs.ValidationError(f'Invalid filter "{name} {op} {value}", unknown operator: {op}')
+    op = COMPARISON_OPERATORS[op]
+    attr_key = _attribute_key(clz, name)
+    if value is None and op in ("EQ", "NE"):
+        op = "IS_NULL" if op == "EQ" else "NOT_NULL"
+    filters.append({"lop": attr_key, "op": op, "rop": value})
+    if op in NULL_OPERATORS:
+        return (op, attr_key)
+    column = getattr(clz, attr_key)
+    if op in ("IN", "NOT_IN"):
+        if isinstance(value, str):
+            value = [v.strip().strip("'\"") for v in value.strip("()[]").split(",")]
+        values.append([_filter_value(column, v, sqltype) for v in value])
+    else:
+        values.append(_filter_value(column, value, sqltype))
+    return (op, attr_key)
+
+
+def _operator(op: str) -> str:
+    return op.strip().upper().replace(" ", "_")
+
+
+def _attribute_key(clz, name: str) -> str:
+    """ attribute key for an attribute or column name (case insensitive, id is the primary key) """
+    names = _attribute_names.get(clz)
+    if names is None:
+        names = {}
+        mapper = inspect(clz)
+        for each_attr in mapper.column_attrs:
+            names[each_attr.columns[0].name.upper()] = each_attr.key
+        for each_attr in mapper.column_attrs:
+            names[each_attr.key.upper()] = each_attr.key
+        names.setdefault("ID", mapper.get_property_by_column(mapper.primary_key[0]).key)
+        _attribute_names[clz] = names
+    attr_key = names.get(f"{name}".strip('"').upper())
+    if attr_key is None:
+        raise safrs.ValidationError(f'Invalid filter, unknown attribute "{name}"')
+    return attr_key
+
+
+def _filter_value(column, value, sqltype: int = None):
+    """ Ontimize value => bind value (epoch milliseconds for DATE (91) / TIMESTAMP (93)) """
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type in (datetime.date, datetime.datetime) or sqltype in (91, 93):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = datetime.datetime.fromtimestamp(value / 1000)
+            return value.date() if sqltype == 91 or python_type is datetime.date else value
+        if isinstance(value, str) and python_type in (datetime.date, datetime.datetime):
+            try:
+                return python_type.fromisoformat(value)
+            except ValueError:
+                return value
+    return value
+
+
+def _hashable(value):
+    return tuple(value) if isinstance(value, list) else value
+
+
 def parsePayload(clz, payload: str):
     """
     Parse the Ontimize payload 
@@ -93,7 +291,7 @@ def parsePayload(clz, payload: str):
         expressions, _filter = advancedFilter(clz, request.args)
     else:
         sqltypes = payload.get("sqltypes") or None
-        expressions, sqlWhere = advancedFilter(clz, payload)
+        expressions = []
         _filter, filter = parseFilter(clz, payload.get("filter", {}), sqltypes)
         columns: list = payload.get("columns") or []
         offset: int = payload.get("offset") or 0
@@ -105,41 +303,23 @@ def parsePayload(clz, payload: str):
 
 
 def parseFilter(clz: any, filter: dict, sqltypes: any):
-    # sourcery skip: merge-duplicate-blocks, remove-pass-elif
+    """
+    Ontimize filter => (CompiledFilter (None if no filter), list of {lop, op, rop} filters)
+
+    @basic_expression, @filter_expression and attribute: value entries must all hold (AND).
+    """
+    values = []
     filters = []
-    sql_where = ""
-    join = ""
-    expr = None
-    for f, value in filter.items():  
-        if f in [BASIC_EXPRESSION]:
-            if expr := ExpressionParser(filter, BASIC_EXPRESSION, sqltypes):
-                sql_where += join + expr.get_sql_where()
-                filters = expr.get_filters()
-                join = " OR "
-        elif f in [FILTER_EXPRESSION]:
-            if expr := ExpressionParser(filter, FILTER_EXPRESSION, sqltypes):
-                sql_where += join + expr.get_sql_where()
-                filters = expr.get_filters()
-                join = " OR "
+    parts = []
+    for f, value in (filter or {}).items():
+        if f in [BASIC_EXPRESSION, FILTER_EXPRESSION]:
+            if value:
+                parts.append(_expression_shape(clz, value, sqltypes, values, filters))
         else:
-            from config.config import Config
-            _quote = '`' if Config.BACKTIC_AS_QUOTE else '"' 
-            attr = ""
-            if f in clz._s_jsonapi_attrs and f != "id":
-                attr = clz._s_jsonapi_attrs[f]._proxy_key
-            elif f == "id":
-                attr = f'{_quote}{clz.__tablename__}{_quote}.{_quote}id{_quote}'
-                _quote = ""
-            elif attr == "":
-                attr =  f'{_quote}{clz.__tablename__}{_quote}.{_quote}{f}{_quote}'
-                _quote = ""
-            q = "'" if isinstance(value, str) else ""
-            sql_where += f'{join} {_quote}{attr}{_quote} = {q}{value}{q}'
-            #name = clz._s_jsonapi_attrs[f] if f !: "id" else clz.id
-            filters.append({"join": join,"lop": attr, "op": "eq", "rop": value})
-            join = " AND "
-            
-    return sql_where, filters
+            parts.append(_comparison_shape(clz, f, "EQ", value, (sqltypes or {}).get(f), values, filters))
+    if not parts:
+        return None, filters
+    return compile_filter(clz, ("ALL", *parts), values), filters
 
 def fixup_sort(clz, data):
     sort = None
@@ -172,103 +352,6 @@ def fixup_data(data, sqltypes):
                 new_data[key] = datetime.fromtimestamp(value / 1000) #.strftime(fmt)  
     return new_data
 
-def _parseFilter(filter: dict, sqltypes: any):
-    # {filter":{"@basic_expression":{"lop":"BALANCE","op":"<=","rop":35000}}
-    filter_result = ""
-    a = ""
-    for f, value in filter.items():
-        q = "'"
-        # {'lop': 'CustomerId', 'op': 'LIKE', 'rop': '%A%'}}
-        if f == BASIC_EXPRESSION and "lop" in value.keys() and "rop" in value.keys():
-                lop = value["lop"]
-                op = value["op"]
-                rop = f"{q}{value['rop']}{q}"
-                return f'"{lop}" {op} {rop}'
-        else:
-            q = "'" if isinstance(value, str) else ""
-        filter_result += f'{a} "{f}" = {q}{value}{q}'
-        a = " and "
-    return None if filter_result == "" else filter_result
-
-class ExpressionHolder():
-    def __init__(self, expr: any, join: str):
-        self.expr = expr
-        self.join = join
-
-class BasicExpression:
-    def __init__(self, lop: any = None, op: str = None, rop: any = None, sqltypes = None):
-        self.lop_ext = []
-        self.rop_ext = []
-        self.sql_where = ""
-        self.join_condition = ""
-        self.sqltypes = sqltypes
-        self.filters = []
-
-        # Left Operator
-        if isinstance(lop, dict):
-            _lop = lop["lop"]
-            _op = lop["lop"]["op"] if hasattr(lop, "op") else lop["op"]
-            _rop = lop["lop"]["rop"] if hasattr(lop, "rop") else lop["rop"]
-
-            be = BasicExpression(_lop, _op, _rop)
-            be.join_condition = _op
-            self.lop_ext.append(be)
-        # Right Operator
-        if isinstance(rop, dict):
-            _lop = rop["lop"]
-            _op = rop["lop"]["op"] if hasattr(rop, "op") else rop["op"]
-            _rop = rop["lop"]["rop"] if hasattr(rop, "rop") else rop["rop"]
-
-            be = BasicExpression(_lop, _op, _rop)
-            be.join_condition = _op
-            self.rop_ext.append(be)
-        #basic {lop: "BALANCE", op: "<=", rop: 35000}
-        attr_name = lop
-        #if attr_name !: "id" and attr_name not in cls._s_jsonapi_attrs:
-        #    raise ValidationError(f'Invalid filter "lop:{lop}, op: {op}, rop: {rop}", unknown attribute "{attr_name}"')
-        #attr = clz._s_jsonapi_attrs[attr_name] if attr_name !: "id" else clz.id
-        ont_op = self.get_ontimize_operator(op)
-        self.lop = attr_name
-        self.op = ont_op
-        self.rop = rop
-
-    def get_ontimize_operator(self, op: str = '='):
-        op_ = op.strip().upper()
-        return ONTIMIZE_OPERATORS[op_] if op_ in ONTIMIZE_OPERATORS else op_
-    
-    def get_sql_where(self):
-        self.where(self)
-        return self.sql_where
-
-    def where(self, expr):
-        if isinstance(expr, BasicExpression):
-            for row in expr.lop_ext:
-                self.where(row)
-            for row in expr.rop_ext:
-                self.where(row)
-
-        if isinstance(expr.lop, str) and not isinstance(expr.rop, dict):
-            self.sql_where += self._parseExpression(expr=expr)
-            self.join_condition = " OR "
-
-    def _parseExpression(self, expr) -> str:
-        if expr.op != None and expr.rop != None:
-            value = expr.rop
-            
-            if self.sqltypes and expr.lop in self.sqltypes and self.sqltypes[expr.lop] in [91,93]:
-                from datetime import datetime
-                if self.sqltypes[expr.lop] == 93:
-                    value = datetime.fromtimestamp(value / 1000).strftime("%Y-%m-%d %H:%M:%S")
-                else:
-                    value = datetime.fromtimestamp(value / 1000).strftime("%Y-%m-%d")
-            q =  "" if expr.is_numeric(value) else "'"
-            
-            self.filters.append({"join": self.join_condition,"lop": expr.lop, "op": expr.op, "rop": f"{q}{value}{q}"})
-            return f'{self.join_condition} "{expr.lop}" {expr.op} {q}{value}{q}'
-        return ""
-
-    def is_numeric(self, value):
-        return False if value and isinstance(value, str) else True 
 def convert_attrname(attrname, attrs):
     return next(
         (a[0] for a in attrs.items() if a[0].upper() == attrname.upper()),
@@ -290,7 +373,7 @@ def advancedFilter(cls, args) -> any:
             if isinstance(item, str):
                 val = json.loads(item)
         except Exception as e:
-            print(f"json load filter item: {item} exception:",e)
+            app_logger.debug(f"filter {req_arg} is not json ({e}), using the value: {item}")
             val = item
             
         if isinstance(val, list):
@@ -305,8 +388,7 @@ def advancedFilter(cls, args) -> any:
                 elif op in ["like","ilike"]:
                     expressions.append(attr.like( item['val']))
                 else:
-                    expressions.append(attr.eq(clean(item['val'])))
-            for e in expressions : print(e," : ", e.right.value)
+                    expressions.append(attr == _unquote(item['val']))
             return expressions, sqlWhere
         else:
             if isinstance(val, dict):
@@ -318,7 +400,7 @@ def advancedFilter(cls, args) -> any:
                     sqlWhere, filters = parseFilter(cls, val['filter'], None)
                     return expressions, sqlWhere
                 elif "@basic_expression" in val:
-                    sqlWhere = _parseFilter(val, None)
+                    sqlWhere, filters = parseFilter(cls, val, None)
                     return expressions, sqlWhere
                 elif req_arg == 'filter[@basic_expression]' or req_arg == 'filter[@BASIC_EXPRESSION]':
                         filters.append({"lop": val['lop'], "op": val["op"], "rop": val["rop"]})
@@ -362,324 +444,22 @@ def advancedFilter(cls, args) -> any:
                 filters.append({"lop": req_arg, "op": "eq", "rop": val})
 
     #query = cls._s_query
-    join =  ""
-    expression_holder= []
+    values = []
+    parts = []
     for flt in filters:
         attr_name = convert_attrname(flt.get("lop"), cls._s_jsonapi_attrs)
-        attr_val = flt.get("rop")
         if attr_name not in ["id","ID","Id"] and attr_name not in cls._s_jsonapi_attrs:
             raise ValidationError(f'Invalid filter "{flt}", unknown attribute "{attr_name}"')
-        if attr_name in ["id","ID","Id"]:
-            for a in cls._s_jsonapi_attrs.items(): 
-                if "primary_key=True" in str(a): 
-                    attr_name = a[0]
-        op_name = flt.get("op", "").strip().upper()
-        if op_name not in ONTIMIZE_OPERATORS:
+        op_name = _operator(flt.get("op", ""))
+        if op_name not in COMPARISON_OPERATORS:
             raise ValidationError(f'Invalid filter {flt}, unknown operator: {op_name}')
-        #join = flt.get("join", "").strip("_").lower()   
-        attr = cls._s_jsonapi_attrs[attr_name] if attr_name != "id" else cls.id 
-        if op_name in ["IN"]:
-            expr = ExpressionHolder(expr=attr.in_(clean(attr_val)), join=join)
-            expression_holder.append(expr)
-        elif op_name in ["LIKE", "ILIKE", "MATCH"]:
-            expressions.append(attr.ilike( clean(attr_val) ))
-            expr = ExpressionHolder(expr=attr.ilike(clean(attr_val)), join=join)
-            expression_holder.append(expr)
-            sqlWhere += f'{join} "{attr_name}" LIKE {clean(attr_val)}'
-        elif op_name in ["NOTLIKE","NOTIN"]:
-            expr = ExpressionHolder(expr=attr.not_in_(clean(attr_val)), join=join)
-            expression_holder.append(expr)
-        elif op_name in ["EQ","NE","LT","LE","GT","GE"]:
-            op = ONTIMIZE_OPERATORS[op_name] if op_name in ONTIMIZE_OPERATORS else "="
-            sqlWhere += f'{join} "{attr_name}" {op} {clean(attr_val)}'
-        elif op_name in ["NULL","IS_NULL","NOTNULL","NOT_NULL"]:
-            op = ONTIMIZE_OPERATORS[op_name] if op_name in ONTIMIZE_OPERATORS else "IS NULL"
-            sqlWhere += f'{join} "{attr_name}" {op}'
-        join = " AND " if join == "" else join
-    final_expr = []
-    expressions = []
-    for expr in expression_holder:
-        join = expr.join
-        expressions.append(expr.expr)
-        if 'or' in join:
-            final_expr.append(OR_(*expr.expr))
-        elif 'and' in join:
-            final_expr.append(AND_(*expr.expr))
-        else:
-            final_expr.append(expr.expr)
-    for e in expressions : print(e," : ", e.right.value)
+        parts.append(_comparison_shape(cls, attr_name, op_name, _unquote(flt.get("rop")), None, values, []))
+    if parts:
+        sqlWhere = compile_filter(cls, ("ALL", *parts), values)
     return expressions, sqlWhere #query.filter(or_(*expressions))
 
-def clean(val):
-    if val and isinstance(val, str) and (val.startswith("'") and val.endswith("'")):
-            return f"'{val[1:-1 ]}'"
-    elif val and isinstance(val, str) and (val.startswith('"') and val.endswith('"')):
-            return f"'{val[1:-1 ]}'"
-    elif val and isinstance(val, str):
-        return  f"'{val}'"
-    else:
-        return val
-            
-class ExpressionParser:
-
-    def __init__(self, filter, expression_type, sqltypes=None):
-        self.basic_expr = None
-        self.filter = self.parse(filter, expression_type)
-        self.build_sql_where(sqltypes)
-        self.expressions = []
-
-    def get_expr(self):
-        # return self.build_sql_where(self.basic_expr) if self.basic_expr else "1=1"
-        self.build_sql_where(self.basic_expr)
-
-    def get_filters(self):
-        return self.basic_expr.filters if self.basic_expr else []
-    
-    def get_expressions(self):
-        return self.basic_expr.expressions if self.basic_expr else []
-    
-    def parse(self, filter, expression_type):
-        if isinstance(filter, dict):
-            return next(
-                (filter[f] for f in filter if f in [expression_type]),
-                None,
-            )
-        return filter
-
-    def get_sql_where(self):
-        return self.basic_expr.get_sql_where() if self.basic_expr else "1=1"
-
-    def build_sql_where(self, sqltypes=None):
-        expr = self.filter
-        if expr is None:
-            return
-        lop = expr["lop"]
-        op = expr["op"].lower()
-        rop = expr["rop"]
-
-        self.basic_expr = BasicExpression(lop, op, rop, sqltypes)
-
-
-if __name__ == "__main__":
-
-    filter =  {
-            "@basic_expression": {
-                "lop": {
-                    "lop": {
-                        "lop": {
-                            "lop": {
-                                "lop": {
-                                    "lop": "FirstName",
-                                    "op": "LIKE",
-                                    "rop": "%St%",
-                                },
-                                "op": "OR",
-                                "rop": {
-                                    "lop": "LastName",
-                                    "op": "LIKE",
-                                    "rop": "%G%",
-                                },
-                            },
-                            "op": "OR",
-                            "rop": {
-                                "lop": "City",
-                                "op": "eq",
-                                "rop": "London",
-                            },
-                        },
-                        "op": "OR",
-                        "rop": {"lop": "Country", "op": "eq", "rop": "UK"},
-                    },
-                    "op": "OR",
-                    "rop": {"lop": "Title", "op": "LIKE", "rop": "Sales%"},
-                },
-                "op": "AND",
-                "rop": {"lop": "LastName", "op": "NOT LIKE", "rop": "%B%"},
-            }
-        }
-    
-    # {'filter': {'@basic_expression': {'lop': {'lop': {'lop': {'lop': {'lop': {'lop': 'EMPLOYEENAME', 'op': 'LIKE', 'rop': '%fort%'}, 'op': 'OR', 'rop': {'lop': 'EMPLOYEESURNAME', 'op': 'LIKE', 'rop': '%fort%'}}, 'op': 'OR', 'rop': {'lop': 'EMPLOYEEADDRESS', 'op': 'LIKE', 'rop': '%fort%'}}, 'op': 'OR', 'rop': {'lop': 'EMPLOYEEEMAIL', 'op': 'LIKE', 'rop': '%fort%'}}, 'op': 'OR', 'rop': {'lop': 'OFFICEID', 'op': 'LIKE', 'rop': '%fort%'}}, 'op': 'AND', 'rop': {'lop': 'EMPLOYEENAME', 'op': 'LIKE', 'rop': '%pamella%'}}}, 'columns': ['EMPLOYEEID', 'EMPLOYEETYPEID', 'EMPLOYEENAME', 'EMPLOYEESURNAME', 'EMPLOYEEADDRESS', 'EMPLOYEESTARTDATE', 'EMPLOYEEEMAIL', 'OFFICEID', 'EMPLOYEEPHOTO', 'EMPLOYEEPHONE', 'NAME'], 'sqltypes': {}, 'offset': 0, 'pageSize': 16, 'orderBy': []}
-    simple = {
-        "filter": {"@basic_expression": {"lop": "BALANCE", "op": "<=", "rop": 35000}}
-    }
-    filter_expr = {
-        "filter": {
-            "@filter_expression": {
-                "lop": {
-                    "lop": {
-                        "lop": {
-                            "lop": {
-                                "lop": "SURNAME",
-                                "op": "=",
-                                "rop": "Christopoulos",
-                            },
-                            "op": "OR",
-                            "rop": {
-                                "lop": "SURNAME",
-                                "op": "=",
-                                "rop": "Vazquez Santos",
-                            },
-                        },
-                        "op": "OR",
-                        "rop": {"lop": "SURNAME", "op": "=", "rop": "Santos Rodríguez"},
-                    },
-                    "op": "OR",
-                    "rop": {"lop": "SURNAME", "op": "=", "rop": "Dominguez "},
-                },
-                "op": "AND",
-                "rop": {
-                    "lop": {"lop": "STARTDATE", "op": "=", "rop": 1279152000000},
-                    "op": "OR",
-                    "rop": {"lop": "STARTDATE", "op": "=", "rop": 1278460800000},
-                },
-            }
-        }
-    }
-    full_expr = {
-        "filter": {
-            "@filter_expression": {
-                "lop": {
-                    "lop": {
-                        "lop": {
-                            "lop": {
-                                "lop": "SURNAME",
-                                "op": "=",
-                                "rop": "Christopoulos",
-                            },
-                            "op": "OR",
-                            "rop": {
-                                "lop": "SURNAME",
-                                "op": "=",
-                                "rop": "Vazquez Santos",
-                            },
-                        },
-                        "op": "OR",
-                        "rop": {"lop": "SURNAME", "op": "=", "rop": "Santos Rodríguez"},
-                    },
-                    "op": "OR",
-                    "rop": {"lop": "SURNAME", "op": "=", "rop": "Dominguez"},
-                },
-                "op": "AND",
-                "rop": {
-                    "lop": {"lop": "STARTDATE", "op": "=", "rop": 1279152000000},
-                    "op": "OR",
-                    "rop": {"lop": "STARTDATE", "op": "=", "rop": 1278460800000},
-                },
-            },
-            "@basic_expression": {
-                "lop": {
-                    "lop": {
-                        "lop": {"lop": "NAME", "op": "LIKE", "rop": "%name%"},
-                        "op": "OR",
-                        "rop": {"lop": "SURNAME", "op": "LIKE", "rop": "%surname%"},
-                    },
-                    "op": "OR",
-                    "rop": {"lop": "EMAIL", "op": "LIKE", "rop": "%email%"},
-                },
-                "op": "OR",
-                "rop": {"lop": "ADDRESS", "op": "LIKE", "rop": "%address%"},
-            },
-        },
-        "columns": [
-            "CUSTOMERID",
-            "NAME",
-            "SURNAME",
-            "ADDRESS",
-            "STARTDATE",
-            "EMAIL",
-            "CUSTOMERTYPEID",
-        ],
-        "sqltypes": {
-            "SURNAME": 12,
-            "CUSTOMERID": 4,
-            "STARTDATE": 93,
-            "ADDRESS": 12,
-            "EMAIL": 12,
-        },
-        "offset": 0,
-        "pageSize": 24,
-        "orderBy": [{"columnName": "SURNAME", "ascendent": False}],
-    }
-    # fltr = json.loads(filter)
-    #ep = ExpressionParser(simple["filter"])
-    #ep = ExpressionParser(filter["filter"])
-    # print(ep.generate_sql_where(filter))
-    # print(ep.get_sql_where())
-    # ep = ExpressionParser(filter_expr["filter"])
-    # print(ep.get_sql_where())
-
-    #filter, columns, sqltypes, offset, pagesize, orderBy, data =  parsePayload(full_expr)
-    #print(filter)
-    
-    ''' TEST CASES
-        No Filter
-        filter[AttrName]=Value (numeric) 	
-            where “AttrName” like :parm_1 [Value]
-        filter[AttrName][like]=”%value%” (string)
-            where “AttrName” like :parm_1 [‘%Value%’]
-        filter[AttrName]=value (date or timestamp)
-            where “AttrName” like :parm_1 [‘YYYY-mm-dd’]
-        filter[AttrName][in]=”(a,b,c)”
-            where “AttrName” in :parm_1 [ ‘(a,b,c)’ ]
-        filter[AttrName]=”Value”&filter[AttrName2]=”%Value1%”  
-            where “AttrName” like :parm_1 or “AttrName2” like :parm_2 [Value,Value1]
-        filter={“lop”:”AttrName”,”op”:”eq”,”rop”:”Value”}
-            where “AttrName” = :parm_1 [value]
-        [{“lop”:”AttrName”,”op”:”ilike”,”val”:”%val%”}] #safrs search
-            where "Attrname" like :parm_1 [‘%val%’]
-
-    '''
-    filter2 = {
-            "@basic_expression": {
-                "lop": {
-                    "lop": {
-                        "lop": {
-                            "lop": {
-                                "lop": {
-                                    "lop": "EMPLOYEENAME",
-                                    "op": "LIKE",
-                                    "rop": "%empname%",
-                                },
-                                "op": "OR",
-                                "rop": {
-                                    "lop": "EMPLOYEESURNAME",
-                                    "op": "LIKE",
-                                    "rop": "%surname%",
-                                },
-                            },
-                            "op": "OR",
-                            "rop": {
-                                "lop": "EMPLOYEEADDRESS",
-                                "op": "LIKE",
-                                "rop": "%address%",
-                            },
-                        },
-                        "op": "OR",
-                        "rop": {"lop": "EMPLOYEEEMAIL", "op": "LIKE", "rop": "%email%"},
-                    },
-                    "op": "OR",
-                    "rop": {"lop": "OFFICEID", "op": "LIKE", "rop": "%officeid%"},
-                },
-                "op": "AND",
-                "rop": {"lop": "EMPLOYEENAME", "op": "LIKE", "rop": "%pamella%"},
-            }
-        }
-    filter = {"filter":{"@filter_expression":{"lop":{"lop":"Id","op":"eq","rop":10259},"op":"and","rop":{"lop":"CustomerId","op":"eq","rop":"CENTC"}}}}
-    filter = 'filter[@basic_expression]={"lop":{"lop":{"lop":{"lop":"NAME","op":"LIKE","rop":"%25ala%25"},"op":"OR","rop":{"lop":"SURNAME","op":"LIKE","rop":"%25ala%25"}},"op":"OR","rop":{"lop":"EMAIL","op":"LIKE","rop":"%25ala%25"}},"op":"OR","rop":{"lop":"ADDRESS","op":"LIKE","rop":"%25ala%25"}}'
-    filter = {"filter":{"@basic_expression":
-        {"lop":{"lop":{"lop":
-            {"lop":"CompanyName","op":"LIKE","rop":"%25Al%25"},"op":"OR","rop":
-                {"lop":"ContactName","op":"LIKE","rop":"%25A%25"}},"op":"OR","rop":
-                    {"lop":"OrderCount","op":"NE","rop": 1}},"op":"OR","rop":
-                        {"lop":"Country","op":"IS_NULL","rop":""}}}}
-    import urllib
-    #print(urllib.parse.quote(json.dumps(filter)))
-    x = urllib.parse.quote("filter[FirstName][like]A")
-    #print(x)
-    # from database.models import models
-    #filter = {"filter": {"@basic_expression": {"lop": "BALANCE", "op": "=", "rop": 35000}}}
-    print(urllib.parse.quote(json.dumps(filter)))
-    sqlWhere, filters, expressions = parseFilter(None, filter,None)
-    print(sqlWhere)
-    print(filters)
-    print(expressions)
\ No newline at end of file
+def _unquote(value):
+    """ 'value' or "value" => value """
+    if isinstance(value, str) and len(value) > 1 and value[0] == value[-1] and value[0] in "'\"":
+        return value[1:-1]
+    return value
@@ -1,12 +1,14 @@
 import json 
 import contextlib
 import logging
-from api.system.expression_parser import parsePayload
+from api.system.expression_parser import parsePayload, parseFilter, where_clause
 from base64 import b64encode
+from sqlalchemy import select
+from sqlalchemy.inspection import inspect
 from sqlalchemy.sql import text
 import safrs
 from io import BytesIO
-from flask import request, jsonify
+from flask import request, jsonify, Response, stream_with_context
     
 
 app_logger = logging.getLogger(__name__)
@@ -14,22 +16,53 @@ app_logger = logging.getLogger(__name__)
 db = safrs.DB 
 session = db.session 
 
+YIELD_PER = 1000
+""" rows fetched per round trip from the server side cursor - and written per response chunk """
+
 def gen_report(api_clz, request, entity, queryParm, columns, columnTitles, attributes) -> any:
-    filter = None #queryParm,get("filter")
+    """
+    Stream the tab separated export: header line, then 1 line per row (ordered by primary key).
+
+    Rows come from a server side cursor (yield_per) and are written in chunks, so memory
+    stays flat however many rows are exported, and the header is sent immediately.
+    """
+    filter, _ = parseFilter(api_clz, queryParm, None) if isinstance(queryParm, dict) else (None, [])
     list_of_columns = []
     for col in columns:
         for attr in attributes:
             if col == attr["name"]:
                 list_of_columns.append(attr['name'])
-    rows = get_rows(api_clz,request, list_of_columns, filter)
-    #from pprint import pprint
-    #print("rows: ", pprint(rows))
-    buffer = BytesIO()
-    buffer.write(bytes('\t'.join(list_of_columns) + '\n', 'utf-8')) 
-    for row in rows["data"]:
-        buffer.write(bytes('\t'.join([str(row[col]) for col in list_of_columns]) + '\n', 'utf-8'))
-
-    return buffer.getvalue()    
+    return Response(stream_with_context(tsv_lines(api_clz, list_of_columns, filter)),
+                    mimetype="text/csv")
+
+
+def tsv_lines(api_clz, list_of_columns: list, filter = None):
+    """
+    Generator of utf-8 chunks: the header, then YIELD_PER rows at a time
+
+    Values are formatted as the Ontimize rows are (Decimal as str, dates as '%Y-%m-%d %H:%M:%S')
+    """
+    from api.system.custom_endpoint import row_serializer
+    yield bytes('\t'.join(list_of_columns) + '\n', 'utf-8')
+    if not list_of_columns:
+        return
+    converters = dict(row_serializer(api_clz, tuple(list_of_columns)).converters)
+    converters = [converters.get(col) for col in list_of_columns]
+    stmt = select(*[getattr(api_clz, col) for col in list_of_columns]) \
+        .order_by(*inspect(api_clz).primary_key) \
+        .execution_options(yield_per=YIELD_PER)
+    if filter is not None:
+        stmt = stmt.where(where_clause(filter))
+    lines = []
+    for row in session.execute(stmt):
+        lines.append('\t'.join([
+            str(value if value is None or converter is None else converter(value))
+            for value, converter in zip(row, converters)]))
+        if len(lines) == YIELD_PER:
+            yield bytes('\n'.join(lines) + '\n', 'utf-8')
+            lines = []
+    if lines:
+        yield bytes('\n'.join(lines) + '\n', 'utf-8')
 
 
 def get_rows(api_clz, request, list_of_columns, filter) -> any:
@@ -1,9 +1,18 @@
-import json 
+import json
 import contextlib
+import hashlib
 import logging
-from api.system.expression_parser import parsePayload
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, Optional
+from api.system.expression_parser import parseFilter, fixup_sort, where_clause
 from base64 import b64encode
-from sqlalchemy.sql import text
+from sqlalchemy import select, func
+from sqlalchemy.inspection import inspect
 import safrs
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
@@ -12,77 +21,71 @@ from reportlab.lib.pagesizes import A4, letter, landscape
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib.units import inch
 from io import BytesIO
-from flask import request, jsonify
+from flask import request, jsonify, copy_current_request_context, send_file, g
 
 app_logger = logging.getLogger(__name__)
 
-db = safrs.DB 
-session = db.session 
+db = safrs.DB
+session = db.session
+
+#####
+# Report engine - rows are fetched in chunks (server side cursor) and laid out as page sized tables,
+# rendered by a background worker pool into an on-disk artifact cache keyed by the query hash.
+# Callers get a handle (the key) to poll (report_status) or download (report_path) as application/pdf.
+#####
+
+REPORT_DIR = Path(os.getenv("APILOGICPROJECT_REPORT_DIR", Path(tempfile.gettempdir()).joinpath("api_logic_server_reports")))
+""" artifact cache: <key>.pdf """
+REPORT_TTL_SECONDS = int(os.getenv("APILOGICPROJECT_REPORT_TTL_SECONDS", "600"))
+""" cached artifacts older than this are rendered again (and pruned) """
+REPORT_WORKERS = int(os.getenv("APILOGICPROJECT_REPORT_WORKERS", "2"))
+REPORT_INLINE_SECONDS = float(os.getenv("APILOGICPROJECT_REPORT_INLINE_SECONDS", "5"))
+""" wait this long for a report before answering with just the handle """
+REPORT_INLINE_MAX_BYTES = 5 * 1024 * 1024
+""" larger reports are not returned inline (base64), only by handle """
+ROWS_PER_TABLE = 40
+""" 1 table per page - ReportLab lays out many small tables much faster than 1 large one """
+YIELD_PER = 1000
+
+TABLE_STYLE = TableStyle([('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+                          ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+                          ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+                          ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+                          ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+                          ('BACKGROUND', (0, 1), (-1, -1), colors.white),
+                          ('GRID', (0, 0), (-1, -1), 1, colors.black)])
+
+_executor: Optional[ThreadPoolExecutor] = None
+_jobs: Dict[str, Future] = {}
+""" key => render in progress (or failed) """
+_lock = threading.Lock()
+
+
 def export_pdf(api_clz, request, entity, queryParm, columns, columnTitles, attributes) -> any:
-    filter = None #queryParm,get("filter")
+    """ export (type pdf): the raw pdf when ready within REPORT_INLINE_SECONDS, else the handle """
+    filter, _ = parseFilter(api_clz, queryParm, None) if isinstance(queryParm, dict) else (None, [])
     list_of_columns = []
     for col in columns:
         for attr in attributes:
             if col == attr["name"]:
                 list_of_columns.append(attr['name'])
-    rows = get_rows(api_clz,request, list_of_columns, filter)
-    
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=landscape(letter))
-    
-    def add_page_number(canvas, doc):
-        page_num = canvas.getPageNumber()
-        text = "Page %s" % page_num
-        canvas.drawRightString(letter[0] - inch, inch, text)
-
-    page_template = PageTemplate(id='my_page_template', frames=[], onPage=add_page_number)
-    #doc.addPageTemplates([page_template])
-    
-    content = []
-
-    # Add title
-    styles = getSampleStyleSheet()
-    title_style = styles["Title"]
-    title = f"PDF Export {entity.upper()} Report" # payload["title"] if 'title' in payload and payload["title"] != '' else f"{entity.upper()} Report"
-    content.append(Paragraph(title, title_style))
-    content.append(Spacer(1, 0.2 * inch)) 
-    # Column Header
-    data = []
-    col_data = []
-    for column in list_of_columns:
-        col_data.append(column)
-        
-    # Define table data (entity)
-    table_data = []
-    table_data.append(col_data)
-    for row in rows['data']:
-        row_data = []
-        for col in list_of_columns:
-            row_data.append(row[col])
-        table_data.append(row_data)
-
-    # Create table
-    table = Table(table_data)
-    table.setStyle(TableStyle([('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                            ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-                            ('GRID', (0, 0), (-1, -1), 1, colors.black)]))
-
-    content.append(table)
-    
-    # Build PDF document
-    doc.build(content)  
-    return buffer.getvalue()
+    spec = {"entity": entity,
+            "title": f"PDF Export {entity.upper()} Report",
+            "columns": [(col, col) for col in list_of_columns],
+            "filter": filter,
+            "landscape": True}
+    key = submit_report(api_clz, spec)
+    path = wait_for_report(key)
+    if path is None:
+        return jsonify({"code": 0, "message": "", "data": [report_status(key)], "sqlTypes": None})
+    return send_file(path, mimetype="application/pdf")
 
 def gen_report(api_clz, request, project_dir, payload, attributes) -> any:
         ''' Report PDF POC https://docs.reportlab.com/
-        pip install reportlab 
-        
+        pip install reportlab
+
         Ontimize Payload:
-        
+
         {"title":"","groups":[],
         "entity":"Customer",
         "path":"/Customer",
@@ -102,114 +105,216 @@ def gen_report(api_clz, request, project_dir, payload, attributes) -> any:
         "style":{'grid': False, 'rowNumber': True, 'columnName': True, 'backgroundOnOddRows': False, 'hideGroupDetails': False, 'groupNewPage': False, 'firstGroupNewPage': False}
         "pageSize":20},
         "advQuery":true}
+
+        Returns the pdf (base64) inline when it is ready within REPORT_INLINE_SECONDS,
+        else {"id", "status", "href"} to poll / download.
         '''
 
-        expression , filter, columns, sqltypes, offset, pagesize, orderBy, data = parsePayload(api_clz, payload)
         if len(payload) == 3:
             return jsonify({})
-        
+
         entity = payload["entity"]
         columns = payload["columns"]
         groups = payload.get("groups", [])
-        style = payload.get("style", {})
+        filters = payload.get("filters") or {}
+        filter, _ = parseFilter(api_clz, filters.get("filter") or payload.get("filter") or {}, filters.get("sqltypes"))
 
-        list_of_columns = []
+        report_columns = []
         for col in columns:
             for attr in attributes:
                 if col['id'] == attr["name"]:
-                    list_of_columns.append(attr['name'])
-        #TODO if groups is not empty, group by the columns - new function
-        rows = get_rows(api_clz,request, list_of_columns, filter, groups)
-        
-        buffer = BytesIO()
-        if payload["vertical"] == "true":
-            doc = SimpleDocTemplate(buffer, pagesize=letter)
-        else:
-            doc = SimpleDocTemplate(buffer, pagesize=landscape(letter))
-        
-        def add_page_number(canvas, doc):
-            page_num = canvas.getPageNumber()
-            text = "Page %s" % page_num
-            canvas.drawRightString(letter[0] - inch, inch, text)
-
-        page_template = PageTemplate(id='my_page_template', frames=[], onPage=add_page_number)
-        #doc.addPageTemplates([page_template])
-        
-        content = []
-
-        # Add title
-        styles = getSampleStyleSheet()
-        title_style = styles["Title"]
+                    report_columns.append((col['id'], col['name']))
         title = payload["title"] if 'title' in payload and payload["title"] != '' else f"{entity.upper()} Report"
-        content.append(Paragraph(title, title_style))
-        content.append(Spacer(1, 0.2 * inch)) 
-        if sub_title := payload.get("subtitle",None):
-            content.append(Paragraph(sub_title, title_style))
-            content.append(Spacer(1, 0.2 * inch)) 
-        # Column Header
-        data = []
-        col_data = []
-        for column in columns:
-            col_data.append(column['name'])
-        
-        if groups and len(groups) > 0:
-            for group in groups:
-                col_data.append('count')
-                columns.append({"id":"count","name":"count"})
-    
-        # Define table data (entity)
-
-        table_data = []
-        table_data.append(col_data)
-        for row in rows['data']:
-            row_data = []
-            for col in columns:
-                row_data.append(row[col["id"]])
-            table_data.append(row_data)
-
-        # Create table
-        table = Table(table_data)
-        table.setStyle(TableStyle([('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                                ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-                                ('GRID', (0, 0), (-1, -1), 1, colors.black)]))
-
-        content.append(table)
-        
-        # Build PDF document
-        doc.build(content)  
-
-        #with open(f"{project_dir}/{entity}.pdf", "wb") as binary_file:
-        #   binary_file.write(buffer.getvalue())
-        
-        output =  b64encode(buffer.getvalue())
-        
-        return {"code": 0,"message": "","data": [{"file":str(output)[2:-1] }],"sqlTypes": None}
-    
-def get_rows(api_clz, request, list_of_columns, filter, groups) -> any:
-    #sql = f"{columns} FROM {entity}"
-    #return session.query(clz).all()
-    key = api_clz.__name__.lower()
-    
-    request.method = 'GET'
-    from api.system.custom_endpoint import CustomEndpoint
-    from sqlalchemy import select, func
-    custom_endpoint = CustomEndpoint(model_class=api_clz, fields=list_of_columns, filter_by=filter)
-    result = custom_endpoint.execute(request=request)
-    if groups and len(groups) > 0:
-        group_by_columns = [getattr(api_clz, group) for group in groups]
-        stmt = session.query(*[getattr(api_clz, col) for col in list_of_columns], func.count().label('count')).group_by(*group_by_columns)
+        spec = {"entity": entity,
+                "title": title,
+                "subtitle": payload.get("subtitle", None),
+                "columns": report_columns,
+                "groups": [group for group in groups or [] if hasattr(api_clz, group)],
+                "order_by": fixup_sort(api_clz, payload.get("orderBy") or filters.get("orderBy")) or [],
+                "filter": filter,
+                "landscape": payload.get("vertical") not in [True, "true"]}
+        key = submit_report(api_clz, spec)
+        path = wait_for_report(key)
+        if path is None or path.stat().st_size > REPORT_INLINE_MAX_BYTES:
+            return {"code": 0, "message": "", "data": [report_status(key)], "sqlTypes": None}
+
+        output = b64encode(path.read_bytes())
+        return {"code": 0,"message": "","data": [{"file":str(output)[2:-1], "id": key }],"sqlTypes": None}
+
+
+def submit_report(api_clz, spec: dict) -> str:
+    """
+    Queue the report on the worker pool, unless it is cached (or already rendering)
+
+    Args:
+        api_clz: model class
+        spec (dict): entity, title, subtitle, columns [(attribute, heading)], groups, order_by, filter, landscape
+
+    Returns:
+        str: the report handle (hash of the query and layout)
+    """
+    key = report_key(spec)
+    path = REPORT_DIR.joinpath(f"{key}.pdf")
+    with _lock:
+        if path.exists() and time.time() - path.stat().st_mtime < REPORT_TTL_SECONDS:
+            return key
+        job = _jobs.get(key)
+        if job is not None and not job.done():
+            return key
+        _prune()
+        render = copy_current_request_context(render_as_requester)  # own session
+        _jobs[key] = _pool().submit(render, request_globals(), key, api_clz, spec)
+    return key
+
+
+def request_globals() -> dict:
+    """
+    The request's g (jwt user, isSA...) for a worker - copy_current_request_context does not carry g
+
+    The user's roles are loaded here, while the request's session is open, since grants read them in the worker.
+    """
+    with contextlib.suppress(Exception):
+        from security.system.authorization import Grant, Security
+        user = Security.current_user()
+        if user:
+            Grant.role_names(user)
+    return {name: g.get(name) for name in g if name != "grant_criteria"}
+
+
+def render_as_requester(request_values: dict, key: str, api_clz, spec: dict) -> Path:
+    """ worker: render_report as the requesting user (same grants) """
+    for name, value in request_values.items():
+        setattr(g, name, value)
+    return render_report(key, api_clz, spec)
+
+
+def wait_for_report(key: str, timeout: float = None) -> Optional[Path]:
+    """ report path once rendered within timeout (default REPORT_INLINE_SECONDS), else None """
+    job = _jobs.get(key)
+    if job is not None:
+        wait([job], timeout=REPORT_INLINE_SECONDS if timeout is None else timeout)
+    return report_path(key)
+
+
+def report_path(key: str) -> Optional[Path]:
+    """ the cached pdf for a handle, None if not (yet) rendered """
+    if not key.isalnum():
+        return None
+    path = REPORT_DIR.joinpath(f"{key}.pdf")
+    return path if path.exists() else None
+
+
+def report_status(key: str) -> dict:
+    """ {"id", "status": done | pending | error | unknown, "href", "message"} """
+    status = {"id": key, "status": "unknown", "href": f"/ontimizeweb/services/rest/report/{key}/pdf"}
+    job = _jobs.get(key)
+    if report_path(key) is not None:
+        status["status"] = "done"
+    elif job is not None and not job.done():
+        status["status"] = "pending"
+    elif job is not None and job.exception() is not None:
+        status["status"] = "error"
+        status["message"] = f"{job.exception()}"
+    return status
+
+
+def report_key(spec: dict) -> str:
+    """ hash of the query and layout (and user - grants filter rows) """
+    user = None
+    with contextlib.suppress(Exception):
+        from security.system.authorization import Security
+        user = getattr(Security.current_user(), "id", None)
+    filter = spec.get("filter")
+    keyed = {**spec, "filter": getattr(filter, "key", filter), "user": user}
+    return hashlib.sha256(json.dumps(keyed, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def render_report(key: str, api_clz, spec: dict) -> Path:
+    """ worker: fetch rows in chunks, 1 table per ROWS_PER_TABLE rows, build into the artifact cache """
+    REPORT_DIR.mkdir(parents=True, exist_ok=True)
+    path = REPORT_DIR.joinpath(f"{key}.pdf")
+    temp_path = REPORT_DIR.joinpath(f"{key}.{threading.get_ident()}.tmp")
+    pagesize = landscape(letter) if spec.get("landscape", True) else letter
+    doc = SimpleDocTemplate(str(temp_path), pagesize=pagesize)
+
+    def add_page_number(canvas, doc):
+        page_num = canvas.getPageNumber()
+        text = "Page %s" % page_num
+        canvas.drawRightString(pagesize[0] - inch, 0.5 * inch, text)
+
+    content = []
+    styles = getSampleStyleSheet()
+    title_style = styles["Title"]
+    content.append(Paragraph(spec["title"], title_style))
+    content.append(Spacer(1, 0.2 * inch))
+    if sub_title := spec.get("subtitle", None):
+        content.append(Paragraph(sub_title, title_style))
+        content.append(Spacer(1, 0.2 * inch))
+
+    header = [name for _, name in spec["columns"]]
+    if spec.get("groups"):
+        header.append('count')
+    table_data = [header]
+    for row in report_rows(api_clz, spec):
+        table_data.append(list(row))
+        if len(table_data) > ROWS_PER_TABLE:
+            content.append(Table(table_data, style=TABLE_STYLE, repeatRows=1))
+            table_data = [header]
+    if len(table_data) > 1 or len(content) <= 2:
+        content.append(Table(table_data, style=TABLE_STYLE, repeatRows=1))
+
+    try:
+        doc.build(content, onFirstPage=add_page_number, onLaterPages=add_page_number)
+        os.replace(temp_path, path)
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            temp_path.unlink()
+    app_logger.debug(f"render_report {spec['entity']} => {path}")
+    return path
+
+
+def report_rows(api_clz, spec: dict):
+    """
+    row tuples (report columns, plus count when grouped), from a server side cursor
+
+    Grouped reports group by every report column (and the groups), as the database requires
+    for selected columns - sorts on other columns are ignored.
+    """
+    attr_names = [attr_name for attr_name, _ in spec["columns"]]
+    columns = [getattr(api_clz, attr_name) for attr_name in attr_names]
+    groups = spec.get("groups")
+    if groups:
+        group_names = attr_names + [group for group in groups if group not in attr_names]
+        stmt = select(*columns, func.count().label('count')).group_by(*[getattr(api_clz, group) for group in group_names])
     else:
-        stmt = session.query(*[getattr(api_clz, col) for col in list_of_columns])
+        stmt = select(*columns)
+    if spec.get("filter") is not None:
+        stmt = stmt.where(where_clause(spec["filter"]))
+    for each_sort in spec.get("order_by") or []:
+        if groups and each_sort["columnName"] not in group_names:
+            continue
+        column = getattr(api_clz, each_sort["columnName"])
+        stmt = stmt.order_by(column.asc() if each_sort.get("ascendent") else column.desc())
+    if not groups:
+        stmt = stmt.order_by(*inspect(api_clz).primary_key)
+    yield from session.execute(stmt.execution_options(yield_per=YIELD_PER))
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=REPORT_WORKERS, thread_name_prefix="pdf_report")
+    return _executor
 
-    if filter:
-        stmt = stmt.filter(text(filter))
 
-    result = stmt.all()
-    for col in result[0]._fields:
-        result = [dict(zip(result[0]._fields, row)) for row in result]
-        break
-    return custom_endpoint.transform("OntimizeEE",key, result)
\ No newline at end of file
+def _prune():
+    """ drop expired artifacts and finished jobs (called under _lock) """
+    for key in [key for key, job in _jobs.items() if job.done()]:
+        _jobs.pop(key)
+    if not REPORT_DIR.exists():
+        return
+    expires = time.time() - REPORT_TTL_SECONDS
+    for each_file in REPORT_DIR.glob("*.pdf"):
+        with contextlib.suppress(FileNotFoundError):
+            if each_file.stat().st_mtime < expires:
+                each_file.unlink()
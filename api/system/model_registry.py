@@ -0,0 +1,101 @@
+"""
+Model Metadata Registry - resource name => model class, attributes, columns and sql types
+
+Built once (from database.models) and then shared by the Ontimize bridge and /metadata,
+so requests do not reflect over the models module.
+"""
+import inspect
+import logging
+import sys
+import threading
+from typing import Dict, List, Optional
+
+app_logger = logging.getLogger(__name__)
+
+MODELS_NAME = "database.models"
+
+
+class ResourceMetadata():
+    """
+    Precomputed metadata for 1 model class (resource)
+    """
+
+    __slots__ = ("name", "model", "attributes", "columns", "types")
+
+    def __init__(self, name: str, model):
+        self.name = name
+        self.model = model
+        self.attributes: List[dict] = []
+        """ getMetaData format: {"name", "attr", "type"} (or {"name", "exception"}) """
+        self.columns: Dict[str, object] = {}
+        """ attribute name => Column """
+        self.types: Dict[str, str] = {}
+        """ attribute name => sql type, eg, INTEGER or VARCHAR(N) """
+        for each_attr in model.__mapper__.attrs:
+            if each_attr._is_relationship:
+                continue
+            try:
+                attribute_object = {"name": each_attr.key,
+                                    "attr": each_attr,
+                                    "type": str(each_attr.expression.type)}
+                self.columns[each_attr.key] = each_attr.columns[0]
+                self.types[each_attr.key] = attribute_object["type"]
+            except Exception as ex:
+                attribute_object = {"name": each_attr.key,
+                                    "exception": f"{ex}"}
+            self.attributes.append(attribute_object)
+
+
+_resources: Optional[Dict[str, ResourceMetadata]] = None
+_lock = threading.Lock()
+
+
+def build() -> Dict[str, ResourceMetadata]:
+    """
+    (Re)build the registry from database.models - called at startup, and on first use
+    """
+    global _resources
+    resources = {}
+    cls_members = inspect.getmembers(sys.modules[MODELS_NAME], inspect.isclass)
+    for each_cls_member in cls_members:
+        each_class_def_str = str(each_cls_member)
+        if (f"'{MODELS_NAME}." in each_class_def_str and
+                        "Ab" not in each_class_def_str):
+            each_resource_name, each_resource_class = each_cls_member
+            resources[each_resource_name] = ResourceMetadata(each_resource_name, each_resource_class)
+    _resources = resources
+    app_logger.debug(f"model_registry - {len(resources)} resources")
+    return resources
+
+
+def resources() -> Dict[str, ResourceMetadata]:
+    """ resource name => ResourceMetadata """
+    if _resources is None:
+        with _lock:
+            if _resources is None:
+                build()
+    return _resources
+
+
+def get_resource(resource_name: str) -> Optional[ResourceMetadata]:
+    """ O(1) lookup - None if resource_name is not a model """
+    return resources().get(resource_name)
+
+
+def get_metadata(resource_name: str = None, include_attributes: bool = True) -> dict:
+    """
+    {"resources": {name: {"attributes": [...], "model": class}}} for 1 / all resources
+    """
+    if resource_name is None:
+        selected = resources().values()
+    else:
+        resource = get_resource(resource_name)
+        selected = [] if resource is None else [resource]
+    resource_objs = {}
+    for each_resource in selected:
+        if include_attributes:
+            resource_objs[each_resource.name] = {"attributes": each_resource.attributes,
+                                                 "model": each_resource.model}
+        else:
+            resource_objs[each_resource.name] = {}
+    return {"resources": resource_objs}
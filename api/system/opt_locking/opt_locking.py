@@ -9,6 +9,8 @@ import logging
 import sqlalchemy
 from sqlalchemy import inspect
 from sqlalchemy import event
+from sqlalchemy.orm.base import NO_VALUE
+from typing import Dict, Optional, Tuple
 from safrs import SAFRSBase
 
 from safrs.util import classproperty
@@ -20,18 +22,52 @@ from config.config import Args as args
 
 logger = logging.getLogger(__name__)
 
+_enabled = False
+""" set by opt_locking_setup (opt_locking not ignored) """
+_version_column: Optional[str] = None
+""" OPT_LOCKING_VERSION_COLUMN - rows with this column use it as their CheckSum """
+_mapper_accessors: Dict[object, tuple] = {}
+""" mapper => (version attribute key, column attribute keys) - see _accessors """
+
 def opt_locking_setup(session):
     """
-    Listen_for read events - set rows' CheckSum property for optimistic locking
+    Enable rows' CheckSum property for optimistic locking
+
+    The CheckSum is computed on first access (see row_checksum), not as rows are read,
+    so reads that are never updated (eg, grid pages) do not pay for it.
 
     Called at Server start (api_logic_server_run)...
     """
-    @event.listens_for(session, 'loaded_as_persistent')
-    def receive_loaded_as_persistent(session, instance):
-        "listen for the 'loaded_as_persistent' (get) event - set CheckSum"
-        checksum_value = checksum_row(instance)
-        logger.debug(f'checksum_value: {checksum_value}')
-        setattr(instance, "_check_sum_property", checksum_value)
+    global _enabled, _version_column
+    _enabled = True
+    _version_column = args.instance.opt_locking_version_column
+    _mapper_accessors.clear()
+    logger.debug(f'opt_locking_setup - version column: {_version_column}')
+
+
+def row_checksum(row: object) -> Optional[str]:
+    """
+    S_CheckSum getter - computed on first access, from the values as read, and retained on the row
+
+    Models with the version column (OPT_LOCKING_VERSION_COLUMN) use its value, without hashing.
+
+    Args:
+        row (object): SQLAlchemy row
+
+    Returns:
+        str: checksum, None for new rows (or when optimistic locking is ignored)
+    """
+    checksum_value = row.__dict__.get("_check_sum_property")
+    if checksum_value is None and _enabled:
+        state = inspect(row)
+        if state.has_identity:
+            version_key, keys = _accessors(state.mapper)
+            if version_key is not None:
+                checksum_value = str(_as_read_value(row, state, version_key))
+            else:
+                checksum_value = checksum([_as_read_value(row, state, each_key) for each_key in keys])
+            setattr(row, "_check_sum_property", checksum_value)
+    return checksum_value
 
 def checksum(list_arg: list) -> str:
     """
@@ -77,22 +113,8 @@ def checksum_row(row: object) -> str:
     Returns:
         int: hash(row attributes), using checksum()
     """
-    inspector = inspect(row)
-    mapper = inspector.mapper
-    iterate_properties = mapper.iterate_properties
-    attr_list = []
-    for each_property in iterate_properties:  # does not include CheckSum
-        if each_property.key == "CheckSum":
-            logger.debug(f'checksum_row (CheckSum) - good place for breakpoint')
-        if isinstance(each_property, sqlalchemy.orm.properties.ColumnProperty):
-            # logger.debug(f'row.property: {each_property} [{getattr(row, each_property.key)}] <{type(each_property)}>')
-            if hasattr(each_property.class_attribute, "key"):
-                attr_list.append(getattr(row, each_property.class_attribute.key))
-            else:
-                debug_stop = f'no key attr - probably @jsonapi_attr'
-    return_value = checksum(attr_list)
-    # logger.debug(f'checksum_row (get) [{return_value}], inspector: {inspector}')
-    return return_value
+    _, keys = _accessors(inspect(row).mapper)
+    return checksum([getattr(row, each_key) for each_key in keys])
 
 def checksum_old_row(logic_row: object) -> str:
     """
@@ -102,20 +124,31 @@ def checksum_old_row(logic_row: object) -> str:
     Returns:
         int: hash(old_row attributes), using checksum()
     """
+    _, keys = _accessors(inspect(logic_row.row).mapper)  # get the mapper from row, values from old_row
+    return checksum([getattr(logic_row.old_row, each_key) for each_key in keys])
+
+
+def _accessors(mapper) -> Tuple[Optional[str], Tuple[str, ...]]:
+    """ (version attribute key or None, column attribute keys) for mapper, computed once """
+    accessors = _mapper_accessors.get(mapper)
+    if accessors is None:
+        keys = []
+        for each_property in mapper.iterate_properties:  # does not include CheckSum
+            if isinstance(each_property, sqlalchemy.orm.properties.ColumnProperty):
+                if hasattr(each_property.class_attribute, "key"):
+                    keys.append(each_property.class_attribute.key)
+                else:
+                    debug_stop = f'no key attr - probably @jsonapi_attr'
+        version_key = _version_column if _version_column in keys else None
+        accessors = (version_key, tuple(keys))
+        _mapper_accessors[mapper] = accessors
+    return accessors
 
-    inspector = inspect(logic_row.row)  # get the mapper from row, values from old_row
-    mapper = inspector.mapper
-    iterate_properties = mapper.iterate_properties
-    attr_list = []
-    for each_property in iterate_properties:  # does not include CheckSum
-        if each_property.key == "CheckSum":
-            logger.debug(f'checksum_row (CheckSum) - good place for breakpoint')
-        if isinstance(each_property, sqlalchemy.orm.properties.ColumnProperty):
-            # logger.debug(f'old_row.property: {each_property} [{getattr(logic_row.old_row, each_property.key)}] <{type(each_property)}>')
-            attr_list.append(getattr(logic_row.old_row, each_property.class_attribute.key))
-    return_value = checksum(attr_list)
-    # logger.debug(f'checksum_row (get) [{return_value}], inspector: {inspector}')
-    return return_value
+
+def _as_read_value(row: object, state, key: str) -> any:
+    """ value as read from the database - the original value, if altered in this session """
+    committed_value = state.committed_state.get(key, NO_VALUE)
+    return getattr(row, key) if committed_value is NO_VALUE else committed_value
 
 
 class ALSError(JsonapiError):
@@ -147,8 +180,14 @@ def opt_lock_patch(logic_row: LogicRow):
         pass
     elif hasattr(logic_row.row, "S_CheckSum"):
         as_read_checksum = logic_row.row.S_CheckSum
-        old_row_checksum = checksum_old_row(logic_row)
-        if as_read_checksum != old_row_checksum:
+        version_key, _ = _accessors(inspect(logic_row.row).mapper)
+        if version_key is not None:
+            old_version = getattr(logic_row.old_row, version_key)
+            old_row_checksum = str(old_version)
+            setattr(logic_row.row, version_key, (old_version or 0) + 1)
+        else:
+            old_row_checksum = checksum_old_row(logic_row)
+        if str(as_read_checksum) != old_row_checksum:
             logger.info(f"optimistic lock failure - as-read vs current: {as_read_checksum} vs {old_row_checksum}")
             raise ALSError(message="Sorry, row altered by another user - please note changes, cancel and retry")
     else:
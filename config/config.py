@@ -104,6 +104,10 @@ class Config:
         BACKTIC_AS_QUOTE = True
         
     ONTIMIZE_SERVICE_TYPE = "OntimizeEE" #  "OntimizeEE" uses the API Bridge / "JSONAPI" / "LAC" | Args.service_type
+    ONTIMIZE_MAX_PAGE_SIZE = 999 # largest pageSize the API Bridge returns
+    ONTIMIZE_COUNT = None # API Bridge totalQueryRecordsNumber: None (999) / "approximate" (planner estimate) / "exact"
+    if os.getenv('ONTIMIZE_COUNT'):  # e.g. export ONTIMIZE_COUNT=approximate
+        ONTIMIZE_COUNT = os.getenv('ONTIMIZE_COUNT')
         
     app_logger.debug(f'config.py - SQLALCHEMY_DATABASE_URI: {SQLALCHEMY_DATABASE_URI}')
 
@@ -185,6 +189,13 @@ class Config:
     # Or enter the n8n_url directly:
     N8N_PRODUCER = {"authorization": f"Basic {token}","n8n_url":"http://localhost:5678/webhook-test/002fa0e8-f7aa-4e04-b4e3-e81aa29c6e69"}  
     N8N_PRODUCER = None # comment out to enable N8N producer
+
+    OUTBOX = False  # True: Kafka / n8n sends from logic are written to the outbox table, and relayed once committed
+    if os.getenv('OUTBOX'):  # e.g. export OUTBOX=true
+        OUTBOX = os.getenv('OUTBOX').lower() in ["true", "yes", "1"]
+    OUTBOX_BATCH_SIZE = 100  # outbox rows relayed per transaction
+    if os.getenv('OUTBOX_BATCH_SIZE'):
+        OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE'))
     # Consumer under consideration
 
     OPT_LOCKING = "optional"
@@ -198,6 +209,12 @@ class Config:
             exit(1)
         app_logger.debug(f'Opt Locking .. overridden from env variable: {OPT_LOCKING}')
 
+    OPT_LOCKING_VERSION_COLUMN = None
+    """ eg, version - models with this (integer) column use it as S_CheckSum, instead of hashing the row """
+    if os.getenv('OPT_LOCKING_VERSION_COLUMN'):  # e.g. export OPT_LOCKING_VERSION_COLUMN=version
+        OPT_LOCKING_VERSION_COLUMN = os.getenv('OPT_LOCKING_VERSION_COLUMN')
+        app_logger.debug(f'Opt Locking version column .. overridden from env variable: {OPT_LOCKING_VERSION_COLUMN}')
+
 
 
 class Args():
@@ -398,6 +415,12 @@ class Args():
         self.flask_app.config["OPT_LOCKING"] = a
 
 
+    @property
+    def opt_locking_version_column(self) -> str:
+        """ version column name (None means hash the row) """
+        return self.flask_app.config.get("OPT_LOCKING_VERSION_COLUMN")
+
+
     @property
     def api_prefix(self) -> str:
         """ uri node for this project (e.g, /api) """
@@ -518,6 +541,16 @@ class Args():
     def n8n_producer(self, a: str):
         self.flask_app.config["N8N_PRODUCER"] = a
 
+    @property
+    def outbox(self) -> bool:
+        """ relay Kafka / n8n sends through the outbox table """
+        return self.flask_app.config.get("OUTBOX", False)
+
+    @property
+    def outbox_batch_size(self) -> int:
+        """ outbox rows relayed per transaction """
+        return self.flask_app.config.get("OUTBOX_BATCH_SIZE", 100)
+
 
     def get_cli_args(self, args: 'Args', dunder_name: str):
         """
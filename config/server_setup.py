@@ -86,6 +86,7 @@ import oracledb
 import integration.kafka.kafka_producer as kafka_producer
 import integration.kafka.kafka_consumer as kafka_consumer
 import integration.n8n.n8n_producer as n8n_producer
+import integration.outbox.outbox as outbox
 
 
 
@@ -343,6 +344,7 @@ def api_logic_server_setup(flask_app: Flask, args: Args):
             kafka_consumer.kafka_consumer(safrs_api = safrs_api)
 
             n8n_producer.n8n_producer()
+            outbox.outbox_relay(flask_app)
 
             SAFRSBase._s_auto_commit = False
             session.close()
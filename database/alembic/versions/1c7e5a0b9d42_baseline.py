@@ -0,0 +1,149 @@
+"""baseline - the medai schema, as created by devops/medai.sql
+
+Revision ID: 1c7e5a0b9d42
+Revises: 
+Create Date: 2026-10-18 08:00:00.000000
+
+Databases created from an earlier devops/medai.sql (no reading_history_patient_day index, no outbox) start here:
+    alembic stamp 1c7e5a0b9d42
+    alembic upgrade head
+
+Databases created from the current devops/medai.sql already have the later revisions:
+    alembic stamp head
+
+(the patient_full_view view is not included)
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1c7e5a0b9d42'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+DRUG_SIDE_EFFECTS = "Nausea, vomiting, diarrhea, gas, weakness, indigestion, abdominal discomfort, headache, " \
+    "metallic taste, muscle pain, heartburn, stomach pain, rash, upper respiratory tract infection, low blood sugar"
+
+DRUGS = [("Metformin", 2000, "mg", "Oral"), ("Glimepiride", 4, "mg", "Oral"), ("Tradjenta", 5, "mg", "Oral"),
+         ("Glargine", 20, "unit", "Injectable"), ("Lispro", 36, "unit", "Injectable"),
+         ("Farxiga", 10, "mg", "Oral"), ("Ozempic", 0.5, "mg", "Injectable")]
+""" drug ids 1..7, as used by recommend_drug """
+
+
+def upgrade():
+    drug_unit = op.create_table('drug_unit',
+        sa.Column('unit_name', sa.String(length=10), primary_key=True),
+    )
+    op.create_table('patient',
+        sa.Column('id', sa.BigInteger(), primary_key=True),
+        sa.Column('name', sa.String(length=256), nullable=False),
+        sa.Column('birth_date', sa.Date()),
+        sa.Column('age', sa.Numeric(10, 1)),
+        sa.Column('weight', sa.BigInteger()),
+        sa.Column('height', sa.BigInteger()),
+        sa.Column('hba1c', sa.Numeric(10, 2)),
+        sa.Column('duration', sa.BigInteger()),
+        sa.Column('ckd', sa.Integer()),
+        sa.Column('cad', sa.Integer()),
+        sa.Column('hld', sa.Integer()),
+        sa.Column('patient_sex', sa.String(length=1), server_default=sa.text("'M'")),
+        sa.Column('creatine_mg_dl', sa.Numeric(10, 4)),
+        sa.Column('medical_record_number', sa.String(length=256)),
+        sa.Column('created_date', sa.DateTime(), server_default=sa.text('now()')),
+    )
+    op.create_table('patient_lab',
+        sa.Column('id', sa.BigInteger(), primary_key=True),
+        sa.Column('patient_id', sa.BigInteger(), sa.ForeignKey('patient.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('lab_name', sa.String(length=256), nullable=False),
+        sa.Column('lab_test_name', sa.String(length=256), nullable=False),
+        sa.Column('lab_test_code', sa.String(length=256)),
+        sa.Column('lab_test_description', sa.Text()),
+        sa.Column('lab_date', sa.Date(), server_default=sa.text('now()')),
+        sa.Column('lab_result', sa.JSON()),
+    )
+    op.create_table('reading',
+        sa.Column('id', sa.BigInteger(), primary_key=True),
+        sa.Column('patient_id', sa.BigInteger(), sa.ForeignKey('patient.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('time_of_reading', sa.String(length=10), nullable=False),
+        sa.Column('reading_value', sa.Numeric(10, 4)),
+        sa.Column('reading_date', sa.Date(), server_default=sa.text('now()')),
+        sa.Column('notes', sa.Text()),
+    )
+    op.create_table('reading_history',
+        sa.Column('id', sa.BigInteger(), primary_key=True),
+        sa.Column('patient_id', sa.BigInteger(), sa.ForeignKey('patient.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('reading_date', sa.Date(), nullable=False),
+        sa.Column('breakfast', sa.Numeric(10, 4)),
+        sa.Column('lunch', sa.Numeric(10, 4)),
+        sa.Column('dinner', sa.Numeric(10, 4)),
+        sa.Column('bedtime', sa.Numeric(10, 4)),
+        sa.Column('notes_for_day', sa.Text()),
+    )
+    drug = op.create_table('drug',
+        sa.Column('id', sa.BigInteger(), primary_key=True),
+        sa.Column('drug_name', sa.String(length=256), nullable=False),
+        sa.Column('dosage', sa.Numeric(10, 4)),
+        sa.Column('dosage_unit', sa.String(length=10), sa.ForeignKey('drug_unit.unit_name')),
+        sa.Column('drug_type', sa.String(length=256)),
+        sa.Column('manufacturer', sa.String(length=256)),
+        sa.Column('side_effects', sa.Text()),
+    )
+    op.create_table('patient_medication',
+        sa.Column('id', sa.BigInteger(), primary_key=True),
+        sa.Column('patient_id', sa.BigInteger(), sa.ForeignKey('patient.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('drug_id', sa.BigInteger(), sa.ForeignKey('drug.id'), nullable=False),
+        sa.Column('dosage', sa.Numeric(10, 4)),
+        sa.Column('dosage_unit', sa.String(length=10), sa.ForeignKey('drug_unit.unit_name')),
+    )
+    op.create_table('recommendation',
+        sa.Column('id', sa.BigInteger(), primary_key=True),
+        sa.Column('patient_id', sa.BigInteger(), sa.ForeignKey('patient.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('time_of_reading', sa.String(length=10), nullable=False),
+        sa.Column('drug_id', sa.BigInteger(), sa.ForeignKey('drug.id'), nullable=False),
+        sa.Column('dosage', sa.Numeric(10, 4)),
+        sa.Column('dosage_unit', sa.String(length=10), sa.ForeignKey('drug_unit.unit_name')),
+        sa.Column('recommendation_date', sa.DateTime(), server_default=sa.text('now()')),
+    )
+    op.create_table('dosage',
+        sa.Column('id', sa.BigInteger(), primary_key=True),
+        sa.Column('drug_id', sa.BigInteger(), sa.ForeignKey('drug.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('drug_name', sa.String(length=256)),
+        sa.Column('drug_type', sa.String(length=256)),
+        sa.Column('min_dose', sa.Numeric(10, 4)),
+        sa.Column('max_dose', sa.Numeric(10, 4)),
+        sa.Column('dosage_unit', sa.String(length=10), sa.ForeignKey('drug_unit.unit_name')),
+        sa.Column('min_age', sa.Numeric(10, 4), server_default=sa.text('18')),
+        sa.Column('max_age', sa.Numeric(10, 4), server_default=sa.text('105')),
+        sa.Column('min_weight', sa.Numeric(10, 4)),
+        sa.Column('max_weight', sa.Numeric(10, 4)),
+        sa.Column('min_creatine', sa.Numeric(10, 4)),
+        sa.Column('max_creatine', sa.Numeric(10, 4)),
+    )
+    op.create_table('contraindication',
+        sa.Column('id', sa.BigInteger(), primary_key=True),
+        sa.Column('drug_id_1', sa.BigInteger(), sa.ForeignKey('drug.id'), nullable=False),
+        sa.Column('drug_id_2', sa.BigInteger(), sa.ForeignKey('drug.id'), nullable=False),
+        sa.Column('description', sa.Text()),
+    )
+    op.create_table('insulin_rules',
+        sa.Column('id', sa.BigInteger(), primary_key=True),
+        sa.Column('blood_sugar_reading', sa.String(length=20), nullable=False),
+        sa.Column('blood_sugar_level', sa.Integer(), nullable=False),
+        sa.Column('glargine_before_dinner', sa.Integer()),
+        sa.Column('lispro_before_breakfast', sa.Integer()),
+        sa.Column('lispro_before_lunch', sa.Integer()),
+        sa.Column('lispro_before_dinner', sa.Integer()),
+    )
+    op.bulk_insert(drug_unit, [{"unit_name": unit_name}
+                               for unit_name in ("mg", "mcg", "ml", "unit", "g", "kg", "l", "oz")])
+    op.bulk_insert(drug, [{"drug_name": drug_name, "dosage": dosage, "dosage_unit": dosage_unit,
+                           "drug_type": drug_type, "manufacturer": "Merck", "side_effects": DRUG_SIDE_EFFECTS}
+                          for drug_name, dosage, dosage_unit, drug_type in DRUGS])
+
+
+def downgrade():
+    for table_name in ('insulin_rules', 'contraindication', 'dosage', 'recommendation', 'patient_medication',
+                       'drug', 'reading_history', 'reading', 'patient_lab', 'patient', 'drug_unit'):
+        op.drop_table(table_name)
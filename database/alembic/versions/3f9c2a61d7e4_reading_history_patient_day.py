@@ -0,0 +1,50 @@
+"""reading_history unique patient day
+
+Revision ID: 3f9c2a61d7e4
+Revises: 1c7e5a0b9d42
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9c2a61d7e4'
+down_revision = '1c7e5a0b9d42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # merge existing duplicates into the latest row per patient / day, so the index can be created
+    op.execute("""
+        WITH merged AS (
+            SELECT patient_id, reading_date, max(id) AS keep_id,
+                   max(breakfast) AS breakfast, max(lunch) AS lunch,
+                   max(dinner) AS dinner, max(bedtime) AS bedtime
+            FROM reading_history
+            GROUP BY patient_id, reading_date
+            HAVING count(*) > 1
+        )
+        UPDATE reading_history rh
+        SET breakfast = COALESCE(rh.breakfast, m.breakfast),
+            lunch = COALESCE(rh.lunch, m.lunch),
+            dinner = COALESCE(rh.dinner, m.dinner),
+            bedtime = COALESCE(rh.bedtime, m.bedtime)
+        FROM merged m
+        WHERE rh.id = m.keep_id
+    """)
+    op.execute("""
+        DELETE FROM reading_history rh
+        USING reading_history newer
+        WHERE newer.patient_id = rh.patient_id
+          AND newer.reading_date = rh.reading_date
+          AND newer.id > rh.id
+    """)
+    op.create_index('reading_history_patient_day', 'reading_history',
+                    ['patient_id', 'reading_date'], unique=True)
+
+
+def downgrade():
+    op.drop_index('reading_history_patient_day', table_name='reading_history')
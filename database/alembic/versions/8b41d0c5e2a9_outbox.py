@@ -0,0 +1,38 @@
+"""outbox table - Kafka / n8n events awaiting relay
+
+Revision ID: 8b41d0c5e2a9
+Revises: 3f9c2a61d7e4
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b41d0c5e2a9'
+down_revision = '3f9c2a61d7e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(sa.schema.CreateSequence(sa.Sequence('outbox_id_seq')))
+    op.create_table('outbox',
+        sa.Column('id', sa.BigInteger(), server_default=sa.text("nextval('outbox_id_seq')"), primary_key=True),
+        sa.Column('channel', sa.String(length=10), nullable=False),
+        sa.Column('topic', sa.String(length=255)),
+        sa.Column('key', sa.String(length=255)),
+        sa.Column('payload', sa.Text()),
+        sa.Column('headers', sa.JSON()),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()')),
+        sa.Column('attempts', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.Column('last_error', sa.Text()),
+        sa.Column('claimed_at', sa.DateTime()),
+        sa.Column('next_attempt_at', sa.DateTime()),
+    )
+
+
+def downgrade():
+    op.drop_table('outbox')
+    op.execute(sa.schema.DropSequence(sa.Sequence('outbox_id_seq')))
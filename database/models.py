@@ -1,5 +1,5 @@
 # coding: utf-8
-from sqlalchemy import BigInteger, Column, Date, DateTime, ForeignKey, Integer, JSON, Numeric, String, Text, text
+from sqlalchemy import BigInteger, Column, Date, DateTime, ForeignKey, Index, Integer, JSON, Numeric, String, Table, Text, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.schema import Sequence
@@ -173,6 +173,9 @@ class Reading(Base):  # type: ignore
 class ReadingHistory(Base):  # type: ignore
     __tablename__ = 'reading_history'
     _s_collection_name = 'ReadingHistory'  # type: ignore
+    __table_args__ = (
+        Index('reading_history_patient_day', 'patient_id', 'reading_date', unique=True),
+    )
 
     id = Column(BigInteger, Sequence('reading_history_id_seq'), primary_key=True)
     patient_id = Column(ForeignKey('patient.id', ondelete='CASCADE'), nullable=False)
@@ -270,3 +273,21 @@ class Recommendation(Base):  # type: ignore
     patient : Mapped["Patient"] = relationship(back_populates=("RecommendationList"))
 
     # child relationships (access children)
+
+
+
+t_outbox = Table(
+    'outbox', Base.metadata,
+    Column('id', BigInteger, Sequence('outbox_id_seq'), primary_key=True),
+    Column('channel', String(10), nullable=False),
+    Column('topic', String(255)),
+    Column('key', String(255)),
+    Column('payload', Text),
+    Column('headers', JSON),
+    Column('created_at', DateTime, server_default=text("now()")),
+    Column('attempts', Integer, nullable=False, server_default=text("0")),
+    Column('last_error', Text),
+    Column('claimed_at', DateTime),
+    Column('next_attempt_at', DateTime)
+)
+""" Kafka / n8n events awaiting relay (integration/outbox) - a Core table, not a model, so it is not exposed in the API """
@@ -22,10 +22,10 @@ def jsonapi_filter(cls):
     sqlWhere = ""
     query = cls._s_query
     if args := request.args:
-        from api.system.expression_parser import advancedFilter
+        from api.system.expression_parser import advancedFilter, where_clause
         expressions, sqlWhere = advancedFilter(cls, args)
     if sqlWhere != "":    
-        return query.filter(text(sqlWhere))
+        return query.filter(where_clause(sqlWhere))
     else:
         return query.filter(or_(*expressions))   
 
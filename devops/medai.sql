@@ -14,6 +14,8 @@ DROP TABLE IF EXISTS recommendation;
 DROP TABLE IF EXISTS drug;
 DROP TABLE IF EXISTS drug_unit;
 DROP TABLE IF EXISTS patient;
+DROP TABLE IF EXISTS outbox;
+DROP SEQUENCE IF EXISTS outbox_id_seq;
 
 create table drug_unit(
 	unit_name VARCHAR(10) PRIMARY KEY
@@ -79,6 +81,8 @@ create table reading_history (
 	notes_for_day TEXT,
 	FOREIGN KEY (patient_id) REFERENCES patient(id) ON DELETE CASCADE
 );
+-- one history row per patient per day (upsert target for readings)
+create unique index reading_history_patient_day on reading_history (patient_id, reading_date);
 -- Drug 
 
 create table drug (
@@ -162,6 +166,23 @@ create table insulin_rules (
         lispro_before_dinner INT
 );
 
+-- Kafka / n8n events awaiting relay (integration/outbox), if OUTBOX specified in Config.py
+create sequence outbox_id_seq;
+
+create table outbox (
+	id BIGINT PRIMARY KEY DEFAULT nextval('outbox_id_seq'),
+	channel VARCHAR(10) NOT NULL, -- kafka or n8n
+	topic VARCHAR(255),
+	key VARCHAR(255),
+	payload TEXT,
+	headers JSON,
+	created_at TIMESTAMP DEFAULT now(),
+	attempts INT NOT NULL DEFAULT 0,
+	last_error TEXT,
+	claimed_at TIMESTAMP, -- set while a relay delivers the row
+	next_attempt_at TIMESTAMP -- failed rows: not relayed before (exponential backoff)
+);
+
 
 CREATE VIEW patient_full_view AS
 SELECT 
@@ -1,21 +1,31 @@
 """
 
-Version 2.1
+Version 2.2
 
 Invoked at server start (api_logic_server_run.py -> config/setup.py)
 
 Connect to Kafka, if KAFKA_CONNECT specified in Config.py
 
+Messages are queued locally, and handed to the producer by a background thread,
+which also serves delivery reports - so logic events never block on the broker.
+With OUTBOX enabled, messages from logic are written to the outbox instead (see integration/outbox).
+
 You do not normally need to alter this file
 
 """
 from config.config import Args
 from confluent_kafka import Producer
+import atexit
+import os
+import queue
 import socket
 import logging
+import threading
+import time
 from logic_bank.exec_row_logic.logic_row import LogicRow
 from integration.system.RowDictMapper import RowDictMapper
-from flask import jsonify
+from integration.system import json_encoder
+import integration.outbox.outbox as outbox
 from confluent_kafka import Producer, KafkaException
 import api.system.api_utils as api_utils
 
@@ -25,7 +35,26 @@ producer = None
 conf = None
 """ filled from config (KAFKA_CONNECT) """
 
-logger = logging.getLogger('integration.n8n')
+PRODUCER_DEFAULTS = {"linger.ms": 20, "batch.num.messages": 1000, "queue.buffering.max.messages": 100000}
+""" batching defaults, overridden by KAFKA_PRODUCER settings """
+
+QUEUE_SIZE = int(os.getenv("APILOGICPROJECT_KAFKA_QUEUE_SIZE", "10000"))
+""" messages awaiting the producer thread - when full, messages are dropped (and logged), not waited for """
+
+POLL_SECONDS = 0.1
+FLUSH_SECONDS = 10.0
+""" at shutdown, wait this long for queued messages to be delivered """
+
+stats = {"queued": 0, "delivered": 0, "failed": 0, "dropped": 0}
+""" message counts, since server start (see _count) """
+_stats_lock = threading.Lock()
+
+_queue: queue.Queue = queue.Queue(maxsize=QUEUE_SIZE)
+""" (topic, key, value) """
+_stop = threading.Event()
+_thread: threading.Thread = None
+
+logger = logging.getLogger('integration.kafka')
 logger.debug("kafka_connect imported")
 
 def kafka_producer():
@@ -34,19 +63,122 @@ def kafka_producer():
 
     Enabled by config.KAFKA_CONNECT (dict, of bootstrap.servers, client.id)
 
+    Starts the producer thread, and flushes at shutdown.
+
     Args:
         none
     """
 
-    global producer, conf
+    global producer, conf, _thread
     if Args.instance.kafka_producer:
-        conf = Args.instance.kafka_producer
+        conf = {**PRODUCER_DEFAULTS, **Args.instance.kafka_producer}
         if "client.id" not in conf:
             conf["client.id"] = socket.gethostname()
         # conf = {'bootstrap.servers': 'localhost:9092', 'client.id': socket.gethostname()}
         producer = Producer(conf)
+        _stop.clear()
+        _thread = threading.Thread(target=_deliver, name="kafka_producer", daemon=True)
+        _thread.start()
+        atexit.register(flush)
         logger.debug(f'\nKafka producer connected')
 
+
+def flush(timeout: float = FLUSH_SECONDS) -> int:
+    """
+    Stop the producer thread, and wait for queued messages to be delivered (eg, at shutdown)
+
+    Args:
+        timeout (float): seconds to wait. Defaults to FLUSH_SECONDS.
+
+    Returns:
+        int: number of messages not delivered
+    """
+    if producer is None:
+        return 0
+    deadline = time.monotonic() + timeout
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout)
+    remaining = producer.flush(max(0.0, deadline - time.monotonic())) + _queue.qsize()
+    if remaining:
+        logger.error(f"kafka_producer#flush: {remaining} messages not delivered")
+    return remaining
+
+
+def produce_now(messages: list, timeout: float = FLUSH_SECONDS) -> list:
+    """
+    Produce messages and wait for their delivery (e.g., the outbox relay) - bypasses the local queue
+
+    Args:
+        messages (list): (topic, key, value) tuples
+        timeout (float): seconds to wait for delivery. Defaults to FLUSH_SECONDS.
+
+    Returns:
+        list: per message, None if delivered, else the error
+    """
+    if producer is None:
+        return ["Kafka not enabled"] * len(messages)
+    errors = ["not delivered"] * len(messages)
+    def on_delivery(index):
+        def delivered(err, msg):
+            errors[index] = None if err is None else str(err)
+        return delivered
+    for index, (topic, key, value) in enumerate(messages):
+        while True:
+            try:
+                producer.produce(topic=topic, key=key, value=value, on_delivery=on_delivery(index))
+                break
+            except BufferError:  # producer queue full - wait for deliveries
+                producer.poll(POLL_SECONDS)
+            except KafkaException as ke:
+                errors[index] = str(ke)
+                break
+    producer.flush(timeout)
+    return errors
+
+
+def _deliver():
+    """ producer thread: hand queued messages to the producer, and serve delivery reports (poll) """
+    while not (_stop.is_set() and _queue.empty()):
+        try:
+            topic, key, value = _queue.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            producer.poll(0)
+            continue
+        while True:
+            try:
+                producer.produce(topic=topic, key=key, value=value, on_delivery=_on_delivery)
+                break
+            except BufferError:  # producer queue full - wait for deliveries
+                producer.poll(POLL_SECONDS)
+            except KafkaException as ke:
+                _count("failed")
+                logger.error(f"kafka_producer#produce error on topic {topic}: {ke}")
+                break
+        producer.poll(0)
+
+
+def _on_delivery(err, msg):
+    """ delivery report, from producer.poll """
+    if err is not None:
+        _count("failed")
+        logger.error(f"kafka_producer delivery failed on topic {msg.topic()}: {err}")
+    else:
+        _count("delivered")
+
+
+def _count(name: str):
+    """ stats[name] += 1 - from callers' threads and the producer thread """
+    with _stats_lock:
+        stats[name] += 1
+
+
+def _message_key(kafka_key: object) -> object:
+    """ str / bytes key, eg, the primary key dict as json """
+    if kafka_key is None or isinstance(kafka_key, (str, bytes)):
+        return kafka_key
+    return json_encoder.dumps(kafka_key)
+
 from sqlalchemy.inspection import inspect
 
 def get_primary_key(logic_row: LogicRow):
@@ -69,9 +201,11 @@ def send_kafka_message(kafka_topic: str, kafka_key: str = None, msg: str="", jso
 
     * Typically called from declare_logic event
 
+    Queued for the producer thread - does not wait for the broker.
+
     Args:
         logic_row (LogicRow): root data to be sent
-        row_dict_mapper (RowDictMapper): typically subclass of RowDictMapper, transforms row to dict
+        row_dict_mapper (RowDictMapper): typically subclass of RowDictMapper, transforms row to dict (shared instance)
         kafka_topic (str): the kafka topic
         kafka_key (str): the kafka key
         msg (str, optional): string to log
@@ -82,9 +216,9 @@ def send_kafka_message(kafka_topic: str, kafka_key: str = None, msg: str="", jso
     if isinstance(payload, dict):
         row_obj_dict = payload
     elif row_dict_mapper is not None:
-        row_obj_dict = row_dict_mapper().row_to_dict(row = logic_row.row)
+        row_obj_dict = row_dict_mapper.instance().row_to_dict(row = logic_row.row)
     elif row_dict_mapper is None:
-        row_obj_dict = RowDictMapper(model_class=logic_row.row.__class__).row_to_dict(row = logic_row.row)
+        row_obj_dict = RowDictMapper.instance(logic_row.row.__class__).row_to_dict(row = logic_row.row)
     else:
         raise ValueError(f"send_kafka_message payload type not supported: {type(payload)}") 
 
@@ -95,20 +229,23 @@ def send_kafka_message(kafka_topic: str, kafka_key: str = None, msg: str="", jso
         else:
             root_name = logic_row.name
 
-    if kafka_key is None:
+    if kafka_key is None and logic_row is not None:
         kafka_key = get_primary_key(logic_row) 
 
     log_msg = msg if msg != "" else f"Sending {root_name} to Kafka topic '{kafka_topic}'" 
 
-    json_string = jsonify({f'{root_name}': row_obj_dict}).data.decode('utf-8')
-    log_msg = log_msg
-    if producer:  # enabled in config/config.py?
+    json_string = json_encoder.dumps({f'{root_name}': row_obj_dict})
+    if producer and logic_row is not None and outbox.enabled():  # sent once committed
+        outbox.add_event(logic_row.session, "kafka", kafka_topic, json_string, key=_message_key(kafka_key))
+        log_msg += " [via outbox]"
+    elif producer:  # enabled in config/config.py?
         try:
-            producer.produce(value=json_string, topic="order_shipping", key=kafka_key)
-            if logic_row:
-                logic_row.log(log_msg)
-        except KafkaException as ke:
-            logger.error("kafka_producer#send_kafka_message error: {ke}") 
+            _queue.put_nowait((kafka_topic, _message_key(kafka_key), json_string))
+            _count("queued")
+        except queue.Full:
+            _count("dropped")
+            log_msg += " [Note: **Kafka queue full - message dropped** ]"
+            logger.error(f"kafka_producer#send_kafka_message queue full ({QUEUE_SIZE}) - dropped message for topic '{kafka_topic}'")
     else:
         log_msg += " [Note: **Kafka not enabled** ]"
     if logic_row is not None:
@@ -1,22 +1,34 @@
 """
 
-Version 1.1
+Version 1.2
 
 Invoked at server start (api_logic_server_run.py -> config/setup.py)
 
 Connect to n8n, if N8N_CONNECT specified in Config.py
 
+Webhooks are queued, and posted by background workers over a keep-alive connection pool
+(with retry / backoff) - so logic events (and their commits) do not wait for n8n.
+With OUTBOX enabled, webhooks from logic are written to the outbox instead (see integration/outbox).
+
 You do not normally need to alter this file
 
 """
+import atexit
+import os
+import queue
+import threading
+import time
 import traceback
 import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import inspect
 from config.config import Args
 import json
 import logging
 from logic_bank.exec_row_logic.logic_row import LogicRow
 from integration.system.RowDictMapper import RowDictMapper
-from flask import jsonify
+from integration.system import json_encoder
+import integration.outbox.outbox as outbox
 import api.system.api_utils as api_utils
 from config.config import Args
 
@@ -26,6 +38,28 @@ producer = None
 conf = None
 """ filled from config (N8N_CONNECT) """
 
+MAX_CONCURRENCY = int(os.getenv("APILOGICPROJECT_N8N_MAX_CONCURRENCY", "4"))
+""" worker threads (and pooled connections) - the most webhooks in flight at once """
+QUEUE_SIZE = int(os.getenv("APILOGICPROJECT_N8N_QUEUE_SIZE", "10000"))
+""" webhooks awaiting a worker - when full, webhooks are dropped (and logged), not waited for """
+TIMEOUT_SECONDS = float(os.getenv("APILOGICPROJECT_N8N_TIMEOUT_SECONDS", "10"))
+RETRIES = 3
+BACKOFF_SECONDS = 0.5
+""" retry n waits BACKOFF_SECONDS * 2**n """
+FLUSH_SECONDS = 10.0
+""" at shutdown, wait this long for queued webhooks """
+
+stats = {"queued": 0, "coalesced": 0, "sent": 0, "failed": 0, "dropped": 0}
+""" webhook counts, since server start (updated under _lock) """
+
+_session: requests.Session = None
+_queue: queue.Queue = queue.Queue(maxsize=QUEUE_SIZE)
+""" keys of _pending, in arrival order """
+_pending = {}
+""" key => webhook (dict) - a row's later event replaces its queued webhook (coalesce) """
+_lock = threading.Lock()
+_workers = []
+
 logger = logging.getLogger('integration.n8n')
 logger.debug("n8n_connect imported")
 
@@ -35,6 +69,8 @@ def n8n_producer():
 
     Enabled by config.KAFKA_CONNECT (dict, of bootstrap.servers, client.id)
 
+    Starts the webhook workers, and flushes at shutdown.
+
     Args:
         none
     """
@@ -44,14 +80,126 @@ def n8n_producer():
         conf = Args.instance.n8n_producer
         producer = conf
         # good place to do defaults, get api keys, etc
+        _start_workers()
+        atexit.register(flush)
         logger.debug('N8N producer initialized')
 
 
+def post_webhook(webhook: dict) -> requests.Response:
+    """
+    Post / get the webhook now, on the pooled session, retrying connection errors, 429 and 5xx with backoff
+
+    Args:
+        webhook (dict): http_method, wh_state, wh_entity, body (json string, or None)
+
+    Returns:
+        requests.Response: the last response (None if n8n could not be reached)
+    """
+    headers = {
+        "Authorization": conf['authorization'],
+        "Content-Type": "application/json",
+        "wh_state": webhook["wh_state"],
+        "wh_entity": webhook["wh_entity"]
+    }
+    endpoint = f'{conf["n8n_url"]}'
+    http_method = webhook["http_method"].lower()
+    if http_method not in {"post", "get"}:
+        logger.error(f"n8n_producer: http_method: {webhook['http_method']} not implemented")
+        return None
+    response = None
+    for each_try in range(RETRIES + 1):
+        if each_try > 0:
+            time.sleep(BACKOFF_SECONDS * 2 ** (each_try - 1))
+        try:
+            if http_method == "post":
+                #Only passing payload in this example
+                response = _get_session().post(endpoint, data=webhook["body"], headers=headers, timeout=TIMEOUT_SECONDS)
+            else:
+                response = _get_session().get(endpoint, headers=headers, timeout=TIMEOUT_SECONDS)
+        except requests.RequestException as e:
+            logger.warning(f"n8n_producer: try {each_try + 1} fails with: {e}")
+            response = None
+            continue
+        if response.status_code != 429 and response.status_code < 500:
+            break
+    if response is None or response.status_code != 200:
+        logger.error(f"n8n_producer: status_code: {None if response is None else response.status_code}")
+    return response
+
+
+def flush(timeout: float = FLUSH_SECONDS) -> int:
+    """ wait for queued webhooks to be sent (eg, at shutdown) - returns the number not sent """
+    deadline = time.monotonic() + timeout
+    while _queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return _queue.unfinished_tasks
+
+
+def _get_session() -> requests.Session:
+    """ 1 keep-alive session, with a connection per worker """
+    global _session
+    if _session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENCY)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _session = session
+    return _session
+
+
+def _start_workers():
+    with _lock:
+        if _workers:
+            return
+        for each_worker in range(MAX_CONCURRENCY):
+            worker = threading.Thread(target=_work, name=f"n8n_producer_{each_worker}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+
+def _work():
+    """ worker thread: post queued webhooks """
+    while True:
+        key = _queue.get()
+        try:
+            with _lock:
+                webhook = _pending.pop(key)
+            response = post_webhook(webhook)
+            with _lock:
+                stats["sent" if response is not None and response.status_code == 200 else "failed"] += 1
+        except Exception as e:
+            with _lock:
+                stats["failed"] += 1
+            logger.error(f"\nn8n_producer fails with: {e}")
+            logger.error(traceback.format_exc())
+        finally:
+            _queue.task_done()
+
+
+def _enqueue(key: object, webhook: dict) -> dict:
+    """ queue webhook - replacing the queued webhook with the same key (same row and state) """
+    with _lock:
+        if key in _pending:
+            _pending[key] = webhook
+            stats["coalesced"] += 1
+            return {"status_code": 202, "coalesced": True}
+        try:
+            _queue.put_nowait(key)
+        except queue.Full:
+            stats["dropped"] += 1
+            logger.error(f"n8n_producer: queue full ({QUEUE_SIZE}) - dropped webhook for {webhook['wh_entity']}")
+            return {"status_code": 503}
+        _pending[key] = webhook
+        stats["queued"] += 1
+    return {"status_code": 202}
+
+
 def send_n8n_message(http_method: str = "POST", ins_upd_dlt: str = "ins", msg: str = "",
         wh_entity: str = "unknown",
         logic_row: LogicRow = None, 
         row_dict_mapper: RowDictMapper = None, 
-        payload: dict = None) -> any:
+        payload: dict = None,
+        blocking: bool = False) -> any:
     """ Send N8N webhook message regarding [logic_row, mapped by row_dict_mapper or by  payload]
 
     * Typically called from declare_logic event
@@ -64,6 +212,8 @@ def send_n8n_message(http_method: str = "POST", ins_upd_dlt: str = "ins", msg: s
         row_dict_mapper (RowDictMapper): (Optional) typically subclass of RowDictMapper, transforms row to dict
         payload (str): (Optional) JSON data to be sent as string (json.dumps(row.to_dict()))    
         wh_entity (str): the webhook entity name pass in header
+        blocking (bool): send now, and return the response.  Default is to queue it for the workers,
+            returning {"status_code": 202} (503 if the queue is full)
     """
 
     global conf
@@ -75,51 +225,41 @@ def send_n8n_message(http_method: str = "POST", ins_upd_dlt: str = "ins", msg: s
         return "send_n8n_message: payload, logic_row, row_dict_mapper are all None - must provide one"
     row_obj_dict = None
     if isinstance(payload, dict):
-        row_obj_dict = json.dumps(payload)
+        row_obj_dict = json.dumps(payload, default=json_encoder.json_default)
     elif logic_row is not None:
-        row_obj_dict = json.dumps(logic_row.row.to_dict())
+        row_obj_dict = json.dumps(logic_row.row.to_dict(), default=json_encoder.json_default)
     elif row_dict_mapper is not None:
-        row_obj_dict = row_dict_mapper().row_to_dict(row = logic_row.row)
+        row_obj_dict = row_dict_mapper.instance().row_to_dict(row = logic_row.row)
     elif row_dict_mapper is None:
-        row_obj_dict = RowDictMapper(model_class=logic_row.row.__class__).row_to_dict(row = logic_row.row)
+        row_obj_dict = RowDictMapper.instance(logic_row.row.__class__).row_to_dict(row = logic_row.row)
     elif payload is None and http_method.lower() == "post":
         raise ValueError(f"send_n8n_message payload type not supported: {type(payload)}") 
 
     wh_state =  ins_upd_dlt if logic_row is None else logic_row.ins_upd_dlt
     wh_entity = logic_row.row.__class__.__name__ if logic_row else wh_entity
     try:
+        body = None
         if row_obj_dict is not None:
-            json_payload = jsonify(f'{row_obj_dict}').data.decode('utf-8')
+            body = json.dumps(row_obj_dict, default=json_encoder.json_default)
             msg = f"Webhook send_n8n_message: http_method: {http_method} wh_state: {wh_state} wh_entity: {wh_entity}"
-            logger.debug(f'\n\n{msg}\n{json_payload}')
-        
-        status = {"status_code": 500}
+            logger.debug(f'\n\n{msg}\n{body}')
 
         if conf is None:
             logger.debug(f"n8n_producer: not configured in config/Config.py")
-        else:
-            headers = {
-                "Authorization": conf['authorization'],
-                "Content-Type": "application/json",
-                "wh_state": wh_state,
-                "wh_entity": wh_entity
-            }
-            endpoint = f'{conf["n8n_url"]}'
-            status = {"status_code": 500}
-            if http_method in {"post", "POST"}:
-                #Only passing payload in this example
-                status = requests.post(endpoint, json=row_obj_dict, headers=headers)
-            elif http_method.lower() == "get":
-                status = requests.get(endpoint, headers=headers)
-            elif http_method.lower() in {"put", "patch", "delete"}:
-                logger.error(f"n8n_producer: http_method: {http_method} not implemented")
-
-            if status and status.status_code != 200:
-                logger.error(f"n8n_producer: status_code: {status.status_code}")
-        return status
+            return {"status_code": 500}
+        webhook = {"http_method": http_method, "wh_state": wh_state, "wh_entity": wh_entity, "body": body}
+        if not blocking and logic_row is not None and outbox.enabled():  # sent once committed
+            outbox.add_event(logic_row.session, "n8n", wh_entity, body,
+                             headers={"http_method": http_method, "wh_state": wh_state})
+            return {"status_code": 202, "outbox": True}
+        if blocking:
+            return post_webhook(webhook)
+        _start_workers()
+        identity = None if logic_row is None else inspect(logic_row.row).identity
+        key = object() if identity is None else (http_method.lower(), wh_state, wh_entity, identity)  # same row & state coalesce
+        return _enqueue(key, webhook)
     except Exception as e:
         logger.error(f"\nn8n_producer fails with: {e}")
         long_message = traceback.format_exc()
         logger.error(long_message)
         return long_message
-
@@ -0,0 +1,181 @@
+"""
+
+Version 1.0
+
+Transactional outbox for Kafka / n8n sends, if OUTBOX specified in Config.py
+
+Logic events write their messages to the outbox table, in the same transaction as the rows
+(so a rollback sends nothing, and the commit does not wait on the broker).
+A background relay (started at server start) claims them in batches, sends them outside any transaction,
+then deletes each row once delivered: delivery is at-least-once.
+
+You do not normally need to alter this file
+
+"""
+import datetime
+import logging
+import threading
+import time
+import traceback
+from sqlalchemy import delete, func, insert, or_, select, update
+from config.config import Args
+from database import models
+
+RETRY_SECONDS = 1
+""" failed rows wait RETRY_SECONDS * 2 ** attempts (at most RETRY_MAX_SECONDS) before they are relayed again """
+RETRY_MAX_SECONDS = 3600
+""" longest wait between attempts - rows are retried until delivered (or deleted) """
+ALERT_ATTEMPTS = 10
+""" rows failing this often are logged as errors on each further failure (see last_error, next_attempt_at) """
+CLAIM_SECONDS = 300
+""" claimed rows not finished within this (e.g., the relaying server stopped) are relayed again """
+POLL_SECONDS = 1.0
+""" relay wait when the outbox is (nearly) empty, or nothing could be delivered """
+
+stats = {"relayed": 0, "failed": 0}
+""" outbox row counts, since server start """
+
+_thread: threading.Thread = None
+
+logger = logging.getLogger('integration.outbox')
+
+
+def enabled() -> bool:
+    """ Kafka / n8n sends from logic go through the outbox (config OUTBOX) """
+    return bool(Args.instance.outbox)
+
+
+def add_event(session, channel: str, topic: str, payload: str, key: str = None, headers: dict = None):
+    """
+    Write an event to the outbox, in session's transaction - relayed once committed
+
+    Args:
+        session: SQLAlchemy session (e.g., logic_row.session)
+        channel (str): kafka or n8n
+        topic (str): kafka topic, or n8n wh_entity
+        payload (str): message (json string)
+        key (str, optional): kafka key
+        headers (dict, optional): n8n http_method, wh_state
+    """
+    if isinstance(key, bytes):
+        key = key.decode("utf-8")
+    session.connection().execute(insert(models.t_outbox).values(
+        channel=channel, topic=topic, key=key, payload=payload, headers=headers))
+
+
+def outbox_relay(flask_app):
+    """
+    Called by api_logic_server_run>server_setup to start the relay thread, if OUTBOX is enabled
+
+    Args:
+        flask_app: for the database engine (app context)
+    """
+    global _thread
+    if not enabled() or _thread is not None:
+        return
+    _thread = threading.Thread(target=_relay, args=(flask_app, Args.instance.outbox_batch_size),
+                               name="outbox_relay", daemon=True)
+    _thread.start()
+    logger.debug('Outbox relay started')
+
+
+def relay_batch(engine, batch_size: int) -> tuple:
+    """
+    Send up to batch_size outbox rows (oldest first)
+
+    Rows are claimed (skip locked, claimed_at set) and committed before delivery, so no locks or
+    transaction are held while Kafka / n8n respond, and several servers can relay the same outbox.
+    Delivered rows are then deleted; failed rows have attempts incremented, their claim released,
+    and next_attempt_at set (exponential backoff), so a Kafka / n8n outage does not exhaust them.
+
+    Returns:
+        tuple: (rows read, rows delivered)
+    """
+    with engine.begin() as connection:
+        rows = claim_batch(connection, batch_size)
+    if not rows:
+        return 0, 0
+    errors = _deliver_kafka([row for row in rows if row.channel == "kafka"])
+    errors.update(_deliver_n8n([row for row in rows if row.channel == "n8n"]))
+    with engine.begin() as connection:
+        delivered = finish_batch(connection, rows, errors)
+    return len(rows), delivered
+
+
+def claim_batch(connection, batch_size: int) -> list:
+    """ lock up to batch_size unclaimed (or expired) rows due for an attempt, and mark them claimed - commit before delivery """
+    table = models.t_outbox
+    rows = connection.execute(select(table)
+                              .where(or_(table.c.next_attempt_at.is_(None), table.c.next_attempt_at <= func.now()))
+                              .where(or_(table.c.claimed_at.is_(None),
+                                         table.c.claimed_at < func.now() - datetime.timedelta(seconds=CLAIM_SECONDS)))
+                              .order_by(table.c.id)
+                              .limit(batch_size)
+                              .with_for_update(skip_locked=True)).all()
+    if rows:
+        connection.execute(update(table).where(table.c.id.in_([row.id for row in rows])).values(claimed_at=func.now()))
+    return rows
+
+
+def finish_batch(connection, rows: list, errors: dict) -> int:
+    """ delete claimed rows that were delivered, release the others for a later retry - returns rows delivered """
+    table = models.t_outbox
+    delivered = [row.id for row in rows if row.id in errors and errors[row.id] is None]
+    if delivered:
+        connection.execute(delete(table).where(table.c.id.in_(delivered)))
+    for row in rows:
+        error = errors.get(row.id, f"unknown channel {row.channel}")
+        if error is not None:
+            retry_seconds = min(RETRY_SECONDS * 2 ** row.attempts, RETRY_MAX_SECONDS)
+            connection.execute(update(table).where(table.c.id == row.id)
+                               .values(attempts=table.c.attempts + 1, last_error=str(error), claimed_at=None,
+                                       next_attempt_at=func.now() + datetime.timedelta(seconds=retry_seconds)))
+            if row.attempts + 1 >= ALERT_ATTEMPTS:
+                logger.error(f"outbox row {row.id} ({row.channel} {row.topic}) failed {row.attempts + 1} times, "
+                             f"retry in {retry_seconds}s: {error}")
+    stats["relayed"] += len(delivered)
+    stats["failed"] += len(rows) - len(delivered)
+    return len(delivered)
+
+
+def _relay(flask_app, batch_size: int):
+    """ relay thread: per batch, a claim transaction, delivery, then a finish transaction """
+    import safrs
+    with flask_app.app_context():
+        engine = safrs.DB.engine
+    while True:
+        read, delivered = 0, 0
+        try:
+            read, delivered = relay_batch(engine, batch_size)
+        except Exception as e:
+            logger.error(f"outbox relay fails with: {e}\n{traceback.format_exc()}")
+        if read < batch_size or delivered == 0:
+            time.sleep(POLL_SECONDS)
+
+
+def _deliver_kafka(rows: list) -> dict:
+    """ row id => None if delivered, else the error """
+    if not rows:
+        return {}
+    import integration.kafka.kafka_producer as kafka_producer
+    errors = kafka_producer.produce_now([(row.topic, row.key, row.payload) for row in rows])
+    return {row.id: error for row, error in zip(rows, errors)}
+
+
+def _deliver_n8n(rows: list) -> dict:
+    """ row id => None if delivered, else the error """
+    if not rows:
+        return {}
+    import integration.n8n.n8n_producer as n8n_producer
+    errors = {}
+    for row in rows:
+        headers = row.headers or {}
+        webhook = {"http_method": headers.get("http_method", "POST"), "wh_state": headers.get("wh_state"),
+                   "wh_entity": row.topic, "body": row.payload}
+        if n8n_producer.conf is None:
+            errors[row.id] = "n8n not enabled"
+            continue
+        response = n8n_producer.post_webhook(webhook)
+        errors[row.id] = None if response is not None and response.status_code == 200 \
+            else f"status_code: {None if response is None else response.status_code}"
+    return errors
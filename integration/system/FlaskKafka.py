@@ -1,24 +1,63 @@
 import signal
 import threading, time
 import logging
+import os
 import sys
 import signal
-from confluent_kafka import Producer, KafkaException, Consumer
+from concurrent.futures import ThreadPoolExecutor, wait
+from confluent_kafka import Producer, KafkaException, Consumer, TopicPartition
 
 ####
 # adapted from and thanks to: https://pypi.org/project/flask-kafka
 ####
 
 logger = logging.getLogger('integration.kafka')
-__version__ = "1.01"
+__version__ = "1.02"
+
+BATCH_SIZE = int(os.getenv("APILOGICPROJECT_KAFKA_CONSUMER_BATCH_SIZE", "100"))
+""" messages per consume() """
+WORKERS = int(os.getenv("APILOGICPROJECT_KAFKA_CONSUMER_WORKERS", str(os.cpu_count() or 1)))
+""" partitions handled concurrently - messages of a partition are always handled in order """
+DEAD_LETTER_TOPIC = os.getenv("APILOGICPROJECT_KAFKA_DEAD_LETTER_TOPIC", "als_dead_letter")
+""" messages whose handler fails are sent here (with the error in the headers) - empty to just log them """
+FLUSH_SECONDS = 10.0
+CONSUMER_SETTINGS = ("group.id", "group.instance.id", "enable.auto.commit", "auto.commit.interval.ms",
+                     "enable.auto.offset.store", "auto.offset.reset", "session.timeout.ms", "heartbeat.interval.ms",
+                     "max.poll.interval.ms", "partition.assignment.strategy", "isolation.level", "enable.partition.eof",
+                     "fetch.min.bytes", "fetch.max.bytes", "fetch.wait.max.ms", "max.partition.fetch.bytes",
+                     "queued.min.messages", "queued.max.messages.kbytes", "check.crcs", "on_commit")
+""" Consumer conf keys left out of the dead letter Producer conf (which keeps the connection, SASL and SSL settings) """
 
 class FlaskKafka():
+    """
+    Consume subscribed topics in batches, handled by a pool of worker threads
+
+    Each batch is split by partition; a partition's messages are handled in order, by 1 worker.
+    Offsets are committed once the batch is handled.  A handler exception does not stop consumption:
+    the message goes to the dead letter topic.  If it cannot be dead lettered, its partition is not
+    committed past it, and is sought back to it, so it is consumed (and handled) again.
+
+    Args:
+        interrupt_event (Event): set to stop consuming
+        conf (dict): confluent_kafka Consumer settings (enable.auto.commit is set False)
+        safrs_api (object): passed to handlers
+        batch_size (int): messages per consume(). Defaults to BATCH_SIZE.
+        workers (int): worker threads. Defaults to WORKERS.
+        dead_letter_topic (str): topic for failed messages. Defaults to DEAD_LETTER_TOPIC.
+    """
     def __init__(self, interrupt_event: object, conf: dict, safrs_api: object, **kw):
         self.consumer = None  # create consumer KafkaConsumer(**kw)
         self.handlers={}
         self.interrupt_event = interrupt_event
         self.conf = conf
         self.safrs_api = safrs_api
+        self.batch_size = kw.get("batch_size", BATCH_SIZE)
+        self.workers = kw.get("workers", WORKERS)
+        self.dead_letter_topic = kw.get("dead_letter_topic", DEAD_LETTER_TOPIC)
+        self.dead_letter_producer = None
+        self._dead_letters = {}
+        """ (topic, partition) => {offset: delivered} - this batch's dead letters """
+        self._dead_letters_lock = threading.Lock()
 
 
     def _add_handler(self, topic, handler):
@@ -38,16 +77,62 @@ class FlaskKafka():
             return f
         return decorator
 
-    def _run_handlers(self, msg):
+    def _run_handlers(self, msg) -> bool:
+        """ run msg's topic handlers - on exception, send msg to the dead letter topic
+
+        Returns:
+            bool: True if handled or dead lettered (False: msg must be consumed again)
+        """
         try:
             handlers = self.handlers[msg.topic()]
             for handler in handlers:
                 handler(msg = msg, safrs_api = self.safrs_api)
-            # self.consumer.commit()
+            return True
         except Exception as e:
-            logger.critical(str(e), exc_info=1)
-            # self.consumer.close()
-            sys.exit("Exited due to exception")
+            logger.error(f"FlaskKafka handler failed - topic: {msg.topic()}, partition: {msg.partition()}, offset: {msg.offset()}: {e}", exc_info=1)
+            return self._dead_letter(msg, e)
+
+    def _run_partition(self, messages: list) -> TopicPartition:
+        """ worker: 1 partition's messages (of a batch), in order, up to the first that cannot be dead lettered
+
+        Returns:
+            TopicPartition: offset to commit (the next message to consume)
+        """
+        for msg in messages:
+            if not self._run_handlers(msg):
+                return TopicPartition(msg.topic(), msg.partition(), msg.offset())
+        return TopicPartition(messages[-1].topic(), messages[-1].partition(), messages[-1].offset() + 1)
+
+    def _dead_letter(self, msg, error: Exception) -> bool:
+        """ produce msg to the dead letter topic - delivery is checked in _commit
+
+        Returns:
+            bool: False if not produced
+        """
+        if not self.dead_letter_topic:
+            return True
+        origin = (msg.topic(), msg.partition())
+        offset = msg.offset()
+        try:
+            headers = list(msg.headers() or []) + [("error", str(error)), ("topic", msg.topic()),
+                                                   ("partition", str(msg.partition())), ("offset", str(offset))]
+            with self._dead_letters_lock:
+                self._dead_letters.setdefault(origin, {})[offset] = False
+            self.dead_letter_producer.produce(topic=self.dead_letter_topic, key=msg.key(), value=msg.value(), headers=headers,
+                                              on_delivery=lambda err, _: self._dead_lettered(origin, offset, err))
+            self.dead_letter_producer.poll(0)
+            return True
+        except (KafkaException, BufferError) as ke:
+            logger.critical(f"FlaskKafka unable to dead letter message from topic {msg.topic()} offset {offset}: {ke}")
+            return False
+
+    def _dead_lettered(self, origin: tuple, offset: int, err):
+        """ dead letter delivery report (from poll / flush) """
+        if err is not None:
+            logger.critical(f"FlaskKafka dead letter not delivered - topic: {origin[0]}, partition: {origin[1]}, offset: {offset}: {err}")
+            return
+        with self._dead_letters_lock:
+            self._dead_letters.setdefault(origin, {})[offset] = True
 
     def signal_term_handler(self, signal, frame):
         logger.info("closing consumer")
@@ -56,23 +141,55 @@ class FlaskKafka():
 
 
     def _start(self):
-        """ thread target (from _run) """
-
-        # thanks: https://www.reddit.com/r/learnpython/comments/gfg97m/how_do_i_run_a_function_every_5_seconds_inside_a/
+        """ thread target (from _run) - consume batches until interrupt_event """
 
         topics = self.handlers.keys()
-        logger.info(f" - FlaskKafka._start: begin polling (v {__version__}), with \n -- conf: {self.conf} \n -- topics: {topics}")
-        consumer = Consumer(self.conf)
+        logger.info(f" - FlaskKafka._start: begin polling (v {__version__}), with \n -- conf: {self.conf} \n -- topics: {topics}"
+                    f"\n -- batch_size: {self.batch_size}, workers: {self.workers}, dead_letter_topic: {self.dead_letter_topic}")
+        consumer = Consumer({**self.conf, "enable.auto.commit": False})
+        self.consumer = consumer
+        if self.dead_letter_topic:
+            self.dead_letter_producer = Producer({key: value for key, value in self.conf.items() if key not in CONSUMER_SETTINGS})
         consumer.subscribe(topics=list(topics))
-        while True:
-            msg = consumer.poll(1.0)
-            logger.debug(f' - KafkaConnect._start - consuming consumer.poll(1.0): {msg}')
-            if msg is None:
-                continue
-            if msg.error():
-                pass  # Handle errors as needed
-            else:
-                self._run_handlers(msg)  # accrued per annotations
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="kafka_consumer") as pool:
+            while not self.interrupt_event.is_set():
+                messages = consumer.consume(num_messages=self.batch_size, timeout=1.0)
+                if not messages:
+                    continue
+                logger.debug(f' - FlaskKafka._start - consumed {len(messages)} messages')
+                partitions = {}
+                for msg in messages:
+                    if msg.error():
+                        logger.error(f"FlaskKafka consume error: {msg.error()}")
+                        continue
+                    partitions.setdefault((msg.topic(), msg.partition()), []).append(msg)
+                futures = [pool.submit(self._run_partition, each_messages) for each_messages in partitions.values()]
+                wait(futures)
+                self._commit(consumer, partitions, [each_future.result() for each_future in futures])
+        consumer.close()
+        logger.info("FlaskKafka consumer closed")
+
+    def _commit(self, consumer, partitions: dict, offsets: list):
+        """ commit the batch's offsets (from _run_partition), once its dead letters are delivered
+
+        A partition with a message that was not dead lettered (or delivered) is committed, and sought back, to that message.
+        """
+        if self.dead_letter_producer is not None and self.dead_letter_producer.flush(FLUSH_SECONDS):
+            logger.critical(f"FlaskKafka dead letters not delivered to {self.dead_letter_topic} in {FLUSH_SECONDS} seconds")
+        with self._dead_letters_lock:
+            dead_letters, self._dead_letters = self._dead_letters, {}
+        for each_offset in offsets:
+            undelivered = [offset for offset, delivered in dead_letters.get((each_offset.topic, each_offset.partition), {}).items()
+                           if not delivered and offset < each_offset.offset]
+            if undelivered:
+                each_offset.offset = min(undelivered)
+            if each_offset.offset <= partitions[(each_offset.topic, each_offset.partition)][-1].offset():
+                logger.warning(f"FlaskKafka consuming again from topic {each_offset.topic}, partition {each_offset.partition}, offset {each_offset.offset}")
+                consumer.seek(TopicPartition(each_offset.topic, each_offset.partition, each_offset.offset))
+        try:
+            consumer.commit(offsets=offsets, asynchronous=False)
+        except KafkaException as ke:
+            logger.error(f"FlaskKafka commit failed: {ke}")  # eg, rebalance
 
 
     def listen_kill_server(self):
@@ -6,7 +6,8 @@ from sqlalchemy.ext.declarative import declarative_base
 from flask_sqlalchemy.model import DefaultMeta
 from sqlalchemy.ext.hybrid import hybrid_property
 import flask_sqlalchemy
-from typing import Any, Optional, Tuple
+from typing import Any, Callable, Dict, Optional, Tuple
+from operator import attrgetter
 from sqlalchemy.orm import object_mapper
 from typing_extensions import Self  # from typing import Self  # requires python 3.11
 import logging
@@ -14,6 +15,9 @@ from logic_bank.exec_row_logic.logic_row import LogicRow
 
 logger = logging.getLogger('integration.kafka')
 
+LOOKUP_CHUNK_SIZE = 500
+""" max values per IN, for prefetch_lookups """
+
 # version 1.1
 
 def json_to_entities(from_row: str | object, to_row):
@@ -30,50 +34,43 @@ def json_to_entities(from_row: str | object, to_row):
     :return: updates to_row with contents of from_row (recursively for lists)
     """
 
-    def get_attr_name(mapper, attr)-> Tuple[Optional[Any], str]:
-        """ returns name, type of SQLAlchemy attr metadata object """
-        attr_name = None
-        attr_type = "attr"
-        if hasattr(attr, "key"):
-            attr_name = attr.key
-        elif isinstance(attr, hybrid_property):
-            attr_name = attr.__name__
-        elif hasattr(attr, "__name__"):
-            attr_name = attr.__name__
-        elif hasattr(attr, "name"):
-            attr_name = attr.name
-        if attr_name == "OrderDetailListX" or attr_name == "CustomerX":
-            print("Debug Stop")
-        if isinstance(attr, sqlalchemy.orm.relationships.RelationshipProperty):   # hasattr(attr, "impl"):   # sqlalchemy.orm.relationships.RelationshipProperty
-            if attr.uselist:
-                attr_type = "list"
-            else: # if isinstance(attr.impl, sqlalchemy.orm.attributes.ScalarObjectAttributeImpl):
-                attr_type = "object"
-        return attr_name, attr_type
-
-    row_mapper = object_mapper(to_row)
+    plan = _entity_plan(to_row)
     for each_attr_name in from_row:
-        if hasattr(to_row, each_attr_name):
-            for each_attr in row_mapper.attrs:
-                mapped_attr_name, mapped_attr_type = get_attr_name(row_mapper, each_attr)
-                if mapped_attr_name == each_attr_name:
-                    if mapped_attr_type == "attr":
-                        value = from_row[each_attr_name]
-                        setattr(to_row, each_attr_name, value)
-                    elif mapped_attr_type == "list":
-                        child_from = from_row[each_attr_name]
-                        for each_child_from in child_from:
-                            child_class = each_attr.entity.class_
-                            # #als add child to parent list
-                            # eachOrderDetail = OrderDetail(); order.OrderDetailList.append(eachOrderDetail)
-                            child_to = child_class()  # instance of child (e.g., OrderDetail)
-                            json_to_entities(each_child_from, child_to)
-                            child_list = getattr(to_row, each_attr_name)
-                            child_list.append(child_to)
-                            pass
-                    elif mapped_attr_type == "object":
-                        logger.debug("a parent object - skip (future - lookups here?)")
-                    break
+        attr_plan = plan.get(each_attr_name)
+        if attr_plan is None:
+            continue
+        mapped_attr_type, child_class = attr_plan
+        if mapped_attr_type == "attr":
+            value = from_row[each_attr_name]
+            setattr(to_row, each_attr_name, value)
+        elif mapped_attr_type == "list":
+            child_from = from_row[each_attr_name]
+            child_list = getattr(to_row, each_attr_name)
+            for each_child_from in child_from:
+                # #als add child to parent list
+                # eachOrderDetail = OrderDetail(); order.OrderDetailList.append(eachOrderDetail)
+                child_to = child_class()  # instance of child (e.g., OrderDetail)
+                json_to_entities(each_child_from, child_to)
+                child_list.append(child_to)
+        elif mapped_attr_type == "object":
+            logger.debug("a parent object - skip (future - lookups here?)")
+
+
+_entity_plans: Dict[type, dict] = {}
+
+
+def _entity_plan(row: object) -> dict:
+    """ cached json_to_entities plan for the row's class: attr name => (attr | list | object, child class) """
+    plan = _entity_plans.get(type(row))
+    if plan is None:
+        plan = {}
+        for each_attr in object_mapper(row).attrs:
+            if isinstance(each_attr, sqlalchemy.orm.relationships.RelationshipProperty):
+                plan[each_attr.key] = ("list" if each_attr.uselist else "object", each_attr.entity.class_)
+            else:
+                plan[each_attr.key] = ("attr", None)
+        _entity_plans[type(row)] = plan
+    return plan
 
 
 def rows_to_dict(result: flask_sqlalchemy.BaseQuery) -> list:
@@ -105,6 +102,72 @@ def rows_to_dict(result: flask_sqlalchemy.BaseQuery) -> list:
     return rows
 
 
+class MappingPlan():
+    """
+    Compiled row_to_dict for 1 RowDictMapper, and (recursively) its related mappers.
+
+    Attribute getters, renames and child plans are resolved once, so converting
+    a row is a loop of function calls.
+    """
+
+    __slots__ = ("use_to_dict", "fields", "related")
+
+    def __init__(self, row_dict_mapper: 'RowDictMapper', use_to_dict: bool):
+        self.use_to_dict = use_to_dict
+        """ no fields declared (on the root mapper) - use safrs to_dict """
+        self.fields: list[tuple[str, Callable]] = []
+        """ (dict name, getter) """
+        self.related: list[tuple[Callable, str, str, MappingPlan]] = []
+        """ (getter, alias, list | object | combined, plan) """
+        if not use_to_dict:
+            for each_field in row_dict_mapper.fields:
+                if isinstance(each_field, tuple):
+                    if isinstance(each_field[0], sqlalchemy.orm.attributes.InstrumentedAttribute):
+                        getter = attrgetter(each_field[0].name)
+                    else:
+                        getter = _constant(each_field[0])
+                    self.fields.append((each_field[1], getter))
+                else:
+                    if isinstance(each_field, str):
+                        logger.info("Coding error - you need to use TUPLE for attr/alias")
+                    self.fields.append((each_field.name, attrgetter(each_field.name)))
+        related_list = row_dict_mapper.related
+        if isinstance(related_list, list) is False:
+            related_list = [related_list]
+        for each_related in related_list:
+            child_property_name = each_related.role_name
+            if child_property_name == '':
+                child_property_name = "OrderList"  # TODO default from class name
+            kind = "list"
+            if each_related.isParent:
+                kind = "combined" if each_related.isCombined else "object"
+            self.related.append((attrgetter(child_property_name), each_related.alias, kind,
+                                 MappingPlan(each_related, use_to_dict)))
+
+    def __call__(self, row) -> dict:
+        if self.use_to_dict:
+            row_as_dict = row.to_dict()
+        else:
+            row_as_dict = {name: getter(row) for name, getter in self.fields}
+        for getter, alias, kind, plan in self.related:
+            related = getter(row)
+            if kind == "list":
+                row_as_dict[alias] = [plan(each_child) for each_child in related]
+            elif kind == "combined":
+                row_as_dict.update(plan(related))
+            else:
+                row_as_dict[alias] = plan(related)
+        return row_as_dict
+
+
+def _constant(value) -> Callable:
+    return lambda row: value
+
+
+_mappers: Dict[type, 'RowDictMapper'] = {}
+""" RowDictMapper subclass (or model class, for RowDictMapper itself) => shared instance """
+
+
 class RowDictMapper():
     """
     Services to support App Integration -- Column renames, Joins, Foreign Keys Lookups, etc.
@@ -169,6 +232,33 @@ class RowDictMapper():
             return f"Alias {self.alias} -- Model: {self._model_class.__name__}, lookup: {self.lookup}, is_parent: {self.isParent}" 
 
 
+    @classmethod
+    def instance(cls, model_class: type[DefaultMeta] | None = None) -> Self:
+        """shared instance of this mapper, with its plan compiled (once) - eg, for send_kafka_message
+
+        Args:
+            model_class (DefaultMeta, optional): required for RowDictMapper itself (not for subclasses)
+
+        Returns:
+            RowDictMapper: cls() - or RowDictMapper(model_class=model_class)
+        """
+        key = model_class if cls is RowDictMapper else cls
+        row_dict_mapper = _mappers.get(key)
+        if row_dict_mapper is None:
+            row_dict_mapper = cls(model_class=model_class) if cls is RowDictMapper else cls()
+            row_dict_mapper.mapping_plan()
+            _mappers[key] = row_dict_mapper
+        return row_dict_mapper
+
+
+    def mapping_plan(self) -> MappingPlan:
+        """ MappingPlan for this mapper, compiled on first use (so define fields / related before converting) """
+        plan = self.__dict__.get("_mapping_plan")
+        if plan is None:
+            plan = self._mapping_plan = MappingPlan(self, use_to_dict = len(self.fields) == 0)
+        return plan
+
+
     def row_to_dict(self, row: object, current_endpoint: 'RowDictMapper' = None) -> dict:
         """returns row as dict per RowDictMapper definition, with subobjects
 
@@ -179,61 +269,36 @@ class RowDictMapper():
         Returns:
             dict: row formatted as dict
         """
-        custom_endpoint = self
-        if current_endpoint is not None:
-            custom_endpoint = current_endpoint
-        row_as_dict = {}
-        if len(self.fields) == 0:
-            # logger.info(f'No fields defined for {self._model_class.__name__}')
-            row_as_dict = row.to_dict()
-        else:
-            for each_field in custom_endpoint.fields:
-                if isinstance(each_field, tuple):
-                    value = "unknown"
-                    if isinstance(each_field[0], sqlalchemy.orm.attributes.InstrumentedAttribute):
-                        value = getattr(row, each_field[0].name)
-                    else:
-                        value = each_field[0]
-                    row_as_dict[each_field[1]] = value
-                else:
-                    if isinstance(each_field, str):
-                        logger.info("Coding error - you need to use TUPLE for attr/alias")
-                    row_as_dict[each_field.name] = getattr(row, each_field.name)
-            
-        custom_endpoint_related_list = custom_endpoint.related
-        if isinstance(custom_endpoint_related_list, list) is False:
-            custom_endpoint_related_list = []
-            custom_endpoint_related_list.append(custom_endpoint.related)
-        for each_related in custom_endpoint_related_list:
-            child_property_name = each_related.role_name
-            if child_property_name == '':
-                child_property_name = "OrderList"  # TODO default from class name
-            if child_property_name.startswith('Product'):
-                debug = 'good breakpoint'
-            row_dict_child_list = getattr(row, child_property_name)
-            if each_related.isParent:
-                the_parent = getattr(row, child_property_name)
-                the_parent_to_dict = self.row_to_dict(row = the_parent, current_endpoint = each_related)
-                if each_related.isCombined:
-                    for each_attr_name, each_attr_value in the_parent_to_dict.items():
-                        row_as_dict[each_attr_name] = each_attr_value
-                else:
-                    row_as_dict[each_related.alias] = the_parent_to_dict
-            else:
-                row_as_dict[each_related.alias] = []
-                for each_child in row_dict_child_list:
-                    each_child_to_dict = self.row_to_dict(row = each_child, current_endpoint = each_related)
-                    row_as_dict[each_related.alias].append(each_child_to_dict)
-        return row_as_dict
+        if current_endpoint is not None and current_endpoint is not self:
+            return MappingPlan(current_endpoint, use_to_dict = len(self.fields) == 0)(row)
+        return self.mapping_plan()(row)
+
+
+    def rows_to_dicts(self, rows) -> list[dict]:
+        """returns rows as dicts per RowDictMapper definition - batch row_to_dict, for bulk integration
+
+        Args:
+            rows (iterable): SQLAlchemy rows, eg, a query result
+
+        Returns:
+            list[dict]: rows formatted as dicts
+        """
+        plan = self.mapping_plan()
+        return [plan(each_row) for each_row in rows]
     
 
-    def dict_to_row(self, row_dict: dict, session: object, current_endpoint: 'RowDictMapper' = None) -> object:
+    def dict_to_row(self, row_dict: dict, session: object, current_endpoint: 'RowDictMapper' = None,
+                    lookup_cache: dict = None, prefetch: bool = True) -> object:
         """Returns SQLAlchemy row(s), converted from dict per RowDictMapper definition
 
+        Parent lookups are cached for the message, so 500 lines for the same Drug run 1 query.
+
         Args:
             row_dict (dict): multi-object dict, typically from request data
             session (session): FlaskSQLAlchemy session
             current_endpoint (RowDictMapper, optional): omit (internal recursion use)
+            lookup_cache (dict, optional): parent lookups for this message (default: new per call)
+            prefetch (bool, optional): resolve all the payload's lookups first, 1 IN query per parent class
 
         Returns:
             object: SQLAlchemy row / sub-rows, ready to insert
@@ -245,6 +310,10 @@ class RowDictMapper():
         custom_endpoint = self  # TODO just use self
         if current_endpoint is not None:
             custom_endpoint = current_endpoint
+        if lookup_cache is None:
+            lookup_cache = {}
+            if prefetch:
+                custom_endpoint.prefetch_lookups(row_dict = row_dict, session = session, lookup_cache = lookup_cache)
         sql_alchemy_row = custom_endpoint._model_class()     # new instance
         error_count = 0                                     # TODO - dates fail in sqlite
         fields = custom_endpoint.fields
@@ -269,16 +338,12 @@ class RowDictMapper():
         if error_count > 0:
             raise ValueError(" * dict_to_row() failed - see above")
         
-        parent_lookup_list = self.parent_lookups
-        if parent_lookup_list:
-            if isinstance(parent_lookup_list, tuple):
-                parent_lookup_list = []
-                parent_lookup_list.append(self.parent_lookups)
-            for each_parent_lookup in parent_lookup_list:
-                self._parent_lookup_from_child(child_row_dict = row_dict, 
-                                            parent_lookup = each_parent_lookup,
-                                            child_row = sql_alchemy_row,
-                                            session = session)
+        for each_parent_lookup in self._parent_lookup_list():
+            self._parent_lookup_from_child(child_row_dict = row_dict, 
+                                        parent_lookup = each_parent_lookup,
+                                        child_row = sql_alchemy_row,
+                                        session = session,
+                                        lookup_cache = lookup_cache)
         
         custom_endpoint_related_list = custom_endpoint.related
         if isinstance(custom_endpoint_related_list, list) is False:
@@ -292,7 +357,8 @@ class RowDictMapper():
                     self._lookup_parent(child_row_dict = row_dict, 
                                        lookup_parent_endpoint = each_related, 
                                        child_row = sql_alchemy_row,
-                                       session = session)
+                                       session = session,
+                                       lookup_cache = lookup_cache)
             else:
                 if child_property_name in row_dict:
                     row_dict_child_list = row_dict[child_property_name]
@@ -300,47 +366,120 @@ class RowDictMapper():
                     for each_row_dict_child in row_dict_child_list:  # recurse for each_child
                         each_child_row = each_related.dict_to_row(row_dict = each_row_dict_child, 
                                                           session = session,
-                                                          current_endpoint = each_related)
+                                                          current_endpoint = each_related,
+                                                          lookup_cache = lookup_cache)
                         child_list = getattr(sql_alchemy_row, each_related.role_name)
                         child_list.append(each_child_row)
         return sql_alchemy_row
+
+
+    def prefetch_lookups(self, row_dict: dict, session: object, lookup_cache: dict) -> dict:
+        """Resolve every parent lookup in the payload - 1 IN query per parent class / lookup columns
+
+        Results are stored in lookup_cache, as used by dict_to_row.
+        Keys not found are left out, so dict_to_row queries them (and reports missing parents) as usual.
+
+        Args:
+            row_dict (dict): multi-object dict, typically from request data
+            session (object): SqlAlchemy session
+            lookup_cache (dict): parent lookups for this message
+
+        Returns:
+            dict: lookup_cache
+        """
+        wanted = {}  # (parent_class, lookup column keys) => (col_defs, set of value tuples)
+        self._collect_lookups(row_dict = row_dict, wanted = wanted)
+        for (parent_class, col_keys), (col_defs, values) in wanted.items():
+            values = [each_value for each_value in values 
+                      if _lookup_key(parent_class, col_defs, each_value) not in lookup_cache]
+            for offset in range(0, len(values), LOOKUP_CHUNK_SIZE):
+                chunk = values[offset : offset + LOOKUP_CHUNK_SIZE]
+                if len(col_defs) == 1:
+                    criteria = col_defs[0].in_([each_value[0] for each_value in chunk])
+                else:
+                    criteria = sqlalchemy.tuple_(*col_defs).in_(chunk)
+                found = {}
+                for each_parent in session.query(parent_class).filter(criteria):
+                    each_value = tuple(getattr(each_parent, each_col_def.key) for each_col_def in col_defs)
+                    found.setdefault(_lookup_key(parent_class, col_defs, each_value), []).append(each_parent)
+                lookup_cache.update(found)
+            logger.debug(f'prefetch_lookups {parent_class.__name__}: {len(values)} keys')
+        return lookup_cache
+
+
+    def _collect_lookups(self, row_dict: dict, wanted: dict):
+        """ add the lookup values in row_dict (and its children) to wanted """
+        for each_parent_lookup in self._parent_lookup_list():
+            _want(wanted, each_parent_lookup[0], each_parent_lookup[1], row_dict)
+        related_list = self.related if isinstance(self.related, list) else [self.related]
+        for each_related in related_list:
+            if each_related.isParent:
+                if each_related.lookup is not None:
+                    _want(wanted, each_related._model_class, each_related._lookup_fields(), row_dict)
+            elif each_related.alias in row_dict:
+                for each_row_dict_child in row_dict[each_related.alias]:
+                    each_related._collect_lookups(row_dict = each_row_dict_child, wanted = wanted)
+
+
+    def _parent_lookup_list(self) -> list:
+        """ parent_lookups, as a list """
+        if not self.parent_lookups:
+            return []
+        if isinstance(self.parent_lookups, tuple):
+            return [self.parent_lookups]
+        return self.parent_lookups
+
+
+    def _lookup_fields(self) -> list:
+        """ lookup columns ("*" means use fields) """
+        if isinstance(self.lookup, str):
+            return self.fields
+        return self.lookup
+
+
+    def _find_parents(self, session: object, parent_class: DefaultMeta, 
+                      filters: list[tuple[Column, Any]], lookup_cache: dict = None) -> list:
+        """ parent rows matching filters, from lookup_cache when already resolved in this message """
+        key = None
+        if lookup_cache is not None:
+            key = _lookup_key(parent_class, [col_def for col_def, filter_val in filters], 
+                              tuple(filter_val for col_def, filter_val in filters))
+            try:
+                if key in lookup_cache:
+                    return lookup_cache[key]
+            except TypeError:
+                key = None  # non-scalar lookup value - not cached
+        query = session.query(parent_class)
+        for col_def, filter_val in filters:
+            query = query.filter(col_def == filter_val)
+        parent_rows = query.all()
+        if key is not None:
+            lookup_cache[key] = parent_rows
+        return parent_rows
     
 
     def _lookup_parent(self, child_row_dict: dict, child_row: object,
-                      session: object, lookup_parent_endpoint: 'RowDictMapper' = None):
+                      session: object, lookup_parent_endpoint: 'RowDictMapper' = None,
+                      lookup_cache: dict = None):
         """ Used when parent is in related
 
         Args:
-            child_row_dict (dict): _description_
-            child_row (object): _description_
-            session (object): _description_
-            lookup_parent_endpoint (RowDictMapper, optional): _description_. Defaults to None.
+            child_row_dict (dict): the incoming payload
+            child_row (object): row
+            session (object): SqlAlchemy session
+            lookup_parent_endpoint (RowDictMapper, optional): the parent (lookup) mapper. Defaults to None.
+            lookup_cache (dict, optional): parent lookups for this message
 
         Raises:
-            ValueError: _description_
-            ValueError: _description_
+            ValueError: missing parent
+            ValueError: multiple parents
         """
         parent_class = lookup_parent_endpoint._model_class
-        query = session.query(parent_class)
         if lookup_parent_endpoint.lookup is not None:
             if self._model_class.__name__ in ['Product']:
                 logging.debug(f'Lookup {parent_class.__name__} with {lookup_parent_endpoint.lookup}' )
-            lookup_param_fields = lookup_parent_endpoint.lookup
-            if isinstance(lookup_param_fields, str):
-                lookup_param_fields = lookup_parent_endpoint.fields
-            for each_lookup_param_field in lookup_param_fields:
-                attr_name = each_lookup_param_field
-                if isinstance(each_lookup_param_field, tuple):
-                    col_def = each_lookup_param_field[0]
-                    attr_name = each_lookup_param_field[1]
-                else:
-                    col_def = each_lookup_param_field
-                    attr_name = each_lookup_param_field.name
-                filter_parm = child_row_dict[attr_name]
-                filter_val = child_row_dict[attr_name]
-                query = query.filter(col_def == filter_val)
-                pass
-            parent_rows = query.all()
+            filters = _lookup_filters(lookup_parent_endpoint._lookup_fields(), child_row_dict)
+            parent_rows = self._find_parents(session, parent_class, filters, lookup_cache)
             if parent_rows is not None:
                 if len(parent_rows) > 1:
                     raise ValueError('Lookup failed: multiple parents', child_row, str(lookup_parent_endpoint)) 
@@ -353,7 +492,8 @@ class RowDictMapper():
 
     def _parent_lookup_from_child(self, child_row_dict: dict, child_row: object,
                       session: object, 
-                      parent_lookup: tuple[DefaultMeta, list[tuple[Column, str]]]):
+                      parent_lookup: tuple[DefaultMeta, list[tuple[Column, str]]],
+                      lookup_cache: dict = None):
         """ Used from child -- parent_lookups (e,g, B2B Product)
 
         Args:
@@ -361,6 +501,7 @@ class RowDictMapper():
             child_row (object): row
             parent_lookup (tuple[DefaultMeta, list[tuple[Column, str]]]): parent class, list of attrs/json keys
             session (object): SqlAlchemy session
+            lookup_cache (dict, optional): parent lookups for this message
 
         Example lookup_fields (genai_demo/OrderB2B.py):
             parent_lookup = ( models.Customer, [(models.Customer.name, 'Account')] )
@@ -372,24 +513,12 @@ class RowDictMapper():
         """
         parent_class = parent_lookup[0]
         lookup_fields = parent_lookup[1]
-        query = session.query(parent_class)
 
         if parent_class.__name__ in ['Product', 'Customer']:
             logging.debug(f'_parent_lookup_from_child {parent_class.__name__}' )
-        for each_lookup_param_field in lookup_fields:   # e.g, (models.Customer.name, 'Account')
-            attr_name = each_lookup_param_field         #       <col_def>             <filter-val>
-            if isinstance(each_lookup_param_field, tuple):
-                col_def = each_lookup_param_field[0]
-                attr_name = each_lookup_param_field[1]
-            else:
-                col_def = each_lookup_param_field
-                attr_name = each_lookup_param_field.name
-            filter_parm = child_row_dict[attr_name]
-            filter_val = child_row_dict[attr_name]
-            query = query.filter(col_def == filter_val)
-            pass
+        filters = _lookup_filters(lookup_fields, child_row_dict)   # e.g, [(models.Customer.name, <Account value>)]
 
-        parent_rows = query.all()
+        parent_rows = self._find_parents(session, parent_class, filters, lookup_cache)
         if parent_rows is not None:
             if len(parent_rows) > 1:
                 raise ValueError(f'Lookup failed: multiple parents', child_row, parent_class.__name__) 
@@ -413,4 +542,36 @@ class RowDictMapper():
 
             setattr(child_row, parent_accessor, parent_row)
 
-        return
\ No newline at end of file
+        return
+
+
+def _lookup_filters(lookup_fields: list[tuple[Column, str] | Column], row_dict: dict) -> list[tuple[Column, Any]]:
+    """ [(col_def, filter_val)] for lookup fields - tuples are (col_def, json key) """
+    filters = []
+    for each_lookup_param_field in lookup_fields:
+        if isinstance(each_lookup_param_field, tuple):
+            col_def = each_lookup_param_field[0]
+            attr_name = each_lookup_param_field[1]
+        else:
+            col_def = each_lookup_param_field
+            attr_name = each_lookup_param_field.name
+        filters.append((col_def, row_dict[attr_name]))
+    return filters
+
+
+def _lookup_key(parent_class: DefaultMeta, col_defs: list[Column], values: tuple) -> tuple:
+    """ lookup_cache key """
+    return (parent_class, tuple(each_col_def.key for each_col_def in col_defs), values)
+
+
+def _want(wanted: dict, parent_class: DefaultMeta, lookup_fields: list, row_dict: dict):
+    """ note parent_class lookup values in row_dict, for prefetch_lookups """
+    try:
+        filters = _lookup_filters(lookup_fields, row_dict)
+        values = tuple(filter_val for col_def, filter_val in filters)
+        hash(values)
+    except (KeyError, TypeError):
+        return  # missing / non-scalar - left to dict_to_row
+    col_defs = tuple(col_def for col_def, filter_val in filters)
+    key = (parent_class, tuple(each_col_def.key for each_col_def in col_defs))
+    wanted.setdefault(key, (col_defs, set()))[1].add(values)
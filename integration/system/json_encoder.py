@@ -0,0 +1,32 @@
+"""
+JSON for integration messages (Kafka, n8n), without a Flask app context
+
+Values and keys are encoded as flask.jsonify does (eg, Decimal as str, dates as http dates,
+keys sorted), so consumers see the same payloads - less jsonify's trailing newline.
+"""
+import dataclasses
+import datetime
+import decimal
+import json
+import uuid
+from werkzeug.http import http_date
+
+_encoder = json.JSONEncoder(separators=(",", ":"), sort_keys=True, default=lambda value: json_default(value))
+
+
+def dumps(obj: object) -> str:
+    """ compact json string for obj """
+    return _encoder.encode(obj)
+
+
+def json_default(value: object) -> object:
+    """ json for values the json module does not support (as flask's DefaultJSONProvider) """
+    if isinstance(value, datetime.date):
+        return http_date(value)
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    if hasattr(value, "__html__"):
+        return str(value.__html__())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
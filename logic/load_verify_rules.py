@@ -3,10 +3,13 @@
 # It is WebGenAI specific, used only when env var WG_PROJECT is set
 #
 import ast
+import hashlib
 import json
+import linecache
 import logging
 import os
 import sys
+import types
 import safrs
 import subprocess
 from importlib import import_module
@@ -34,6 +37,55 @@ def init_rule():
 
 MANAGER_PATH = "/opt/webgenai/database/manager.py"
 EXPORT_JSON_PATH = os.environ.get("EXPORT_JSON_PATH", "./docs/export/export.json")
+VERIFIED_FILE = "verified.json"
+""" in rule_code_dir: export.json and models.py hashes, and the verification result of each rule (delete to re-verify) """
+RULE_PACKAGE = "wg_rules"
+""" compiled rules are modules in this (in memory) package, so rule names cannot shadow other modules """
+
+manager_batch_script = """
+import json, os, runpy, sys
+manager_path = sys.argv[1]
+sys.path.insert(0, os.path.dirname(manager_path))  # as when manager.py is run as a script
+failures = 0
+for each_args in json.load(sys.stdin):
+    sys.argv = [manager_path] + each_args
+    try:
+        runpy.run_path(manager_path, run_name="__main__")
+    except SystemExit as exc:
+        if exc.code not in (None, 0):
+            failures += 1
+            print(f"manager {each_args} exited with {exc.code}", file=sys.stderr)
+    except Exception as exc:
+        failures += 1
+        print(f"manager {each_args} failed: {type(exc).__name__}: {exc}", file=sys.stderr)
+sys.exit(1 if failures else 0)
+"""
+""" runs manager.py once per args list, in 1 interpreter - exits 1 if any run failed (see stderr) """
+
+export_hash = None
+""" sha256 of the last export.json read """
+
+
+def set_rule_statuses(updates):
+    """
+    Call the manager.py script for many rules, in 1 python process
+
+    Args:
+        updates (list): (rule_id, "--rule-status" | "--rule-error", value) tuples
+    """
+    if not updates:
+        return
+    if not Path(MANAGER_PATH).exists():
+        app_logger.info(f"No manager, can't set rule status / errors: {updates}")
+        return
+    manager_args = [["-R", rule_id, option, value] for rule_id, option, value in updates]
+    result = subprocess.run(["python", "-c", manager_batch_script, MANAGER_PATH],  # the manager's python, as before
+                            input=json.dumps(manager_args), text=True, 
+                            capture_output=True, cwd="/opt/webgenai")
+    if result.returncode != 0:
+        app_logger.warning(f"manager failed to set status / error of rule(s): {result.stderr}")
+        return
+    app_logger.info(f"Set status / error of {len(updates)} rule(s)")
 
 
 def set_rule_status(rule_id, status):
@@ -42,28 +94,14 @@ def set_rule_status(rule_id, status):
     
     (if the status is "active", the manager will remove the rule error)
     """
-    if not Path(MANAGER_PATH).exists():
-        app_logger.info(f"No manager, can't set rule {rule_id} status {status}")
-        return
-    subprocess.run([
-            "python", MANAGER_PATH, 
-            "-R", rule_id,
-            "--rule-status", status],
-            cwd="/opt/webgenai")
+    set_rule_statuses([(rule_id, "--rule-status", status)])
 
 
 def set_rule_error(rule_id, error):
     """
     Call the manager.py script to set the error of a rule
     """
-    if not Path(MANAGER_PATH).exists():
-        app_logger.warning(f"No manager, can't set rule {rule_id} error {error}")
-        return
-    subprocess.check_output([
-                "python", MANAGER_PATH, 
-                "-R", rule_id,
-                "--rule-error", error],
-                cwd="/opt/webgenai")
+    set_rule_statuses([(rule_id, "--rule-error", error)])
 
 
 def check_rule_code_syntax(rule_code):
@@ -74,21 +112,48 @@ def check_rule_code_syntax(rule_code):
         ast.parse(rule_code)
         return rule_code
     except Exception as exc:
-        log.warning(f"Syntax error in rule code '{rule_code}': {exc}")
+        app_logger.warning(f"Syntax error in rule code '{rule_code}': {exc}")
     
     rule_code = rule_code.replace("\\\\", "\\")
     try:
         ast.parse(rule_code)
         return rule_code
     except Exception as exc:
-        log.warning(f"Syntax error in rule code '{rule_code}': {exc}")
+        app_logger.warning(f"Syntax error in rule code '{rule_code}': {exc}")
         return None
 
 
+def compile_rule(module_name, rule_file, rule_code):
+    """
+    Compile the rule (in memory, from its AST) into module module_name (in RULE_PACKAGE), with init_rule()
+
+    The source is registered with linecache, since logicbank uses inspect.
+    """
+    source = rule_import_template.format(rule_code=rule_code)
+    filename = str(rule_file)
+    code = compile(ast.parse(source, filename), filename, "exec")
+    lines = source.splitlines(keepends=True)
+    linecache.cache[filename] = (len(source), None, lines, filename)
+    rule_package = sys.modules.get(RULE_PACKAGE)
+    if rule_package is None:
+        rule_package = sys.modules[RULE_PACKAGE] = types.ModuleType(RULE_PACKAGE)
+        rule_package.__path__ = []
+    rule_module = types.ModuleType(module_name)
+    rule_module.__file__ = filename
+    sys.modules[module_name] = rule_module
+    setattr(rule_package, module_name.rpartition(".")[2], rule_module)
+    exec(code, rule_module.__dict__)
+    if not Path(rule_file).exists() or Path(rule_file).read_text() != source:
+        Path(rule_file).write_text(source)  # for reference, and auto_discovery
+    return rule_module
+
+
 def get_exported_rules(rule_code_dir):
     """
-    Read the exported rules from export.json and write the code to the 
-    rule_code_dir
+    Read the exported rules from export.json and compile the code of each 
+    (copy in rule_code_dir)
+
+    Each rule gets its module_name, and code_hash (for verification results)
     """
     export_file = Path(EXPORT_JSON_PATH)
     if not export_file.exists():
@@ -96,67 +161,132 @@ def get_exported_rules(rule_code_dir):
         return []
 
     try:
-        with open(export_file) as f:
-            export = json.load(f)
+        export_bytes = export_file.read_bytes()
+        export = json.loads(export_bytes)
         rules = export.get("rules", [])
     except Exception as exc:
         app_logger.warning(f"Failed to load rules from {export_file}: {exc}")
         return []
+    global export_hash
+    export_hash = hashlib.sha256(export_bytes).hexdigest()
 
     for rule in rules:
         if rule["status"] == "rejected":
             continue
         rule_file = rule_code_dir / f"{secure_filename(rule['name']).replace('.','_')}.py"
         try:
-            # write current rule to rule_file
-            # (we can't use eval, because logicbank uses inspect)
             rule_code_str = check_rule_code_syntax(rule["code"])
             if not rule_code_str:
                 continue
-            with open(rule_file, "w") as temp_file:
-                rule_code = "\n".join([f"  {code}" for code in rule_code_str.split("\n")])
-                temp_file.write(rule_import_template.format(rule_code=rule_code))
-                temp_file_path = temp_file.name
+            rule_code = "\n".join([f"  {code}" for code in rule_code_str.split("\n")])
             # module_name used to import current rule
-            module_name = Path(temp_file_path).stem
+            module_name = f"{RULE_PACKAGE}.{rule_file.stem}"
+            compile_rule(module_name, rule_file, rule_code)
             rule["module_name"] = module_name
+            rule["code_hash"] = hashlib.sha256(rule_code.encode()).hexdigest()
             app_logger.info(f"{rule['id']} rule file: {rule_file}")
         except Exception as exc:
             app_logger.exception(exc)
-            app_logger.warning(f"Failed to write rule code to {rule_file}: {exc}")
+            app_logger.warning(f"Failed to compile rule code {rule_file}: {exc}")
             
     return rules
 
 
-def verify_rules(rule_code_dir, rule_type="accepted"):
+def get_models_hash():
+    """
+    sha256 of database/models.py - rules verified against other models are verified again
+    """
+    try:
+        return hashlib.sha256(Path(sys.modules["database.models"].__file__).read_bytes()).hexdigest()
+    except Exception as exc:
+        app_logger.warning(f"Failed to read database/models.py, rules will be verified: {exc}")
+        return None
+
+
+def read_verified(rule_code_dir):
+    """
+    Verification results from the last run: {"export_hash": str, "models_hash": str, "rules": {rule id: result}}
+
+    Results are only used if export.json (read by get_exported_rules) and database/models.py are unchanged.
+    """
+    not_verified = {"export_hash": None, "models_hash": None, "rules": {}}
+    try:
+        with open(Path(rule_code_dir) / VERIFIED_FILE) as f:
+            verified = json.load(f)
+    except Exception:
+        return not_verified
+    models_hash = get_models_hash()
+    if export_hash is None or models_hash is None \
+            or verified.get("export_hash") != export_hash or verified.get("models_hash") != models_hash:
+        app_logger.info("export.json or database/models.py changed - verifying rules")
+        return not_verified
+    app_logger.info(f"export.json and database/models.py unchanged - using verification results in {VERIFIED_FILE}")
+    return verified
+
+
+def write_verified(rule_code_dir, verified):
+    try:
+        verified["export_hash"] = export_hash
+        verified["models_hash"] = get_models_hash()
+        with open(Path(rule_code_dir) / VERIFIED_FILE, "w") as f:
+            json.dump(verified, f, indent=4)
+    except Exception as exc:
+        app_logger.warning(f"Failed to save rule verification results: {exc}")
+
+
+def verify_rules(rule_code_dir, rule_type="accepted", rules=None, verified=None, updates=None):
     """
     Verify the rules from export.json and activate them if they pass verification
     
-    Write the rule code to a temporary file and import it as a module
+    Rules are compiled in memory, and imported as modules.
+    Rules unchanged since the last verification (verified, see read_verified) are loaded without re-verifying:
+    init_rule() declares them in the current (declare_logic) activation, as load_active_rules does.
+    Rule status / errors are set in 1 manager call (unless updates is provided, to defer them).
     """
-    rules = get_exported_rules(rule_code_dir)
+    if rules is None:
+        rules = get_exported_rules(rule_code_dir)
+    verified = verified if verified is not None else {"export_hash": None, "models_hash": None, "rules": {}}
+    pending_updates = [] if updates is None else updates
     
     for rule in rules:
         if not rule["status"] == rule_type:
             continue
-        module_name = rule["module_name"]
+        module_name = rule.get("module_name")
+        if module_name is None:
+            continue
+        result = verified["rules"].get(rule["id"])
+        if result is not None and result.get("code_hash") == rule["code_hash"]:
+            if result["status"] == "active":
+                app_logger.info(f"{Fore.GREEN}Loading verified rule {module_name} {rule['id']} {Style.RESET_ALL}")
+                import_module(module_name).init_rule()
+                if rule["status"] != "active":
+                    pending_updates.append((rule["id"], "--rule-status", "active"))
+            else:
+                app_logger.info(f"{Fore.YELLOW}Skipping rule {module_name} {rule['id']} - failed verification: {result['error']}{Style.RESET_ALL}")
+                rule["status"] = "accepted"
+                rule["error"] = result["error"]
+            continue
         app_logger.info(f"\n{Fore.BLUE}Verifying rule: {module_name} - {rule['id']}{Style.RESET_ALL}")
         try:
             rule_module = import_module(module_name)
             rule_module.init_rule()
             LogicBank.activate(session=safrs.DB.session, activator=rule_module.init_rule)
             if rule["status"] != "active":
-                set_rule_status(rule["id"], "active")
+                pending_updates.append((rule["id"], "--rule-status", "active"))
+            verified["rules"][rule["id"]] = {"code_hash": rule["code_hash"], "status": "active", "error": None}
             app_logger.info(f"\n{Fore.GREEN}Activated rule {rule['id']}{Style.RESET_ALL}")
             
         except Exception as exc:
             app_logger.exception(exc)
-            set_rule_error(rule["id"], f"{type(exc).__name__}: {exc}")
+            pending_updates.append((rule["id"], "--rule-error", f"{type(exc).__name__}: {exc}"))
             app_logger.warning(f"{Fore.RED}Failed to verify {rule_type} rule code\n{rule['code']}\n{Fore.YELLOW}{type(exc).__name__}: {exc}{Style.RESET_ALL}")
             app_logger.debug(f"{rule}")
             rule["status"] = "accepted"
             rule["error"] = f"{type(exc).__name__}: {exc}"
+            verified["rules"][rule["id"]] = {"code_hash": rule["code_hash"], "status": "accepted", "error": rule["error"]}
         
+    if updates is None:
+        set_rule_statuses(pending_updates)
     return rules
    
       
@@ -166,6 +296,7 @@ def load_active_rules(rule_code_dir, rules=None):
     """
     if not rules:
         rules = get_exported_rules(rule_code_dir)
+    updates = []
     for rule in rules:
         module_name = rule.get("module_name", None)
         if not rule["status"] == "active" or module_name is None:
@@ -177,7 +308,8 @@ def load_active_rules(rule_code_dir, rules=None):
         except Exception as exc:
             app_logger.exception(exc)
             app_logger.warning(f"{Fore.RED}Failed to load active rule {rule['id']} {rule['code']} {Style.RESET_ALL}")
-            set_rule_error(rule["id"], f"{type(exc).__name__}: {exc}")
+            updates.append((rule["id"], "--rule-error", f"{type(exc).__name__}: {exc}"))
+    set_rule_statuses(updates)
             
 
 def get_project_id():
@@ -197,15 +329,19 @@ def load_verify_rules():
     
     rule_code_dir = Path("./logic/wg_rules") # in the project root
     rule_code_dir.mkdir(parents=True, exist_ok=True)
-    sys.path.append(f"{rule_code_dir}")
     
     app_logger.info(f"Loading rules from {rule_code_dir.resolve()}")
     
     rules = []
     
     if os.environ.get("VERIFY_RULES") == "True":
-        rules = verify_rules(rule_code_dir, rule_type="active")
-        verify_rules(rule_code_dir, rule_type="accepted")
+        rules = get_exported_rules(rule_code_dir)
+        verified = read_verified(rule_code_dir)
+        updates = []
+        verify_rules(rule_code_dir, rule_type="active", rules=rules, verified=verified, updates=updates)
+        verify_rules(rule_code_dir, rule_type="accepted", rules=rules, verified=verified, updates=updates)
+        set_rule_statuses(updates)
+        write_verified(rule_code_dir, verified)
     else:
         try:
             load_active_rules(rule_code_dir, rules)
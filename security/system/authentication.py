@@ -21,6 +21,11 @@ def login():
 """
 
 import logging, sys
+import contextlib
+import os
+import threading
+import time
+from collections import OrderedDict
 from flask import Flask
 from flask import jsonify, request
 from flask_jwt_extended import JWTManager
@@ -32,6 +37,7 @@ import config.config as config
 from config.config import Args
 from security.authentication_provider.abstract_authentication_provider import Abstract_Authentication_Provider
 from flask_cors import CORS, cross_origin
+from sqlalchemy import event
 
 authentication_provider : Abstract_Authentication_Provider = config.Config.SECURITY_PROVIDER  # type: ignore
 # note: direct config access is disparaged, but used since args not set up when this imported
@@ -40,6 +46,14 @@ security_logger = logging.getLogger(__name__)
 
 JWT_EXCLUDE = 'jwt_exclude'
 
+USER_CACHE_SECONDS = float(os.getenv("APILOGICPROJECT_USER_CACHE_SECONDS", "60"))
+""" authenticated users (with roles) are reused this long - 0 to look up the user on every request """
+USER_CACHE_SIZE = 1024
+
+_user_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+""" (jwt subject, token id) => (expires, user), least recently used first """
+_user_cache_lock = threading.Lock()
+
 def jwt_required(*args, **kwargs):
     from flask import request
     _jwt_required_ori = jwt_required_ori(*args, **kwargs)
@@ -124,7 +138,77 @@ def configure_auth(flask_app: Flask, database: object, method_decorators: list[o
     @jwt.user_lookup_loader
     def user_lookup_callback(_jwt_header, jwt_data):
         identity = jwt_data["sub"]
-        return authentication_provider.get_user(identity, jwt_data)
-
+        key = (identity, jwt_data.get("jti"))
+        user = get_cached_user(key)
+        if user is None:
+            user = authentication_provider.get_user(identity, jwt_data)
+            cache_user(key, user)
+        return user
+
+    _invalidate_on_user_changes()
     method_decorators.append(jwt_required())
     security_logger.info("\nAuthentication loaded -- api calls now require authorization header")
+
+
+def get_cached_user(key: tuple) -> object:
+    """ user for (jwt subject, token id), None if not cached or expired """
+    with _user_cache_lock:
+        cached = _user_cache.get(key)
+        if cached is None:
+            return None
+        if cached[0] <= time.monotonic():
+            del _user_cache[key]
+            return None
+        _user_cache.move_to_end(key)
+        return cached[1]
+
+
+def cache_user(key: tuple, user: object):
+    """ retain user for USER_CACHE_SECONDS, dropping the least recently used beyond USER_CACHE_SIZE """
+    if USER_CACHE_SECONDS <= 0 or user is None:
+        return
+    with _user_cache_lock:
+        _user_cache[key] = (time.monotonic() + USER_CACHE_SECONDS, user)
+        _user_cache.move_to_end(key)
+        while len(_user_cache) > USER_CACHE_SIZE:
+            _user_cache.popitem(last=False)
+
+
+def invalidate_user(user_id: str = None):
+    """
+    Drop cached users, so the next request reads the user / roles again
+
+    Args:
+        user_id (str, optional): jwt subject (User.id). Defaults to None (all users).
+    """
+    with _user_cache_lock:
+        if user_id is None:
+            _user_cache.clear()
+            return
+        for each_key in [each_key for each_key in _user_cache if each_key[0] == user_id]:
+            del _user_cache[each_key]
+    security_logger.debug(f"invalidate_user: {user_id}")
+
+
+def _invalidate_on_user_changes():
+    """ User / UserRole / Role changes made through this server (eg, the admin app) invalidate cached users """
+    with contextlib.suppress(ImportError):
+        import database.database_discovery.authentication_models as authentication_models
+        for each_class, listener in ((authentication_models.User, _invalidate_user_id),
+                                     (authentication_models.UserRole, _invalidate_role_user_id),
+                                     (authentication_models.Role, _invalidate_all)):
+            for each_event in ("after_insert", "after_update", "after_delete"):
+                if not event.contains(each_class, each_event, listener):
+                    event.listen(each_class, each_event, listener)
+
+
+def _invalidate_all(mapper, connection, target):
+    invalidate_user()
+
+
+def _invalidate_user_id(mapper, connection, target):
+    invalidate_user(getattr(target, "id", None))
+
+
+def _invalidate_role_user_id(mapper, connection, target):
+    invalidate_user(getattr(target, "user_id", None))
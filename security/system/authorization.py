@@ -9,7 +9,7 @@ and enforcing them using SQLAlchemy
 You typically do not alter this file.
 """
 
-from typing import Dict, Tuple
+from typing import Dict, Optional, Tuple
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import ORMExecuteState
 from sqlalchemy.orm import session
@@ -39,6 +39,9 @@ security_logger.debug(f'\nAuthorization loaded via api_logic_server_run.py -- im
 db = safrs.DB         # Use the safrs.DB, not db!
 session = db.session  # sqlalchemy.orm.scoping.scoped_session
 
+_grant_plans : Dict[tuple, 'GrantPlan'] = {}
+""" (role names, entity name) => GrantPlan; cleared when grants are declared """
+
 
 class Security:
 
@@ -129,6 +132,7 @@ class DefaultRolePermission:
         if self.role_name not in self.grants_by_role:
             DefaultRolePermission.grants_by_role[self.role_name] = []
         DefaultRolePermission.grants_by_role[self.role_name].append( self )
+        _grant_plans.clear()
 
 
 class GlobalFilter():
@@ -260,6 +264,7 @@ class Grant:
             if self._entity_name not in self.grants_by_table:
                 Grant.grants_by_table[self._entity_name] = []
             Grant.grants_by_table[self._entity_name].append( self )
+            _grant_plans.clear()
 
 
     @staticmethod
@@ -273,37 +278,31 @@ class Grant:
 
         u2 is a manager and a tenant
 
+        Permissions and filters for the user's roles / entity are computed once (GrantPlan),
+        and the resulting loader criteria are cached for the request, so this is typically a dict lookup.
+
         Args:
             entity_name (str): class name
-            crud_state (str): _description_
-            orm_execute_state (any, optional): _description_. Defaults to None.
+            crud_state (str): is_select, is_update, is_insert or is_delete
+            orm_execute_state (any, optional): select being executed (None for updates). Defaults to None.
             property_list (any, optional): _description_. Defaults to None.
 
         Raises:
-            GrantSecurityException: _description_
-            GrantSecurityException: _description_
-            GrantSecurityException: _description_
-            GrantSecurityException: _description_
+            GrantSecurityException: user's roles do not have crud_state access to entity_name
         """
         
         if not Args.instance.security_enabled:
             return
         
         user = Security.current_user()
-        sql_select = "not a SELECT"
-        if orm_execute_state is not None:
-            sql_select = str(orm_execute_state.statement)
-            security_logger.info(f"\nSQL Select -- Begin authorization processing for {sql_select}")   
+        if orm_execute_state is not None and security_logger.isEnabledFor(logging.DEBUG):
+            security_logger.debug(f"\nSQL Select -- Begin authorization processing for {orm_execute_state.statement}")   
         
-        can_read = False
-        can_insert = False
-        can_delete = False
-        can_update = False
         super_users = ['sa']  # admin not required here, has role 'sa'
         try:
             from flask import g
-            is_sa = Security.current_user_has_role('sa')
-            if user.id in super_users or is_sa or g.isSA:
+            role_names = Grant.role_names(user)
+            if user.id in super_users or "sa" in role_names or g.isSA:
                 security_logger.debug("super user (e,g, sa) - no grants apply")
                 return
         except Exception as ex:
@@ -311,108 +310,41 @@ class Grant:
                 security_logger.debug(f"no user - ok (eg, system initialization) error: {ex}")
                 return
 
-        grant_list = []
-        """ grant filters or'd into this query; can be > 1, since users have > 1 role, and global tenant filters """
-
-        global_filter_list = []
-        """ global filters and'd onto this query """
-
-        grant_entity = entity_name 
-
-        user_roles_or_public = []
-        ''' if user has no roles, assume public role (if has roles, not public - causes confusion) '''
-        if len(user.UserRoleList) == 0:
-            user_roles_or_public = [DotMap(role_name="public")]
-        else:
-            for each_role in user.UserRoleList:
-                user_roles_or_public.append(each_role)
-                    
-        #########################################
-        # Role crud permissions 
-        #########################################
-        # start out full restricted - any True will turn on access
-        for each_role in DefaultRolePermission.grants_by_role:
-            for each_user_role in user_roles_or_public:
-                if each_user_role.role_name == "sa":
-                    can_read = True
-                    can_insert = True
-                    can_delete = True
-                    can_update = True
-                    security_logger.debug(f"Grant on role sa - all permissions")
-                    break
-                if each_role == each_user_role.role_name:
-                    #if Security.current_user_has_role(each_role):
-                    for grant_role in DefaultRolePermission.grants_by_role[each_role]:
-                        can_read = can_read or grant_role.can_read
-                        can_insert = can_insert or grant_role.can_insert
-                        can_delete = can_delete or grant_role.can_delete
-                        can_update = can_update or grant_role.can_update
-                        security_logger.debug(f"Grant on role: {each_role} Read: {can_read}, Update: {can_update}, Insert: {can_insert}, Delete: {can_delete}")
-                    
-        #########################################
-        # Grants 
-        #########################################
-        if entity_name in Grant.grants_by_table:
-            for each_grant in Grant.grants_by_table[entity_name]:
-                grant_entity = each_grant.entity
-                if each_grant.global_filter is not None:    # Global Filters
-                    excluded_role = False
-                    for each_user_role in user_roles_or_public:
-                        if each_user_role.role_name in each_grant.global_filter.roles_not_filtered:
-                            excluded_role = True
-                            break
-                    if excluded_role == False and each_grant.filter is not None \
-                        and orm_execute_state is not None:
-                        global_filter_list.append(each_grant.filter())
-                        security_logger.info(f"+ Global Filter: {each_grant.filter_debug}")
-                else:                                       # Grant Permissions
-                    for each_user_role in user_roles_or_public:
-                        if each_grant.role_name == each_user_role.role_name:
-                            security_logger.debug(f'Amend Grant for class / role: {entity_name} / {each_grant.role_name} - {each_grant.filter}')
-                            security_logger.debug(f"Grant on entity: {entity_name} Role: {each_user_role.role_name:} Read: {each_grant.can_read}, Update: {each_grant.can_update}, Insert: {each_grant.can_insert}, Delete: {each_grant.can_delete}")
-                            # 
-                            can_read = can_read or each_grant.can_read 
-                            can_insert = can_insert or each_grant.can_insert
-                            can_delete = can_delete or each_grant.can_delete
-                            can_update = can_update or each_grant.can_update
-                                
-                            if each_grant.filter is not None \
-                                and orm_execute_state is not None:
-                                grant_list.append(each_grant.filter())
-                                security_logger.info(f"+ Grant: {each_grant.filter_debug}")
-            security_logger.debug(f"Grants accrued for entity {entity_name}")
-        else:
-            security_logger.debug(f"No Grants for entity {entity_name}")
-            
-        security_logger.debug(f"Security Permissions for user:{user} state:{crud_state}, read:{can_read}, insert:{can_insert}, update:{can_update}, delete:{can_delete}")   
-        
-        if not can_read and crud_state == 'is_select':
-            raise GrantSecurityException(user=user,entity_name=entity_name,access="read")
-        elif not can_update and crud_state == 'is_update':
-                raise GrantSecurityException(user=user,entity_name=entity_name,access="update")
-        elif not can_insert and crud_state == 'is_insert':
-                raise GrantSecurityException(user=user,entity_name=entity_name,access="insert")
-        elif not can_delete and crud_state == 'is_delete':
-                raise GrantSecurityException(user=user,entity_name=entity_name,access="delete")
+        plan = Grant.plan(entity_name, role_names)
+        plan.check(user, entity_name, crud_state)
 
         ##############
         # Apply Grants
         ##############
-        if grant_entity is not None and (grant_list or global_filter_list) and crud_state == "is_select":
-            grants_filter = or_(*grant_list)
-            global_filter = and_(*global_filter_list)
-            orm_execute_state.statement = orm_execute_state.statement.options(
-                with_loader_criteria(grant_entity, grants_filter))
-            orm_execute_state.statement = orm_execute_state.statement.options(
-                with_loader_criteria(grant_entity, global_filter))
-            security_logger.debug(f"Filter(s) applied for entity {entity_name} ") 
-        
-        security_logger.debug(f"+ Authorization complete for user: {user} state:{crud_state}, read:{can_read}, insert:{can_insert}, update:{can_update}, delete:{can_delete}") 
-        sql_select = "not a SELECT"
-        if orm_execute_state is not None:
-            sql_select = str(orm_execute_state.statement)
-        security_logger.info(f"SQL Select: End authorization processing for: {sql_select}")   
+        if orm_execute_state is None or crud_state != "is_select":
+            return
+        criteria_cache = _request_cache()
+        criteria_key = (getattr(user, "id", None), role_names, entity_name)
+        criteria = None if criteria_cache is None else criteria_cache.get(criteria_key)
+        if criteria is None:
+            criteria = plan.criteria()
+            if criteria_cache is not None:
+                criteria_cache[criteria_key] = criteria
+        if criteria:
+            orm_execute_state.statement = orm_execute_state.statement.options(*criteria)
+            if security_logger.isEnabledFor(logging.DEBUG):
+                security_logger.debug(f"SQL Select: End authorization processing for: {orm_execute_state.statement}")
+
+    @staticmethod
+    def role_names(user) -> Tuple[str, ...]:
+        """ user's role names (sorted) - if user has no roles, assume public role (if has roles, not public - causes confusion) """
+        role_names = tuple(sorted({each_role.role_name for each_role in user.UserRoleList}))
+        return role_names or ("public",)
 
+    @staticmethod
+    def plan(entity_name: str, role_names: Tuple[str, ...]) -> 'GrantPlan':
+        """ GrantPlan for these roles on entity_name, computed on first use """
+        key = (role_names, entity_name)
+        plan = _grant_plans.get(key)
+        if plan is None:
+            plan = GrantPlan(entity_name, role_names)
+            _grant_plans[key] = plan
+        return plan
 
 
     @staticmethod
@@ -441,6 +373,88 @@ class Grant:
                     
                 Grant.exec_grants(entity_name=entity_name, crud_state=crud_state, orm_execute_state=None)
 
+
+class GrantPlan():
+    """
+    Effective permissions and filters of 1 entity for a set of roles
+
+    Grants are declared at startup (declare_security.py), so a plan is shared by every user / token with the same roles.
+    Filters are still evaluated per request (see criteria), since they typically reference Security.current_user().
+    """
+
+    __slots__ = ("can_read", "can_insert", "can_update", "can_delete", "entity", "grants", "global_filters")
+
+    def __init__(self, entity_name: str, role_names: Tuple[str, ...]):
+        # start out full restricted - any True will turn on access
+        self.can_read = self.can_insert = self.can_update = self.can_delete = "sa" in role_names
+        self.entity: DeclarativeMeta = None
+        self.grants: list[Grant] = []
+        """ grant filters or'd into this query; can be > 1, since users have > 1 role """
+        self.global_filters: list[Grant] = []
+        """ global (eg, tenant) filters and'd onto this query """
+
+        #########################################
+        # Role crud permissions 
+        #########################################
+        for each_role in role_names:
+            for grant_role in DefaultRolePermission.grants_by_role.get(each_role, []):
+                self.can_read = self.can_read or grant_role.can_read
+                self.can_insert = self.can_insert or grant_role.can_insert
+                self.can_delete = self.can_delete or grant_role.can_delete
+                self.can_update = self.can_update or grant_role.can_update
+
+        #########################################
+        # Grants 
+        #########################################
+        for each_grant in Grant.grants_by_table.get(entity_name, []):
+            self.entity = each_grant.entity
+            if each_grant.global_filter is not None:    # Global Filters
+                excluded_role = any(each_role in each_grant.global_filter.roles_not_filtered for each_role in role_names)
+                if not excluded_role and each_grant.filter is not None:
+                    self.global_filters.append(each_grant)
+                    security_logger.debug(f"+ Global Filter: {each_grant.filter_debug}")
+            elif each_grant.role_name in role_names:    # Grant Permissions
+                self.can_read = self.can_read or each_grant.can_read 
+                self.can_insert = self.can_insert or each_grant.can_insert
+                self.can_delete = self.can_delete or each_grant.can_delete
+                self.can_update = self.can_update or each_grant.can_update
+                if each_grant.filter is not None:
+                    self.grants.append(each_grant)
+                    security_logger.debug(f"+ Grant: {each_grant.filter_debug}")
+        security_logger.debug(f"Security Permissions for entity:{entity_name} roles:{role_names}, read:{self.can_read}, insert:{self.can_insert}, update:{self.can_update}, delete:{self.can_delete}")
+
+    def check(self, user, entity_name: str, crud_state: str):
+        """ raise GrantSecurityException unless these roles have crud_state access """
+        if not self.can_read and crud_state == 'is_select':
+            raise GrantSecurityException(user=user,entity_name=entity_name,access="read")
+        elif not self.can_update and crud_state == 'is_update':
+                raise GrantSecurityException(user=user,entity_name=entity_name,access="update")
+        elif not self.can_insert and crud_state == 'is_insert':
+                raise GrantSecurityException(user=user,entity_name=entity_name,access="insert")
+        elif not self.can_delete and crud_state == 'is_delete':
+                raise GrantSecurityException(user=user,entity_name=entity_name,access="delete")
+
+    def criteria(self) -> tuple:
+        """ with_loader_criteria options for the current user (filters are evaluated now) """
+        options = []
+        if self.grants:
+            options.append(with_loader_criteria(self.entity, or_(*[each_grant.filter() for each_grant in self.grants])))
+        if self.global_filters:
+            options.append(with_loader_criteria(self.entity, and_(*[each_grant.filter() for each_grant in self.global_filters])))
+        return tuple(options)
+
+
+def _request_cache() -> Optional[dict]:
+    """ (user, roles, entity) => loader criteria, for this request - None outside a request (eg, kafka consumers) """
+    try:
+        from flask import g
+        if "grant_criteria" not in g:
+            g.grant_criteria = {}
+        return g.grant_criteria
+    except RuntimeError:
+        return None
+
+
 @event.listens_for(session, 'do_orm_execute')
 def receive_do_orm_execute(orm_execute_state: ORMExecuteState ):
     """listen for the 'do_orm_execute' event from SQLAlchemy
@@ -0,0 +1,223 @@
+"""
+CustomEndpoint root queries: request filters, in-process includes, cursor paging, row serialization
+"""
+import contextlib
+import datetime
+from decimal import Decimal
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("safrs")
+pytest.importorskip("logic_bank")
+
+from sqlalchemy import Column, Date, ForeignKey, Integer, Numeric, String, create_engine, event, select
+from sqlalchemy.orm import Session, declarative_base, load_only, relationship, selectinload, with_loader_criteria
+from safrs.errors import ValidationError
+import api.system.custom_endpoint as custom_endpoint
+from api.system.custom_endpoint import CustomEndpoint, row_serializer
+
+Base = declarative_base()
+
+
+class Patient(Base):
+    __tablename__ = "patient"
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50))
+    age = Column(Integer)
+    ReadingList = relationship("Reading", back_populates="patient")
+
+    _s_type = "Patient"
+
+    @property
+    def jsonapi_id(self):
+        return str(self.id)
+
+    @property
+    def S_CheckSum(self):
+        return f"{self.id}:{self.name}:{self.age}"
+
+    def to_dict(self):
+        return {"name": self.name, "age": self.age}
+
+
+class Reading(Base):
+    __tablename__ = "reading"
+    id = Column(Integer, primary_key=True)
+    patient_id = Column(ForeignKey("patient.id"))
+    reading_value = Column(Numeric(10, 4))
+    reading_date = Column(Date)
+    patient = relationship("Patient", back_populates="ReadingList")
+
+
+PATIENTS = [(1, "Ann", 40), (2, "Bob", 35), (3, "Cy", 40), (4, "Dee", None), (5, "Eve", None),
+            (6, "Fay", 35), (7, None, 40), (8, "Ann", None), (9, "Gus", 52)]
+
+
+@pytest.fixture
+def db_session(monkeypatch):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as a_session:
+        a_session.add_all([Patient(id=id, name=name, age=age) for id, name, age in PATIENTS])
+        a_session.add_all([Reading(id=1, patient_id=1, reading_value=Decimal("120.5"), reading_date=datetime.date(2025, 3, 1)),
+                           Reading(id=2, patient_id=1, reading_value=None, reading_date=None)])
+        a_session.commit()
+        monkeypatch.setattr(custom_endpoint, "session", a_session)
+        yield a_session
+
+
+def endpoint() -> CustomEndpoint:
+    """ root endpoint on Patient, without the safrs model registry """
+    result = object.__new__(CustomEndpoint)
+    result._model_class = Patient
+    result._model_class_name = "Patient"
+    result.order_by = None
+    result.count = None
+    result._cursor = None
+    result.startRecordIndex = 0
+    return result
+
+
+def names(json_result: dict) -> list:
+    return [each["attributes"]["name"] for each in json_result["data"]]
+
+
+def test_filters_are_bound(db_session):
+    assert names(endpoint()._query_jsonapi(include="", filters={'"name"': "'Bob'"})) == ["Bob"]
+    assert names(endpoint()._query_jsonapi(include="", filters={"name": "Bob' or '1'='1"})) == []
+
+
+def test_filter_expression_conditions(db_session):
+    assert names(endpoint()._query_jsonapi(include="", filters=None, filter_="age=40 AND name='Cy'")) == ["Cy"]
+    assert names(endpoint()._query_jsonapi(include="", filters=None, filter_="name='x' or 1=1")) == []
+
+
+@pytest.mark.parametrize("filters, filter_", [
+    ({"nope": "1"}, None),
+    ({"1=1) or (1": "1"}, None),
+    (None, "age > 3"),
+    (None, "nope=1"),
+])
+def test_invalid_filters_are_rejected(db_session, filters, filter_):
+    with pytest.raises(ValidationError):
+        endpoint()._query_jsonapi(include="", filters=filters, filter_=filter_)
+
+
+def page_through(a_session, order_by, limit: int) -> list:
+    """ ids of every page, each page starting at the previous page's cursor """
+    ids, cursor = [], None
+    while True:
+        page_endpoint = endpoint()
+        if cursor is not None:
+            page_endpoint._cursor = CustomEndpoint._decodeCursor(cursor)
+        ids.append([each_row.id for each_row in page_endpoint._page(a_session.query(Patient), limit, 0, order_by)])
+        cursor = page_endpoint.nextCursor
+        if cursor is None:
+            return ids
+
+
+def sorted_ids(*keys) -> list:
+    """ ids of PATIENTS sorted by (index, ascending) keys then id, nulls last """
+    rows = sorted(PATIENTS, key=lambda row: row[0])
+    for index, ascending in reversed(keys):
+        rows = sorted([row for row in rows if row[index] is not None], key=lambda row: row[index], reverse=not ascending) \
+            + [row for row in rows if row[index] is None]
+    return [row[0] for row in rows]
+
+
+@pytest.mark.parametrize("order_by, expected", [
+    ([{"columnName": "age", "ascendent": False}, {"columnName": "name", "ascendent": True}], sorted_ids((2, False), (1, True))),
+    ("age,-name", sorted_ids((2, True), (1, False))),
+    ("-name", sorted_ids((1, False))),
+    ("-id", sorted_ids((0, False))),
+    (None, sorted_ids()),
+])
+@pytest.mark.parametrize("limit", [1, 2, 4])
+def test_cursor_pages_keep_every_sort_key_and_null(db_session, order_by, expected, limit):
+    pages = page_through(db_session, order_by, limit)
+    assert [each_id for each_page in pages for each_id in each_page] == expected
+    assert all(len(each_page) == limit for each_page in pages[:-1])
+
+
+def test_cursor_for_other_sort_is_rejected(db_session):
+    first = endpoint()
+    first._page(db_session.query(Patient), 2, 0, "age")
+    second = endpoint()
+    second._cursor = CustomEndpoint._decodeCursor(first.nextCursor)
+    with pytest.raises(ValidationError):
+        second._page(db_session.query(Patient), 2, 0, None)
+
+
+def old_rows_to_dict(result) -> list:
+    """ rows_to_dict before RowSerializer: the row's __dict__ """
+    rows = []
+    for each_row in result:
+        row_as_dict = {}
+        for a, v, in each_row.__dict__.items():
+            if a != "_sa_instance_state":
+                if isinstance(v, Decimal):
+                    row_as_dict[a] = str(v)
+                elif isinstance(v, datetime.date):
+                    row_as_dict[a] = v.strftime('%Y-%m-%d %H:%M:%S')
+                else:
+                    row_as_dict[a] = v
+        if hasattr(each_row, "id"):
+            with contextlib.suppress(Exception):
+                row_as_dict["id"] = each_row.id
+        rows.append(row_as_dict)
+    return rows
+
+
+def loaded_with_checksum(rows: list) -> list:
+    for each_row in rows:
+        each_row._check_sum_property = each_row.S_CheckSum  # as the loaded_as_persistent listener did
+    return rows
+
+
+@pytest.mark.parametrize("model_class, options", [
+    (Patient, []),
+    (Patient, [selectinload(Patient.ReadingList)]),
+    (Reading, [selectinload(Reading.patient)]),
+])
+def test_row_serializer_matches_row_dict(db_session, model_class, options):
+    rows = db_session.execute(select(model_class).options(*options).order_by(model_class.id)).scalars().all()
+    serializer = row_serializer(model_class)
+    serialized = [serializer(each_row) for each_row in rows]
+    if model_class is Patient:
+        rows = loaded_with_checksum(rows)
+    assert serialized == old_rows_to_dict(rows)
+
+
+def test_partial_select_is_not_lazy_loaded_for_checksum(db_session):
+    statements = []
+    event.listen(db_session.get_bind(), "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    rows = db_session.execute(select(Patient).options(load_only(Patient.name)).order_by(Patient.id)).scalars().all()
+    serializer = row_serializer(Patient, ("id", "name"))
+    serialized = [serializer(each_row) for each_row in rows]
+    assert len(statements) == 1
+    assert serialized[0] == {"id": 1, "name": "Ann"}
+
+
+def test_explain_renders_in_lists():
+    from sqlalchemy.dialects import postgresql
+    from api.system.expression_parser import parseFilter
+    in_filter, _ = parseFilter(Patient, {"@basic_expression": {"lop": "age", "op": "IN", "rop": [35, 40]}}, None)
+    statement = select(Patient).where(custom_endpoint.where_clause(in_filter))
+    sql, params = custom_endpoint.explain_sql(statement, postgresql.dialect())
+    assert sql.startswith("EXPLAIN (FORMAT JSON) SELECT") and "POSTCOMPILE" not in sql
+    assert sorted(value for value in params.values() if value in (35, 40)) == [35, 40]
+
+
+def test_explain_runs_with_the_grants(db_session, monkeypatch):
+    """ the EXPLAIN runs through session.execute, after security's do_orm_execute added the grants """
+    event.listen(db_session, "do_orm_execute", lambda orm_execute_state: setattr(
+        orm_execute_state, "statement", orm_execute_state.statement.options(
+            with_loader_criteria(Patient, Patient.name != "Ann"))))
+    event.listen(db_session, "do_orm_execute", custom_endpoint._explain_plan)
+    explained = []
+    monkeypatch.setattr(custom_endpoint, "explain_sql", lambda statement, dialect: (
+        explained.append(str(statement.compile(dialect=dialect))) or ("SELECT 7", ())))
+    assert db_session.execute(select(Patient), execution_options={custom_endpoint.EXPLAIN_OPTION: True}).scalar() == 7
+    assert "patient.name != " in explained[0]
+    assert len(db_session.execute(select(Patient)).scalars().all()) == 6  # other selects run as usual
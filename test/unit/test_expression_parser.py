@@ -0,0 +1,100 @@
+"""
+Ontimize / JSON:API filters => cached, parameterized SQLAlchemy expressions
+"""
+import datetime
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("safrs")
+
+from sqlalchemy import Column, Date, Integer, String, create_engine, select
+from sqlalchemy.orm import Session, declarative_base
+from safrs import ValidationError
+from api.system.expression_parser import advancedFilter, parseFilter, where_clause
+
+Base = declarative_base()
+
+
+class Patient(Base):
+    __tablename__ = "patient"
+    id = Column(Integer, primary_key=True)
+    name = Column("patient_name", String(50))
+    age = Column(Integer)
+    birth_date = Column(Date)
+
+
+Patient._s_jsonapi_attrs = {"name": Patient.name, "age": Patient.age, "birth_date": Patient.birth_date}
+
+PATIENTS = [(1, "Ann", 40, datetime.date(1985, 1, 2)), (2, "Bob", 35, None), (3, "Cy", None, datetime.date(1990, 6, 1)),
+            (4, "O'Hara", 52, None)]
+
+
+@pytest.fixture(scope="module")
+def db_session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as a_session:
+        a_session.add_all([Patient(id=id, name=name, age=age, birth_date=birth_date)
+                           for id, name, age, birth_date in PATIENTS])
+        a_session.commit()
+        yield a_session
+
+
+def ids(a_session, filter) -> list:
+    return a_session.execute(select(Patient.id).where(where_clause(filter)).order_by(Patient.id)).scalars().all()
+
+
+def basic(expression: dict) -> dict:
+    return {"@basic_expression": expression}
+
+
+@pytest.mark.parametrize("filter, expected", [
+    ({"name": "Ann"}, [1]),
+    ({"PATIENT_NAME": "O'Hara"}, [4]),
+    ({"AGE": None}, [3]),
+    (basic({"lop": "age", "op": ">=", "rop": 40}), [1, 4]),
+    (basic({"lop": {"lop": "name", "op": "LIKE", "rop": "%o%"}, "op": "OR", "rop": {"lop": "age", "op": "LT", "rop": 36}}), [2, 4]),
+    (basic({"lop": {"lop": "age", "op": "NOT_NULL", "rop": ""}, "op": "AND_NOT", "rop": {"lop": "name", "op": "=", "rop": "Bob"}}), [1, 4]),
+    (basic({"lop": "id", "op": "IN", "rop": [1, 3]}), [1, 3]),
+    (basic({"lop": "birth_date", "op": "=", "rop": int(datetime.datetime(1990, 6, 1).timestamp() * 1000)}), [3]),
+    ({"age": 40, "@basic_expression": {"lop": "name", "op": "=", "rop": "Cy"}}, []),
+])
+def test_parse_filter(db_session, filter, expected):
+    compiled, filters = parseFilter(Patient, filter, None)
+    assert ids(db_session, compiled) == expected
+
+
+def test_values_are_bound_and_templates_shared(db_session):
+    first, _ = parseFilter(Patient, {"name": "Ann' or '1'='1"}, None)
+    second, _ = parseFilter(Patient, {"name": "Bob"}, None)
+    assert ids(db_session, first) == []
+    assert ids(db_session, second) == [2]
+    assert first.template is second.template
+    assert first.key != second.key
+
+
+def test_no_filter_is_true(db_session):
+    assert parseFilter(Patient, {}, None)[0] is None
+    assert ids(db_session, None) == [1, 2, 3, 4]
+    assert ids(db_session, "") == [1, 2, 3, 4]
+
+
+@pytest.mark.parametrize("filter", [
+    {"nope": 1},
+    basic({"lop": "age", "op": "BETWEEN", "rop": 1}),
+    basic({"lop": {"lop": "age", "op": "=", "rop": 1}, "op": "=", "rop": {"lop": "age", "op": "=", "rop": 2}}),
+])
+def test_invalid_filter(filter):
+    with pytest.raises(ValidationError):
+        parseFilter(Patient, filter, None)
+
+
+@pytest.mark.parametrize("args, expected", [
+    ({"filter[name]": "'Bob'"}, [2]),
+    ({"filter": '{"lop": "age", "op": "GT", "rop": 36}'}, [1, 4]),
+    ({"page[limit]": "10"}, [1, 2, 3, 4]),
+])
+def test_advanced_filter(db_session, args, expected):
+    expressions, sql_where = advancedFilter(Patient, args)
+    assert expressions == []
+    assert ids(db_session, sql_where) == expected
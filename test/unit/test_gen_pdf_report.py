@@ -0,0 +1,79 @@
+"""
+PDF report rows: grouped reports group by every selected column (as PostgreSQL requires)
+"""
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("safrs")
+pytest.importorskip("reportlab")
+
+from sqlalchemy import Column, Integer, String, create_engine, event
+from sqlalchemy.orm import Session, declarative_base
+import api.system.gen_pdf_report as gen_pdf_report
+
+Base = declarative_base()
+
+
+class Patient(Base):
+    __tablename__ = "patient"
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50))
+    city = Column(String(50))
+    age = Column(Integer)
+
+
+PATIENTS = [(1, "Ann", "Oslo", 40), (2, "Bob", "Oslo", 35), (3, "Ann", "Oslo", 41), (4, "Cy", "Rome", 40),
+            (5, "Ann", "Rome", 40)]
+
+
+@pytest.fixture
+def db_session(monkeypatch):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as a_session:
+        a_session.add_all([Patient(id=id, name=name, city=city, age=age) for id, name, city, age in PATIENTS])
+        a_session.commit()
+        a_session.statements = []
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def keep_statement(conn, cursor, statement, parameters, context, executemany):
+            a_session.statements.append(statement)
+
+        monkeypatch.setattr(gen_pdf_report, "session", a_session)
+        yield a_session
+
+
+def report_spec(**spec) -> dict:
+    return {"entity": "Patient", "title": "Patients", "columns": [("name", "Name"), ("city", "City")], **spec}
+
+
+def group_by(statement: str) -> list:
+    group_by_clause = statement.split("GROUP BY ")[1].split(" ORDER BY ")[0]
+    return [each.strip() for each in group_by_clause.split(",")]
+
+
+def test_grouped_report_groups_by_every_column(db_session):
+    spec = report_spec(groups=["city"], order_by=[{"columnName": "city", "ascendent": True},
+                                                  {"columnName": "name", "ascendent": False},
+                                                  {"columnName": "age", "ascendent": True}])
+    rows = [tuple(each) for each in gen_pdf_report.report_rows(Patient, spec)]
+    assert rows == [("Bob", "Oslo", 1), ("Ann", "Oslo", 2), ("Cy", "Rome", 1), ("Ann", "Rome", 1)]
+    assert group_by(db_session.statements[-1].replace("\n", " ")) == ["patient.name", "patient.city"]
+
+
+def test_group_outside_the_columns_is_grouped_too(db_session):
+    spec = report_spec(columns=[("name", "Name")], groups=["age"])
+    rows = sorted(tuple(each) for each in gen_pdf_report.report_rows(Patient, spec))
+    assert rows == [("Ann", 1), ("Ann", 2), ("Bob", 1), ("Cy", 1)]
+    assert group_by(db_session.statements[-1].replace("\n", " ")) == ["patient.name", "patient.age"]
+
+
+def test_report_without_groups_is_in_key_order(db_session):
+    rows = [tuple(each) for each in gen_pdf_report.report_rows(Patient, report_spec())]
+    assert rows == [(name, city) for _, name, city, _ in PATIENTS]
+
+
+def test_grouped_report_renders(db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(gen_pdf_report, "REPORT_DIR", tmp_path)
+    path = gen_pdf_report.render_report("grouped", Patient, report_spec(groups=["city"]))
+    assert path.read_bytes().startswith(b"%PDF")
@@ -0,0 +1,99 @@
+"""
+ReadingHistory upsert (insert_history): 1 row per patient per day, however readings are dated
+"""
+import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("safrs")
+
+from sqlalchemy import BigInteger, Column, Date, Index, Integer, Numeric, String, Text, create_engine, event, select
+from sqlalchemy.orm import Session, declarative_base
+import api.api_discovery.insert_history as insert_history
+
+Base = declarative_base()
+
+
+class ReadingHistory(Base):
+    """ reading_history, as in devops/medai.sql """
+    __tablename__ = "reading_history"
+    __table_args__ = (Index("reading_history_patient_day", "patient_id", "reading_date", unique=True),)
+    id = Column(BigInteger().with_variant(Integer(), "sqlite"), primary_key=True)
+    patient_id = Column(BigInteger, nullable=False)
+    reading_date = Column(Date, nullable=False)
+    breakfast = Column(Numeric(10, 4))
+    lunch = Column(Numeric(10, 4))
+    dinner = Column(Numeric(10, 4))
+    bedtime = Column(Numeric(10, 4))
+    notes_for_day = Column(Text)
+
+
+class Reading(Base):
+    __tablename__ = "reading"
+    id = Column(BigInteger().with_variant(Integer(), "sqlite"), primary_key=True)
+    patient_id = Column(BigInteger, nullable=False)
+    time_of_reading = Column(String(10), nullable=False)
+    reading_value = Column(Numeric(10, 4))
+    reading_date = Column(Date)
+
+
+@pytest.fixture
+def db_session(monkeypatch):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    monkeypatch.setattr(insert_history, "models", SimpleNamespace(ReadingHistory=ReadingHistory, Reading=Reading))
+    with Session(engine) as a_session:
+        monkeypatch.setattr(insert_history, "session", a_session)
+        yield a_session
+
+
+def history(a_session) -> list:
+    return [(each.patient_id, each.reading_date, each.breakfast, each.lunch, each.dinner, each.bedtime)
+            for each in a_session.execute(select(ReadingHistory).order_by(ReadingHistory.patient_id)).scalars()]
+
+
+def test_same_day_readings_are_one_values_row(db_session):
+    """ datetimes of 1 day fold to 1 VALUES row (Postgres rejects a statement that upserts a row twice) """
+    inserted_rows = []
+
+    @event.listens_for(db_session.get_bind(), "before_cursor_execute")
+    def count_rows(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT INTO reading_history"):
+            inserted_rows.append(len(parameters) // 6)
+
+    morning = datetime.datetime(2025, 3, 16, 7, 30)
+    insert_history.upsert_reading_history([
+        (1, morning, "breakfast", 120),
+        (1, morning.replace(hour=12), "lunch", 140),
+        (1, morning.date(), "dinner", 160),
+        (2, morning, "bedtime", 100),
+    ], db_session)
+    db_session.commit()
+    assert inserted_rows == [2]
+    assert history(db_session) == [
+        (1, morning.date(), Decimal("120"), Decimal("140"), Decimal("160"), None),
+        (2, morning.date(), None, None, None, Decimal("100")),
+    ]
+
+
+def test_upsert_keeps_other_meals(db_session):
+    day = datetime.date(2025, 3, 16)
+    insert_history.upsert_reading_history([(1, day, "breakfast", 120), (1, day, "lunch", 140)], db_session)
+    insert_history.upsert_reading_history([(1, datetime.datetime(2025, 3, 16, 20), "lunch", 150)], db_session)
+    db_session.commit()
+    assert history(db_session) == [(1, day, Decimal("120"), Decimal("150"), None, None)]
+
+
+def test_commit_event_upserts_in_flush(db_session):
+    """ as create_reading: 1 commit per reading, each dated now() """
+    for meal, value in (("breakfast", 110), ("lunch", 130), ("snack", 90), ("bedtime", 150)):
+        reading = Reading(patient_id=3, time_of_reading=meal, reading_value=value,
+                          reading_date=datetime.datetime(2025, 3, 17, 8))
+        db_session.add(reading)
+        insert_history.insert_reading_history(reading, None)
+        db_session.commit()
+    assert history(db_session) == [
+        (3, datetime.date(2025, 3, 17), Decimal("110"), Decimal("130"), None, Decimal("150")),
+    ]
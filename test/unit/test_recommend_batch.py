@@ -0,0 +1,99 @@
+"""
+recommend_batch must emit what recommend_drug emits, row for row - including rows with missing values
+"""
+import random
+from decimal import Decimal
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("safrs")
+pytest.importorskip("logic_bank")
+pd = pytest.importorskip("pandas")
+
+import api.api_discovery.recommend_drug as recommend_drug
+import api.api_discovery.recommend_batch as recommend_batch
+
+TIMES = ("Before_Breakfast", "Before_Lunch", "Before_Dinner")
+
+
+def insulin_rules():
+    rules = []
+    for level in range(60, 420, 20):
+        for each_time in TIMES:
+            rules.append(SimpleNamespace(
+                id=len(rules) + 1, blood_sugar_reading=each_time, blood_sugar_level=level,
+                glargine_before_dinner=level // 20 if each_time == "Before_Breakfast" else None,
+                lispro_before_breakfast=(level // 40) or None,
+                lispro_before_lunch=(level // 50) or None,
+                lispro_before_dinner=(level // 60) or None))
+    return rules
+
+
+def maybe(rnd: random.Random, value):
+    return None if rnd.random() < 0.1 else value
+
+
+def sample_rows(count: int = 400, seed: int = 7) -> list:
+    rnd = random.Random(seed)
+    rows = []
+    for each_id in range(1, count + 1):
+        patient = SimpleNamespace(
+            name=f"p{each_id}",
+            creatine_mg_dl=maybe(rnd, Decimal(rnd.choice(["0.8", "1.0", "1.05", "1.1", "1.5", "2.0", "3.0", "7.0"]))),
+            weight=maybe(rnd, Decimal(rnd.choice(["90", "100", "150", "180", "180.5", "250", "400", "401"]))),
+            hba1c=maybe(rnd, Decimal(rnd.choice(["6.4", "6.5", "8", "9", "9.1", "14", "14.5"]))),
+            PatientMedicationList=[SimpleNamespace(drug_id=7)] if rnd.random() < 0.2 else [])
+        rows.append(SimpleNamespace(
+            id=each_id, patient_id=each_id, patient=patient, reading_date="2025-03-16",
+            breakfast=maybe(rnd, Decimal(rnd.choice(["70", "80", "99.5", "100", "240", "400.9", "401", "600"]))),
+            lunch=maybe(rnd, Decimal(rnd.randint(50, 420))),
+            dinner=maybe(rnd, Decimal(rnd.randint(50, 420))),
+            bedtime=maybe(rnd, Decimal(rnd.choice(["59.5", "80.5", "81.5", "150", "390"])))))
+    return rows
+
+
+def per_row(rows: list, monkeypatch) -> list:
+    emitted = []
+
+    def create_recommendation(row, dosage, drug_id, time_of_reading, logic_row, drug_name):
+        if dosage:
+            emitted.append((row.id, drug_id, time_of_reading, int(dosage)))
+
+    monkeypatch.setattr(recommend_drug, "create_recommendation", create_recommendation)
+    monkeypatch.setattr(recommend_drug, "get_contraindications", lambda logic_row: [])
+    for each_row in rows:
+        try:
+            recommend_drug.recommend_drug(each_row, None, SimpleNamespace(log=lambda msg: None))
+        except TypeError:
+            pass  # None compared - recommend_drug stops here
+    return emitted
+
+
+def batch(rows: list) -> list:
+    frame = pd.DataFrame.from_records([
+        (each.id, each.patient_id, each.reading_date, each.breakfast, each.lunch, each.dinner, each.bedtime,
+         each.patient.creatine_mg_dl, each.patient.weight, each.patient.hba1c,
+         any(med.drug_id == recommend_batch.OZEMPIC_DRUG_ID for med in each.patient.PatientMedicationList))
+        for each in rows], columns=recommend_batch.FRAME_COLUMNS)
+    result = recommend_batch.recommend_batch(frame)
+    return [(int(each.reading_history_id), int(each.drug_id), each.time_of_reading, int(each.dosage))
+            for each in result.itertuples()]
+
+
+def test_batch_matches_recommend_drug(monkeypatch):
+    monkeypatch.setattr(recommend_drug, "_insulin_rule_index", recommend_drug.InsulinRuleIndex(insulin_rules()))
+    rows = sample_rows()
+    expected = per_row(rows, monkeypatch)
+    assert expected  # sample exercises the rules
+    assert batch(rows) == expected
+
+
+def test_missing_values_emit_until_recommend_drug_raises(monkeypatch):
+    monkeypatch.setattr(recommend_drug, "_insulin_rule_index", recommend_drug.InsulinRuleIndex(insulin_rules()))
+    row = sample_rows(count=1)[0]
+    row.breakfast, row.bedtime = Decimal("240"), None
+    row.patient.creatine_mg_dl, row.patient.weight, row.patient.hba1c = Decimal("1.5"), Decimal("90"), None
+    expected = per_row([row], monkeypatch)
+    assert expected == batch([row])
+    assert (1, 6, "breakfast", 10) in expected  # farxiga, before hba1c is compared
@@ -0,0 +1,236 @@
+"""
+RowDictMapper dict_to_row: parent lookups cached per message, prefetched with 1 IN query per parent class
+RowDictMapper row_to_dict: compiled MappingPlan output matches the interpreted row_to_dict
+"""
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("flask_sqlalchemy")
+pytest.importorskip("logic_bank")
+
+import sqlalchemy
+from sqlalchemy import Column, ForeignKey, Integer, String, create_engine, event, inspect, select
+from sqlalchemy.orm import Session, declarative_base, relationship
+import integration.system.RowDictMapper as row_dict_mapper
+from integration.system.RowDictMapper import RowDictMapper
+
+
+class ToDict:
+    def to_dict(self):  # as safrs
+        return {each_attr.key: getattr(self, each_attr.key) for each_attr in inspect(self).mapper.column_attrs}
+
+
+Base = declarative_base(cls=ToDict)
+
+
+class Customer(Base):
+    __tablename__ = "customer"
+    _s_class_name = "Customer"
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50))
+    OrderList = relationship("Order", back_populates="customer")
+
+
+class Product(Base):
+    __tablename__ = "product"
+    _s_class_name = "Product"
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50))
+    size = Column(String(10))
+    OrderDetailList = relationship("OrderDetail", back_populates="product")
+
+
+class Order(Base):
+    __tablename__ = "order"
+    _s_class_name = "Order"
+    id = Column(Integer, primary_key=True)
+    customer_id = Column(ForeignKey("customer.id"))
+    notes = Column(String(50))
+    customer = relationship("Customer", back_populates="OrderList")
+    OrderDetailList = relationship("OrderDetail", back_populates="order")
+
+
+class OrderDetail(Base):
+    __tablename__ = "order_detail"
+    _s_class_name = "OrderDetail"
+    id = Column(Integer, primary_key=True)
+    order_id = Column(ForeignKey("order.id"))
+    product_id = Column(ForeignKey("product.id"))
+    quantity = Column(Integer)
+    order = relationship("Order", back_populates="OrderDetailList")
+    product = relationship("Product", back_populates="OrderDetailList")
+
+
+PRODUCTS = [(1, "Widget", "S"), (2, "Widget", "L"), (3, "Gadget", "S"), (4, "Gizmo", "S"), (5, "Gizmo", "S"),
+            (6, "Sprocket", "M")]
+
+
+@pytest.fixture
+def db_session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as a_session:
+        a_session.add_all([Customer(id=1, name="Alfreds"), Customer(id=2, name="Bottom")])
+        a_session.add_all([Product(id=id, name=name, size=size) for id, name, size in PRODUCTS])
+        a_session.commit()
+        a_session.selects = []
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def count_selects(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith("SELECT"):
+                a_session.selects.append(statement.split("FROM ")[1].split()[0])
+
+        yield a_session
+
+
+def order_mapper(product_lookup: list) -> RowDictMapper:
+    """ Order, Customer by name (parent_lookups), OrderDetails with Product lookup """
+    return RowDictMapper(model_class=Order, alias="Order", fields=[(Order.notes, "Notes")],
+                         parent_lookups=(Customer, [(Customer.name, "Account")]),
+                         related=RowDictMapper(model_class=OrderDetail, alias="Items", role_name="OrderDetailList",
+                                               fields=[(OrderDetail.quantity, "Quantity")],
+                                               related=RowDictMapper(model_class=Product, role_name="product",
+                                                                     lookup=product_lookup)))
+
+
+def order_dict(items: list, account: str = "Alfreds") -> dict:
+    return {"Notes": "rush", "Account": account, "Items": [dict(each_item, Quantity=1) for each_item in items]}
+
+
+BY_NAME = [(Product.name, "ProductName")]
+BY_NAME_AND_SIZE = [(Product.name, "ProductName"), (Product.size, "Size")]
+
+
+def test_prefetch_is_one_query_per_parent_class(db_session):
+    items = [{"ProductName": name} for name in ["Gadget", "Sprocket"] * 50]
+    order = order_mapper(BY_NAME).dict_to_row(row_dict=order_dict(items), session=db_session)
+    assert sorted(db_session.selects) == ["customer", "product"]
+    assert order.customer.name == "Alfreds"
+    assert [each.product.id for each in order.OrderDetailList] == [3, 6] * 50
+
+
+def test_without_prefetch_each_key_is_queried_once(db_session):
+    items = [{"ProductName": name} for name in ["Gadget", "Sprocket", "Gadget", "Sprocket"]]
+    order = order_mapper(BY_NAME).dict_to_row(row_dict=order_dict(items), session=db_session, prefetch=False)
+    assert sorted(db_session.selects) == ["customer", "product", "product"]
+    assert [each.product.id for each in order.OrderDetailList] == [3, 6, 3, 6]
+
+
+def test_multi_column_lookup_is_one_tuple_in(db_session):
+    items = [{"ProductName": "Widget", "Size": "L"}, {"ProductName": "Widget", "Size": "S"},
+             {"ProductName": "Gadget", "Size": "S"}, {"ProductName": "Widget", "Size": "L"}]
+    order = order_mapper(BY_NAME_AND_SIZE).dict_to_row(row_dict=order_dict(items), session=db_session)
+    assert sorted(db_session.selects) == ["customer", "product"]
+    assert [each.product.id for each in order.OrderDetailList] == [2, 1, 3, 2]
+
+
+def test_prefetch_is_chunked(db_session, monkeypatch):
+    monkeypatch.setattr(row_dict_mapper, "LOOKUP_CHUNK_SIZE", 2)
+    items = [{"ProductName": "Widget", "Size": size} for size in ["S", "L"]] + [{"ProductName": "Gadget", "Size": "S"}]
+    order = order_mapper(BY_NAME_AND_SIZE).dict_to_row(row_dict=order_dict(items), session=db_session)
+    assert sorted(db_session.selects) == ["customer", "product", "product"]
+    assert [each.product.id for each in order.OrderDetailList] == [1, 2, 3]
+
+
+def test_shared_lookup_cache_spans_messages(db_session):
+    lookup_cache = {}
+    mapper = order_mapper(BY_NAME)
+    for _ in range(3):
+        mapper.dict_to_row(row_dict=order_dict([{"ProductName": "Gadget"}]), session=db_session, lookup_cache=lookup_cache)
+    assert sorted(db_session.selects) == ["customer", "product"]
+
+
+@pytest.mark.parametrize("items, account, error", [
+    ([{"ProductName": "Nope"}], "Alfreds", "missing parent"),
+    ([{"ProductName": "Gizmo"}], "Alfreds", "multiple parents"),
+    ([{"ProductName": "Gadget"}], "Nobody", "missing parent"),
+])
+def test_lookup_failures_are_reported(db_session, items, account, error):
+    with pytest.raises(ValueError, match=error):
+        order_mapper(BY_NAME).dict_to_row(row_dict=order_dict(items, account), session=db_session)
+
+
+def old_row_to_dict(self: RowDictMapper, row: object, current_endpoint: RowDictMapper = None) -> dict:
+    """ row_to_dict before MappingPlan: the mapper definition, interpreted per row """
+    custom_endpoint = self
+    if current_endpoint is not None:
+        custom_endpoint = current_endpoint
+    row_as_dict = {}
+    if len(self.fields) == 0:
+        row_as_dict = row.to_dict()
+    else:
+        for each_field in custom_endpoint.fields:
+            if isinstance(each_field, tuple):
+                if isinstance(each_field[0], sqlalchemy.orm.attributes.InstrumentedAttribute):
+                    value = getattr(row, each_field[0].name)
+                else:
+                    value = each_field[0]
+                row_as_dict[each_field[1]] = value
+            else:
+                row_as_dict[each_field.name] = getattr(row, each_field.name)
+    custom_endpoint_related_list = custom_endpoint.related
+    if isinstance(custom_endpoint_related_list, list) is False:
+        custom_endpoint_related_list = [custom_endpoint.related]
+    for each_related in custom_endpoint_related_list:
+        child_property_name = each_related.role_name
+        if each_related.isParent:
+            the_parent_to_dict = old_row_to_dict(self, getattr(row, child_property_name), each_related)
+            if each_related.isCombined:
+                row_as_dict.update(the_parent_to_dict)
+            else:
+                row_as_dict[each_related.alias] = the_parent_to_dict
+        else:
+            row_as_dict[each_related.alias] = [old_row_to_dict(self, each_child, each_related)
+                                               for each_child in getattr(row, child_property_name)]
+    return row_as_dict
+
+
+@pytest.fixture
+def orders(db_session) -> list:
+    db_session.add_all([Order(id=1, customer_id=1, notes="rush"), Order(id=2, customer_id=2, notes=None),
+                        Order(id=3, customer_id=1, notes="empty")])
+    db_session.add_all([OrderDetail(id=id, order_id=order_id, product_id=product_id, quantity=quantity)
+                        for id, order_id, product_id, quantity in [(1, 1, 1, 5), (2, 1, 3, 1), (3, 2, 6, None)]])
+    db_session.commit()
+    return db_session.execute(select(Order).order_by(Order.id)).scalars().all()
+
+
+MAPPERS = {
+    "fields, combined and nested parents": lambda: RowDictMapper(
+        model_class=Order, alias="Order", fields=[(Order.id, "OrderId"), Order.notes, ("v1", "Version")],
+        related=[RowDictMapper(model_class=Customer, role_name="customer", alias="Customer", isParent=True,
+                               isCombined=False, fields=[(Customer.name, "Account")]),
+                 RowDictMapper(model_class=OrderDetail, alias="Items", role_name="OrderDetailList",
+                               fields=[(OrderDetail.quantity, "Quantity")],
+                               related=RowDictMapper(model_class=Product, role_name="product", isParent=True,
+                                                     fields=[(Product.name, "ProductName"), Product.size]))]),
+    "child without fields": lambda: RowDictMapper(
+        model_class=Order, alias="Order", fields=[Order.id],
+        related=RowDictMapper(model_class=OrderDetail, alias="Items", role_name="OrderDetailList")),
+    "to_dict": lambda: RowDictMapper(
+        model_class=Order, alias="Order",
+        related=[RowDictMapper(model_class=OrderDetail, alias="Items", role_name="OrderDetailList",
+                               related=RowDictMapper(model_class=Product, role_name="product", isParent=True,
+                                                     isCombined=False))]),
+}
+
+
+@pytest.mark.parametrize("mapper_name", MAPPERS)
+def test_mapping_plan_matches_row_to_dict(orders, mapper_name):
+    mapper = MAPPERS[mapper_name]()
+    expected = [old_row_to_dict(mapper, each_order) for each_order in orders]
+    assert [mapper.row_to_dict(each_order) for each_order in orders] == expected
+    assert mapper.rows_to_dicts(orders) == expected
+    detail_mapper = mapper.related if isinstance(mapper.related, RowDictMapper) else mapper.related[-1]
+    assert [mapper.row_to_dict(each_detail, current_endpoint=detail_mapper) for each_detail in orders[0].OrderDetailList] \
+        == [old_row_to_dict(mapper, each_detail, detail_mapper) for each_detail in orders[0].OrderDetailList]
+
+
+def test_instance_is_shared_and_compiled_once(orders):
+    class OrderMapper(RowDictMapper):
+        def __init__(self):
+            super().__init__(model_class=Order, alias="Order", fields=[Order.id, Order.notes])
+
+    assert OrderMapper.instance() is OrderMapper.instance()
+    assert OrderMapper.instance().mapping_plan() is OrderMapper.instance().mapping_plan()
+    assert OrderMapper.instance().rows_to_dicts(orders) == [old_row_to_dict(OrderMapper(), each) for each in orders]